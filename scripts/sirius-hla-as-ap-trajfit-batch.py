@@ -0,0 +1,57 @@
+#!/usr/bin/env python-sirius
+
+"""Batch Fitting of Recorded Injection Trajectories."""
+
+import logging as _log
+import argparse as _argparse
+
+from siriushlafac.as_ap_trajfit.batch import run_batch
+
+
+def main():
+    """."""
+    parser = _argparse.ArgumentParser(
+        description="Fit recorded injection trajectories in parallel.")
+    parser.add_argument(
+        'acc', type=str, choices=('SI', 'BO', 'si', 'bo'),
+        help='Accelerator.')
+    parser.add_argument(
+        'directory', type=str,
+        help="Directory with .npz files containing 'x', 'y' and 'sum' "
+        "or .trj trajectory recordings.")
+    parser.add_argument(
+        '-o', '--output', type=str, default='trajfit_results.csv',
+        help='Output CSV file.')
+    parser.add_argument(
+        '-p', '--pattern', type=str, nargs='+', default=('*.npz', '*.trj'),
+        help='File name patterns.')
+    parser.add_argument(
+        '-j', '--nrprocs', type=int, default=None,
+        help='Number of processes. Defaults to the number of CPUs.')
+    parser.add_argument(
+        '--tunes', type=float, nargs=2, default=None,
+        metavar=('NUX', 'NUY'), help='Adjust model tunes before fitting.')
+    parser.add_argument(
+        '--tol', type=float, default=100, help='Tolerance [um].')
+    parser.add_argument(
+        '--max-iter', type=int, default=10, help='Number of iterations.')
+    parser.add_argument(
+        '--thres', type=float, default=10.0, help='Min BPM sum [%%].')
+    parser.add_argument(
+        '--unit', type=float, default=1e-6,
+        help='Conversion of x and y to meters. Defaults to 1e-6 (um).')
+    parser.add_argument(
+        '--fast', action='store_true',
+        help='Use response matrix fitting with fallback to full fitting.')
+    args = parser.parse_args()
+
+    _log.basicConfig(level=_log.INFO, format='%(asctime)s %(message)s')
+    run_batch(
+        args.acc.upper(), args.directory, args.output, pattern=args.pattern,
+        nrprocs=args.nrprocs, tunes=args.tunes, unit=args.unit,
+        tol=args.tol*1e-6, max_iter=args.max_iter, thres=args.thres/100,
+        fast_fit=args.fast)
+
+
+if __name__ == '__main__':
+    main()
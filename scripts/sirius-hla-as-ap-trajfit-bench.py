@@ -0,0 +1,57 @@
+#!/usr/bin/env python-sirius
+
+"""Offline Benchmark of Injection Trajectory Fitting."""
+
+import argparse as _argparse
+
+from siriushlafac.as_ap_trajfit.benchmark import run_benchmark, \
+    DEFAULT_NOISES, DEFAULT_THRESHOLDS
+
+
+def main():
+    """."""
+    parser = _argparse.ArgumentParser(
+        description="Benchmark trajectory fitting with simulated data.")
+    parser.add_argument(
+        '-a', '--accs', type=str, nargs='+', default=['SI', 'BO'],
+        choices=('SI', 'BO'), help='Accelerators.')
+    parser.add_argument(
+        '-o', '--output', type=str, default='trajfit_benchmark.json',
+        help='Output JSON file.')
+    parser.add_argument(
+        '-n', '--nrpts', type=int, default=5,
+        help='Simulated trajectories per grid point.')
+    parser.add_argument(
+        '--noises', type=float, nargs='+',
+        default=[v*1e6 for v in DEFAULT_NOISES], help='BPM noise [um].')
+    parser.add_argument(
+        '--thres', type=float, nargs='+',
+        default=[v*100 for v in DEFAULT_THRESHOLDS],
+        help='Min BPM sum [%%].')
+    parser.add_argument(
+        '-b', '--backends', type=str, nargs='*', default=[],
+        choices=('matplotlib', 'pyqtgraph'),
+        help='Also time window updates with these plotting backends.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        accs=args.accs, noises=[v*1e-6 for v in args.noises],
+        thresholds=[v/100 for v in args.thres], nrpts=args.nrpts,
+        backends=args.backends, output=args.output, seed=args.seed)
+
+    for acc, res in report['results'].items():
+        print(f'{acc}:')
+        print(f'  model creation: {res["time_model"]*1e3:8.1f} ms')
+        print(f'  response mat.:  {res["time_respmat"]*1e3:8.1f} ms')
+        tim = res['time_do_fitting']['mean']
+        print(f'  do_fitting:     {tim*1e3:8.2f} ms')
+        tim = res['time_fast_fit']['mean']
+        print(f'  fast fit:       {tim*1e3:8.2f} ms')
+        for backend, tim in res['window_update'].items():
+            print(f'  update ({backend}): {tim["mean"]*1e3:8.2f} ms')
+    print(f'Report saved in {args.output}')
+
+
+if __name__ == '__main__':
+    main()
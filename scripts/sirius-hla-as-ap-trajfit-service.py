@@ -0,0 +1,52 @@
+#!/usr/bin/env python-sirius
+
+"""Injection Trajectory Fitting Service."""
+
+import logging as _log
+import argparse as _argparse
+
+from siriushlafac.as_ap_trajfit.service import FitService, get_address
+
+
+def main():
+    """."""
+    parser = _argparse.ArgumentParser(
+        description="Fit SOFB trajectory of each shot and publish results "
+        "to the trajectory fitting interfaces in viewer mode.")
+    parser.add_argument(
+        'acc', type=str, choices=('SI', 'BO', 'si', 'bo'),
+        help='Accelerator.')
+    parser.add_argument(
+        '--host', type=str, default='localhost',
+        help="Interface to listen on. Use '' for all interfaces.")
+    parser.add_argument(
+        '--port', type=int, default=None, help='Port to listen on.')
+    parser.add_argument(
+        '--tunes', type=float, nargs=2, default=None,
+        metavar=('NUX', 'NUY'), help='Adjust model tunes before fitting.')
+    parser.add_argument(
+        '--tol', type=float, default=100, help='Tolerance [um].')
+    parser.add_argument(
+        '--max-iter', type=int, default=10, help='Number of iterations.')
+    parser.add_argument(
+        '--thres', type=float, default=10.0, help='Min BPM sum [%%].')
+    parser.add_argument(
+        '--max-rate', type=float, default=10.0,
+        help='Maximum fitting rate [Hz]. Use 0 for no limit.')
+    parser.add_argument(
+        '--fast', action='store_true',
+        help='Use response matrix fitting with fallback to full fitting.')
+    args = parser.parse_args()
+
+    _log.basicConfig(level=_log.INFO, format='%(asctime)s %(message)s')
+    acc = args.acc.upper()
+    service = FitService(
+        acc, address=get_address(acc, args.host, args.port),
+        tunes=args.tunes, fast_fit=args.fast, tol=args.tol*1e-6,
+        max_iter=args.max_iter, thres=args.thres/100,
+        max_rate=args.max_rate)
+    service.run()
+
+
+if __name__ == '__main__':
+    main()
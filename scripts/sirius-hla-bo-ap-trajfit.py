@@ -8,12 +8,36 @@ import argparse as _argparse
 from siriushla.sirius_application import SiriusApplication
 
 from siriushlafac.as_ap_trajfit import ASFitTrajWindow
+from siriushlafac.as_ap_trajfit.service import get_address
 
 
-parser = _argparse.ArgumentParser(
-    description="Run Injection Trajectory Fitting Interface.")
-args = parser.parse_args()
+def main():
+    """."""
+    parser = _argparse.ArgumentParser(
+        description="Run Injection Trajectory Fitting Interface.")
+    parser.add_argument(
+        '-b', '--backend', type=str, default='matplotlib',
+        choices=ASFitTrajWindow.BACKENDS, help='Plotting backend.')
+    parser.add_argument(
+        '-v', '--viewer', action='store_true',
+        help='Only show results of the fitting service.')
+    parser.add_argument(
+        '--host', type=str, default='localhost', help='Fitting service host.')
+    parser.add_argument(
+        '--port', type=int, default=None, help='Fitting service port.')
+    parser.add_argument(
+        '-r', '--replay', type=str, default=None, metavar='FILE',
+        help='Open recording of SOFB trajectories, without connecting '
+        'to SOFB.')
+    args = parser.parse_args()
 
-app = SiriusApplication()
-app.open_window(ASFitTrajWindow, acc='BO', parent=None)
-sys.exit(app.exec_())
+    app = SiriusApplication()
+    app.open_window(
+        ASFitTrajWindow, acc='BO', parent=None, backend=args.backend,
+        viewer=args.viewer, address=get_address('BO', args.host, args.port),
+        isonline=args.replay is None, replay=args.replay)
+    sys.exit(app.exec_())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python-sirius
+
+"""Batch Reprocessing of Archived Coupling Measurements."""
+
+import logging as _log
+import argparse as _argparse
+
+from siriushlafac.si_ap_coupling_meas.batch import run_batch, plot_trend
+
+
+def main():
+    """."""
+    parser = _argparse.ArgumentParser(
+        description="Reprocess coupling measurements in parallel.")
+    parser.add_argument(
+        'directory', type=str,
+        help='Directory searched recursively for .npz and .pickle files.')
+    parser.add_argument(
+        '-o', '--output', type=str, default='coupling_trend.csv',
+        help='Output CSV file.')
+    parser.add_argument(
+        '--plot', type=str, default='coupling_trend.png',
+        help='Output trend plot. Use an empty string to skip it.')
+    parser.add_argument(
+        '-j', '--nrprocs', type=int, default=None,
+        help='Number of processes. Defaults to the number of CPUs.')
+    parser.add_argument(
+        '--coupling-resolution', type=float, default=None,
+        help='Coupling resolution [%%]. Defaults to the value of each file.')
+    args = parser.parse_args()
+
+    _log.basicConfig(level=_log.INFO, format='%(asctime)s %(message)s')
+    coup_res = args.coupling_resolution
+    rows = run_batch(
+        args.directory, args.output, nrprocs=args.nrprocs,
+        coupling_resolution=None if coup_res is None else coup_res/100)
+    if rows and args.plot:
+        plot_trend(rows, args.plot)
+
+
+if __name__ == '__main__':
+    main()
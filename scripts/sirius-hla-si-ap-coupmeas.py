@@ -10,10 +10,16 @@ from siriushla.sirius_application import SiriusApplication
 from siriushlafac.si_ap_coupling_meas import SICoupMeasWindow
 
 
-parser = _argparse.ArgumentParser(
-    description="Run Coupling Measurement Interface.")
-args = parser.parse_args()
+def main():
+    """."""
+    parser = _argparse.ArgumentParser(
+        description="Run Coupling Measurement Interface.")
+    parser.parse_args()
 
-app = SiriusApplication()
-app.open_window(SICoupMeasWindow, parent=None)
-sys.exit(app.exec_())
+    app = SiriusApplication()
+    app.open_window(SICoupMeasWindow, parent=None)
+    sys.exit(app.exec_())
+
+
+if __name__ == '__main__':
+    main()
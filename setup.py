@@ -35,7 +35,11 @@ setup(
     scripts=[
         'scripts/sirius-hla-bo-ap-trajfit.py',
         'scripts/sirius-hla-si-ap-trajfit.py',
+        'scripts/sirius-hla-as-ap-trajfit-batch.py',
+        'scripts/sirius-hla-as-ap-trajfit-bench.py',
+        'scripts/sirius-hla-as-ap-trajfit-service.py',
         'scripts/sirius-hla-si-ap-coupmeas.py',
+        'scripts/sirius-hla-si-ap-coupmeas-batch.py',
         ],
     zip_safe=False,
     )
@@ -0,0 +1,212 @@
+"""Headless fitting of recorded injection trajectories."""
+
+import os as _os
+import csv as _csv
+import glob as _glob
+import time as _time
+import logging as _log
+import multiprocessing as _mp
+
+import numpy as np
+
+from apsuite.optics_analysis import TuneCorr
+
+from .fitting import InjTrajFitter, create_fit_traj, truncate_traj
+from .modeltune import adjust_model_tunes
+from .recorder import TrajRecording
+
+COLUMNS = (
+    'file', 'shot', 'x0[m]', 'xl0[rad]', 'y0[m]', 'yl0[rad]', 'delta',
+    'chi[m]', 'nr_iter', 'method', 'reliable', 'reason')
+
+# Extension of the files of TrajRecorder.
+TRAJ_RECORDING_EXT = '.trj'
+
+# Fitter of each worker process, created by _init_worker.
+_FITTER = None
+_UNIT = 1e-6
+
+
+def create_fitter(acc, tunes=None, tol=100e-6, max_iter=10, thres=0.1,
+                  fast_fit=False, isonline=False):
+    """Create fitter, optionally adjusting the model tunes.
+
+    Args:
+        acc (str): accelerator, 'SI' or 'BO'.
+        tunes (tuple, optional): model tunes (nux, nuy). If None the
+            nominal model is used. Defaults to None.
+        tol (float, optional): fitting tolerance [m]. Defaults to 100e-6.
+        max_iter (int, optional): maximum number of iterations.
+            Defaults to 10.
+        thres (float, optional): minimum BPM sum relative to its maximum.
+            Defaults to 0.1.
+        fast_fit (bool, optional): whether to use the response matrix
+            fitting. Defaults to False.
+        isonline (bool, optional): whether to connect to SOFB.
+            Defaults to False.
+
+    Returns:
+        InjTrajFitter: fitter object.
+
+    """
+    fit_traj = create_fit_traj(acc, isonline=isonline)
+    if tunes is not None:
+        tunecorr = TuneCorr(
+            fit_traj.model, acc, method='Proportional', grouping='TwoKnobs')
+        tunes, *_ = adjust_model_tunes(
+            tunecorr, acc, fit_traj.model, tunes)
+    fitter = InjTrajFitter(fit_traj, acc)
+    fitter.invalidate_respmat(tunes=tunes)
+    fitter.tol = tol
+    fitter.max_iter = max_iter
+    fitter.count_rel_thres = thres
+    fitter.fast_fit = fast_fit
+    return fitter
+
+
+def iter_trajs(fname, unit=1e-6):
+    """Iterate over recorded trajectories of a file.
+
+    Trajectory recordings (.trj files of TrajRecorder) are read frame by
+    frame from the memory map. Other files are loaded as .npz files with
+    the arrays 'x', 'y' and 'sum', with one trajectory per row when more
+    than one shot is stored.
+
+    Args:
+        fname (str): file name.
+        unit (float, optional): conversion factor of x and y to meters.
+            Defaults to 1e-6, the unit of SOFB trajectories.
+
+    Yields:
+        trjx, trjy, trjs (numpy.ndarray): trajectories of each shot.
+
+    """
+    if fname.endswith(TRAJ_RECORDING_EXT):
+        rec = TrajRecording(fname)
+        for idx in range(len(rec)):
+            _, trjx, trjy, trjs = rec.get_frame(idx)
+            yield trjx * unit, trjy * unit, trjs
+        return
+    trjxs, trjys, trjss = load_trajs(fname, unit=unit)
+    yield from zip(trjxs, trjys, trjss)
+
+
+def load_trajs(fname, unit=1e-6):
+    """Load recorded trajectories from a .npz or .trj file.
+
+    Args:
+        fname (str): file name. See iter_trajs for the formats.
+        unit (float, optional): conversion factor of x and y to meters.
+            Defaults to 1e-6, the unit of SOFB trajectories.
+
+    Returns:
+        trjx, trjy, trjs (numpy.ndarray): 2D arrays with one shot per row.
+
+    """
+    if fname.endswith(TRAJ_RECORDING_EXT):
+        trajs = list(iter_trajs(fname, unit=unit))
+        if not trajs:
+            raise ValueError(f'{fname} has no frames.')
+        trjx, trjy, trjs = zip(*trajs)
+        return np.array(trjx), np.array(trjy), np.array(trjs)
+    with np.load(fname) as data:
+        trjx = np.atleast_2d(data['x']) * unit
+        trjy = np.atleast_2d(data['y']) * unit
+        trjs = np.atleast_2d(data['sum'])
+    return trjx, trjy, trjs
+
+
+def fit_file(fitter, fname, unit=1e-6):
+    """Fit all shots of a file.
+
+    Args:
+        fitter (InjTrajFitter): fitter object.
+        fname (str): file name.
+        unit (float, optional): conversion factor of x and y to meters.
+            Defaults to 1e-6.
+
+    Returns:
+        list: one row per shot, following COLUMNS.
+
+    """
+    rows = []
+    for shot, trajs in enumerate(iter_trajs(fname, unit=unit)):
+        trjx, trjy, trjs = truncate_traj(*trajs, fitter.count_rel_thres)
+        try:
+            res = fitter.fit(trjx, trjy, trjs)
+        except Exception as err:
+            rows.append(
+                [fname, shot] + [np.nan]*6 + [0, '', False, str(err)])
+            continue
+        rows.append(
+            [fname, shot] + list(res['vec']) + [
+                res['chi'], res['nr_iter'], res['method'],
+                not res['unreliable'], res['unreliable']])
+    return rows
+
+
+def _init_worker(acc, tunes, fitter_kws, unit):
+    global _FITTER, _UNIT
+    _FITTER = create_fitter(acc, tunes=tunes, **fitter_kws)
+    _UNIT = unit
+
+
+def _fit_file_worker(fname):
+    try:
+        return fit_file(_FITTER, fname, unit=_UNIT)
+    except Exception as err:
+        return [[fname, -1] + [np.nan]*6 + [0, '', False, str(err)]]
+
+
+def run_batch(acc, directory, output, pattern=('*.npz', '*.trj'),
+              nrprocs=None, tunes=None, unit=1e-6, **fitter_kws):
+    """Fit all recorded trajectories in a directory using a process pool.
+
+    Each worker process builds its own model once and fits whole files.
+
+    Args:
+        acc (str): accelerator, 'SI' or 'BO'.
+        directory (str): directory searched recursively for files.
+        output (str): name of the CSV file with the results table.
+        pattern (str or tuple, optional): file name patterns. Defaults
+            to ('*.npz', '*.trj'), recorded shots and trajectory
+            recordings, whose frames are fitted as shots.
+        nrprocs (int, optional): number of processes. Defaults to the
+            number of CPUs.
+        tunes (tuple, optional): model tunes (nux, nuy). Defaults to None.
+        unit (float, optional): conversion factor of x and y to meters.
+            Defaults to 1e-6.
+        fitter_kws: keyword arguments passed to create_fitter.
+
+    Returns:
+        int: number of fitted shots.
+
+    """
+    if isinstance(pattern, str):
+        pattern = (pattern, )
+    fnames = sorted({
+        fname for pat in pattern for fname in _glob.glob(
+            _os.path.join(directory, '**', pat), recursive=True)})
+    if not fnames:
+        _log.warning('No files found in ' + directory)
+        return 0
+    nrprocs = nrprocs or _os.cpu_count()
+    nrprocs = min(nrprocs, len(fnames))
+    _log.info(f'Fitting {len(fnames):d} files in {nrprocs:d} processes.')
+
+    tini = _time.time()
+    nr_shots = 0
+    ctx = _mp.get_context('spawn')
+    with open(output, 'w', newline='') as fil, ctx.Pool(
+            processes=nrprocs, initializer=_init_worker,
+            initargs=(acc, tunes, fitter_kws, unit)) as pool:
+        writer = _csv.writer(fil)
+        writer.writerow(COLUMNS)
+        results = pool.imap_unordered(_fit_file_worker, fnames)
+        for i, rows in enumerate(results):
+            writer.writerows(rows)
+            nr_shots += len(rows)
+            _log.info(f'{i+1:d}/{len(fnames):d} files done.')
+    _log.info(
+        f'{nr_shots:d} shots fitted in {_time.time()-tini:.1f} s.')
+    return nr_shots
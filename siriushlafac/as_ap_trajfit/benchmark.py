@@ -0,0 +1,227 @@
+"""Offline benchmark of the trajectory fitting pipeline.
+
+Trajectories are simulated with the fitting object itself, so neither
+network nor PVs are needed. For each accelerator the benchmark runs over
+a grid of initial conditions, BPM noise levels and BPM sum thresholds,
+timing do_fitting, calc_traj, the fast fitting and, optionally, the full
+window update of each plotting backend. Accuracy is reported as the
+difference between fitted and true initial conditions.
+"""
+
+import os as _os
+import sys as _sys
+import json as _json
+import time as _time
+import platform as _platform
+import itertools as _itertools
+
+import numpy as np
+
+from .. import __version__
+from .fitting import InjTrajFitter, create_fit_traj, truncate_traj
+from .history import PARAMS
+
+DEFAULT_GRIDS = {
+    'SI': dict(
+        x0=[-8.5e-3, -8.0e-3], xl0=[-0.2e-3, 0.2e-3], y0=[0.0, 0.4e-3],
+        yl0=[0.0], delta=[0.0, 2e-3]),
+    'BO': dict(
+        x0=[-1.0e-3, 1.0e-3], xl0=[-0.2e-3, 0.2e-3], y0=[0.0, 0.4e-3],
+        yl0=[0.0], delta=[0.0, 2e-3]),
+    }
+DEFAULT_NOISES = (0.1e-3, 0.5e-3)
+DEFAULT_THRESHOLDS = (0.1, 0.5)
+
+
+def _stats(values):
+    values = np.asarray(values, dtype=float)
+    if not values.size:
+        return dict()
+    return dict(
+        mean=float(values.mean()), std=float(values.std()),
+        p50=float(np.percentile(values, 50)),
+        p95=float(np.percentile(values, 95)), max=float(values.max()))
+
+
+def _timeit(func, *args, **kwargs):
+    tini = _time.perf_counter()
+    ret = func(*args, **kwargs)
+    return ret, _time.perf_counter() - tini
+
+
+def bench_case(fitter, vec, noise, thres, nrpts=5, tol=100e-6, max_iter=10):
+    """Benchmark fitting of simulated trajectories of one grid point.
+
+    Args:
+        fitter (InjTrajFitter): offline fitter.
+        vec (tuple): true (x0, x0', y0, y0', delta).
+        noise (float): RMS BPM noise [m] in both planes.
+        thres (float): minimum BPM sum relative to its maximum.
+        nrpts (int, optional): number of noisy trajectories. Defaults to 5.
+        tol (float, optional): fitting tolerance [m]. Defaults to 100e-6.
+        max_iter (int, optional): maximum number of iterations.
+            Defaults to 10.
+
+    Returns:
+        case (dict): timings [s], accuracy and convergence statistics.
+        trajs (list): simulated (trjx, trjy, trjs) trajectories.
+
+    """
+    fit_traj = fitter.fit_traj
+    fitter.count_rel_thres = thres
+    fitter.tol = tol
+    fitter.max_iter = max_iter
+    x0, xl0, y0, yl0, delta = vec
+
+    tim_fit, tim_calc, tim_fast = [], [], []
+    errs, errs_fast, chis, iters, unrel, fallback = [], [], [], [], 0, 0
+    trajs = []
+    for _ in range(nrpts):
+        trjx, trjy, trjs = fit_traj.simulate_sofb(
+            x0, xl0, y0=y0, yl0=yl0, delta=delta, errx=noise, erry=noise)
+        trjx, trjy, trjs = truncate_traj(trjx, trjy, trjs, thres)
+        trajs.append((trjx, trjy, trjs))
+
+        (vecs, _, fchis), dtime = _timeit(
+            fit_traj.do_fitting, trjx, trjy, tol=tol, max_iter=max_iter,
+            full=True)
+        tim_fit.append(dtime)
+        unrel += bool(fit_traj.unreliable_fitting())
+        errs.append(np.array(vecs[-1]) - vec)
+        chis.append(fchis[-1])
+        iters.append(len(vecs) - 1)
+
+        _, dtime = _timeit(fit_traj.calc_traj, *vecs[-1], size=trjx.size)
+        tim_calc.append(dtime)
+
+        fitter.fast_fit = True
+        res, dtime = _timeit(fitter.fit, trjx, trjy, trjs)
+        fitter.fast_fit = False
+        tim_fast.append(dtime)
+        errs_fast.append(res['vec'] - vec)
+        fallback += res['method'] != 'fast'
+
+    errs, errs_fast = np.array(errs), np.array(errs_fast)
+    return dict(
+        true_vec=dict(zip(PARAMS, map(float, vec))),
+        noise=noise, thres=thres, nrpts=nrpts,
+        nr_bpms=int(np.mean([trj[0].size for trj in trajs])),
+        time_do_fitting=_stats(tim_fit),
+        time_calc_traj=_stats(tim_calc),
+        time_fast_fit=_stats(tim_fast),
+        error_rms=dict(zip(
+            PARAMS, map(float, np.sqrt((errs**2).mean(axis=0))))),
+        error_rms_fast=dict(zip(
+            PARAMS, map(float, np.sqrt((errs_fast**2).mean(axis=0))))),
+        chi=_stats(chis), nr_iter=_stats(iters),
+        unreliable_frac=unrel/nrpts, fast_fallback_frac=fallback/nrpts,
+        ), trajs
+
+
+def bench_window_update(acc, backend, results, nrpts=20):
+    """Time the window update with fitting results.
+
+    A window is created offline, with a QApplication on the offscreen
+    platform if none exists, and, once its model is loaded, updated with
+    each result in turn, including the processing of the resulting paint
+    events.
+
+    Args:
+        acc (str): accelerator.
+        backend (str): plotting backend.
+        results (list): fitting results as returned by InjTrajFitter.fit.
+        nrpts (int, optional): number of updates. Defaults to 20.
+
+    Returns:
+        dict: timing statistics [s].
+
+    """
+    _os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qtpy.QtWidgets import QApplication
+    from .main import ASFitTrajWindow
+
+    app = QApplication.instance() or QApplication([])
+    win = ASFitTrajWindow(acc=acc, backend=backend, isonline=False)
+    win.show()
+    errors = []
+    win._loader.loadError.connect(errors.append)
+    while not win.ismodel_loaded:
+        if errors:
+            raise RuntimeError('Could not load model: ' + errors[0])
+        app.processEvents()
+        _time.sleep(0.01)
+    times = []
+    for i in range(nrpts):
+        res = results[i % len(results)]
+        tini = _time.perf_counter()
+        win._update_results(res)
+        if backend == 'pyqtgraph':
+            win.fig_widget.repaint()
+        app.processEvents()
+        times.append(_time.perf_counter() - tini)
+    win.close()
+    return _stats(times)
+
+
+def run_benchmark(
+        accs=('SI', 'BO'), grids=None, noises=DEFAULT_NOISES,
+        thresholds=DEFAULT_THRESHOLDS, nrpts=5, backends=(), output=None,
+        seed=0):
+    """Run benchmark suite and optionally save it as JSON.
+
+    Args:
+        accs (tuple, optional): accelerators. Defaults to ('SI', 'BO').
+        grids (dict, optional): grid of initial conditions of each
+            accelerator, in the format of DEFAULT_GRIDS. Defaults to
+            DEFAULT_GRIDS.
+        noises (tuple, optional): BPM noise levels [m].
+        thresholds (tuple, optional): BPM sum thresholds.
+        nrpts (int, optional): trajectories per grid point. Defaults to 5.
+        backends (tuple, optional): plotting backends whose window update
+            will be timed. Defaults to (), which skips the Qt part.
+        output (str, optional): JSON file name. Defaults to None.
+        seed (int, optional): NumPy random seed. Defaults to 0.
+
+    Returns:
+        dict: benchmark report.
+
+    """
+    np.random.seed(seed)
+    grids = grids or DEFAULT_GRIDS
+    report = dict(
+        metadata=dict(
+            siriushlafac=__version__, timestamp=_time.time(),
+            python=_sys.version.split()[0], numpy=np.__version__,
+            platform=_platform.platform(), machine=_platform.machine(),
+            nrpts=nrpts, seed=seed),
+        results=dict())
+    for acc in accs:
+        acc = acc.upper()
+        fit_traj, tim_model = _timeit(create_fit_traj, acc, isonline=False)
+        fitter = InjTrajFitter(fit_traj, acc)
+        _, tim_respmat = _timeit(fitter.respmat.build)
+
+        grid = grids[acc]
+        cases, results = [], []
+        for vals in _itertools.product(*[grid[par] for par in PARAMS]):
+            for noise, thres in _itertools.product(noises, thresholds):
+                case, trajs = bench_case(
+                    fitter, np.array(vals), noise, thres, nrpts=nrpts)
+                cases.append(case)
+                results.append(fitter.fit(*trajs[0]))
+        accrep = dict(
+            time_model=tim_model, time_respmat=tim_respmat, cases=cases,
+            time_do_fitting=_stats(
+                [cas['time_do_fitting']['mean'] for cas in cases]),
+            time_fast_fit=_stats(
+                [cas['time_fast_fit']['mean'] for cas in cases]),
+            window_update=dict())
+        for backend in backends:
+            accrep['window_update'][backend] = bench_window_update(
+                acc, backend, results)
+        report['results'][acc] = accrep
+
+    if output is not None:
+        with open(output, 'w') as fil:
+            _json.dump(report, fil, indent=2)
+    return report
@@ -0,0 +1,342 @@
+"""Injection trajectory fitting decoupled from the graphical interface."""
+
+import time as _time
+from threading import RLock as _RLock
+
+import numpy as np
+
+from apsuite.commisslib.inj_traj_fitting import SIFitInjTraj, \
+    BOFitInjTraj
+
+from ..latency import StageTimer
+from .respmat import TrajRespMat
+
+
+def create_fit_traj(acc, isonline=True):
+    """Create injection trajectory fitting object of the accelerator.
+
+    Args:
+        acc (str): accelerator, 'SI' or 'BO'.
+        isonline (bool, optional): whether to connect to SOFB. Use False
+            to fit recorded or simulated data. Defaults to True.
+
+    Returns:
+        SIFitInjTraj or BOFitInjTraj: fitting object.
+
+    """
+    acc = acc.upper()
+    if acc == 'SI':
+        return SIFitInjTraj(isonline=isonline)
+    elif acc == 'BO':
+        return BOFitInjTraj(isonline=isonline)
+    raise ValueError('acc must be SI or BO.')
+
+
+def get_valid_bpms(trjs, thres):
+    """Mask of the BPMs before the first one with low sum signal.
+
+    Args:
+        trjs (numpy.ndarray): BPM sum signal. If 2D, one shot per row.
+        thres (float): minimum sum relative to its maximum in the shot.
+
+    Returns:
+        numpy.ndarray: boolean mask with the same shape as trjs.
+
+    """
+    trjs = np.asarray(trjs)
+    maxs = np.nanmax(trjs, axis=-1)[..., None]
+    return np.cumprod(trjs >= thres * maxs, axis=-1).astype(bool)
+
+
+def truncate_traj(trjx, trjy, trjs, thres):
+    """Discard BPMs from the first one with low sum signal onwards.
+
+    Args:
+        trjx (numpy.ndarray): horizontal trajectory.
+        trjy (numpy.ndarray): vertical trajectory.
+        trjs (numpy.ndarray): BPM sum signal.
+        thres (float): minimum sum relative to its maximum.
+
+    Returns:
+        trjx, trjy, trjs: truncated trajectories and untouched sum.
+
+    """
+    size = int(get_valid_bpms(trjs, thres).sum())
+    size = min(size, trjx.size, trjy.size)
+    return trjx[:size], trjy[:size], trjs
+
+
+def convert_sofb_traj(trjx, trjy, trjs, thres):
+    """Convert raw SOFB trajectory to the fitting units and truncate it.
+
+    Args:
+        trjx (numpy.ndarray): horizontal trajectory [um].
+        trjy (numpy.ndarray): vertical trajectory [um].
+        trjs (numpy.ndarray): BPM sum signal.
+        thres (float): minimum sum relative to its maximum.
+
+    Returns:
+        trjx, trjy, trjs: truncated trajectories [m] and sum.
+
+    """
+    return truncate_traj(
+        np.asarray(trjx)*1e-6, np.asarray(trjy)*1e-6, np.asarray(trjs),
+        thres)
+
+
+class InjTrajFitter:
+    """Run injection trajectory fits without touching Qt widgets.
+
+    The fitting settings are plain attributes, updated by the GUI thread,
+    so that fits can be executed by worker threads or headless processes.
+
+    When warm_start is enabled each fit is seeded with the last reliable
+    solution instead of the initial guess calculated from the data. If
+    the resulting chi^2 is larger than chi2_jump_factor times the
+    previous one, the seed is discarded and the fit is redone from
+    scratch, which handles abrupt changes in the injection conditions.
+
+    When fast_fit is enabled the trajectory is first fitted with a linear
+    model based on a cached response matrix (see TrajRespMat). The full
+    iterative fitting, seeded with the linear solution, is only performed
+    when the linear fitting residue is larger than the tolerance or the
+    linear fitting is unreliable, that is, it used fewer than
+    MIN_RELIABLE_BPMS BPMs or has parameters beyond VEC_LIMITS.
+
+    The attribute lock is held during fittings and must be held by any
+    code changing the model, so that fittings never see a model in an
+    intermediate state.
+
+    The duration of each fitting stage is recorded by the StageTimer in
+    the attribute timer, when it is enabled.
+    """
+
+    MIN_RELIABLE_BPMS = 10
+    VEC_NAMES = ('x0', "x0'", 'y0', "y0'", 'delta')
+    VEC_LIMITS = np.array([15e-3, 3e-3, 5e-3, 2e-3, 0.03])
+
+    def __init__(self, fit_traj, acc='SI', timer=None):
+        """."""
+        self.fit_traj = fit_traj
+        self.acc = acc.upper()
+        self.tol = 100e-6
+        self.max_iter = 10
+        self.chi2_jump_factor = 4.0
+        self.fast_fit = False
+        self._warm_start = False
+        self._last_vec = None
+        self._last_chi = None
+        self._respmat = TrajRespMat(fit_traj, self.acc)
+        self.lock = _RLock()
+        self.timer = timer or StageTimer()
+
+    @property
+    def warm_start(self):
+        """Whether to seed fits with the previous converged solution."""
+        return self._warm_start
+
+    @warm_start.setter
+    def warm_start(self, value):
+        self._warm_start = bool(value)
+        if not self._warm_start:
+            self.reset_warm_start()
+
+    def reset_warm_start(self):
+        """Forget previous solution, so next fit starts from scratch."""
+        self._last_vec = None
+        self._last_chi = None
+
+    @property
+    def respmat(self):
+        """Response matrix used by the fast fitting."""
+        return self._respmat
+
+    def invalidate_respmat(self, tunes=None):
+        """Discard response matrix. Must be called when the model changes.
+
+        Args:
+            tunes (tuple, optional): new model tunes, used to identify the
+                response matrix saved on disk. If None, the matrix is not
+                persisted. Defaults to None.
+
+        """
+        self._respmat = TrajRespMat(self.fit_traj, self.acc, tunes=tunes)
+
+    def notify_model_changed(self, tunes=None):
+        """Discard all data depending on the model.
+
+        Args:
+            tunes (tuple, optional): new model tunes. Defaults to None.
+
+        """
+        with self.lock:
+            self.invalidate_respmat(tunes=tunes)
+            self.reset_warm_start()
+
+    @property
+    def count_rel_thres(self):
+        """Minimum BPM sum relative to its maximum to consider a BPM."""
+        return self.fit_traj.params.count_rel_thres
+
+    @count_rel_thres.setter
+    def count_rel_thres(self, value):
+        self.fit_traj.params.count_rel_thres = float(value)
+
+    @property
+    def bpmpos(self):
+        """BPM longitudinal positions [m]."""
+        return self.fit_traj.twiss.spos[self.fit_traj.bpm_idx]
+
+    def get_traj(self):
+        """Return trajectory from SOFB.
+
+        Returns:
+            trjx (numpy.ndarray): horizontal trajectory [m].
+            trjy (numpy.ndarray): vertical trajectory [m].
+            trjs (numpy.ndarray): BPM sum signal [counts].
+
+        """
+        with self.timer.stage('get_traj_from_sofb'):
+            return self.fit_traj.get_traj_from_sofb()
+
+    def fit(self, trjx, trjy, trjs):
+        """Fit trajectory and calculate fitted trajectory.
+
+        Args:
+            trjx (numpy.ndarray): horizontal trajectory [m].
+            trjy (numpy.ndarray): vertical trajectory [m].
+            trjs (numpy.ndarray): BPM sum signal [counts].
+
+        Returns:
+            dict: fitting result with keys 'vec' (x0, x0', y0, y0', delta),
+                'chi', 'nr_iter', 'method' ('fast' or 'full'), 'warm_start',
+                'fit_time', 'trjx', 'trjy', 'trjs', 'trjx_fit', 'trjy_fit',
+                'bpmpos', 'unreliable', 'timestamp' and 'tunes', the model
+                tunes (None for the nominal model).
+
+        """
+        with self.lock:
+            tini = _time.time()
+            res = None
+            if self.fast_fit:
+                res = self._do_fast_fitting(trjx, trjy)
+            if res is None or res['chi'] > self.tol or res['unreliable']:
+                seed = None if res is None else res['vec']
+                res = self._do_full_fitting(trjx, trjy, seed)
+            res['fit_time'] = _time.time() - tini
+            res['tunes'] = self._respmat.tunes
+
+        if self._warm_start and not res['unreliable']:
+            self._last_vec, self._last_chi = res['vec'], res['chi']
+        else:
+            self.reset_warm_start()
+
+        res.update(
+            trjx=trjx, trjy=trjy, trjs=trjs, bpmpos=self.bpmpos,
+            timestamp=_time.time())
+        return res
+
+    def get_multiturn_traj(self):
+        """Return multi-turn trajectories from SOFB.
+
+        Returns:
+            trjx (numpy.ndarray): (nturns, nbpm) horizontal trajectories [m].
+            trjy (numpy.ndarray): (nturns, nbpm) vertical trajectories [m].
+            trjs (numpy.ndarray): (nturns, nbpm) BPM sum signal [counts].
+
+        """
+        sofb = self.fit_traj.devices['sofb']
+        nbpm = len(self.fit_traj.bpm_idx)
+        trjx = np.asarray(sofb.mt_trajx).reshape(-1, nbpm) * 1e-6
+        trjy = np.asarray(sofb.mt_trajy).reshape(-1, nbpm) * 1e-6
+        trjs = np.asarray(sofb.mt_sum).reshape(-1, nbpm)
+        return trjx, trjy, trjs
+
+    def fit_batch(self, trjx, trjy, trjs):
+        """Fit many shots or turns at once with the linear model.
+
+        All trajectories are fitted together with stacked linear algebra
+        (see TrajRespMat.fit_batch). BPMs after the first one with sum
+        below count_rel_thres are ignored in each trajectory.
+
+        Args:
+            trjx (numpy.ndarray): (N, nbpm) horizontal trajectories [m].
+            trjy (numpy.ndarray): (N, nbpm) vertical trajectories [m].
+            trjs (numpy.ndarray): (N, nbpm) BPM sum signal [counts].
+
+        Returns:
+            dict: fitting results with keys 'vecs' (N, 5), 'chis' (N, ),
+                'nr_bpms' (N, ), 'converged' (N, ), whether chi is below
+                the tolerance, 'mean' and 'std' (5, ) of the converged
+                shots, and 'fit_time'.
+
+        """
+        tini = _time.time()
+        valid = get_valid_bpms(trjs, self.count_rel_thres)
+        with self.lock:
+            vecs, chis = self._respmat.fit_batch(trjx, trjy, valid=valid)
+        nr_bpms = valid.sum(axis=1)
+        conv = (chis <= self.tol) & (nr_bpms >= self._respmat.MIN_NR_BPMS)
+        sel = vecs[conv] if conv.any() else np.full((1, 5), np.nan)
+        return dict(
+            vecs=vecs, chis=chis, nr_bpms=nr_bpms, converged=conv,
+            mean=sel.mean(axis=0), std=sel.std(axis=0),
+            fit_time=_time.time() - tini)
+
+    def _do_fast_fitting(self, trjx, trjy):
+        try:
+            with self.timer.stage('fast_fit'):
+                vec, chi, trjx_fit, trjy_fit = self._respmat.fit(trjx, trjy)
+        except ValueError:
+            return None
+        return dict(
+            vec=vec, chi=chi, nr_iter=0, method='fast', warm_start=False,
+            trjx_fit=trjx_fit, trjy_fit=trjy_fit,
+            unreliable=self.check_linear_fitting(vec, trjx.size))
+
+    def check_linear_fitting(self, vec, nr_bpms):
+        """Return why a linear fitting is unreliable or '' if it is not.
+
+        Args:
+            vec (numpy.ndarray): fitted (x0, x0', y0, y0', delta).
+            nr_bpms (int): number of BPMs used in the fitting.
+
+        Returns:
+            str: reasons, one per line.
+
+        """
+        reasons = []
+        if nr_bpms < self.MIN_RELIABLE_BPMS:
+            reasons.append(f'Only {nr_bpms:d} BPMs used in linear fitting.')
+        out = np.abs(vec) > self.VEC_LIMITS
+        if out.any():
+            names = ', '.join(np.array(self.VEC_NAMES)[out])
+            reasons.append('Out of range of linear fitting: ' + names + '.')
+        return '\n'.join(reasons)
+
+    def _do_full_fitting(self, trjx, trjy, vec0=None):
+        if vec0 is None and self._warm_start:
+            vec0 = self._last_vec
+        vecs, chis = self._do_fitting(trjx, trjy, vec0)
+        warm = vec0 is not None
+        last_chi = self._last_chi
+        if warm and last_chi is not None and \
+                chis[-1]**2 > self.chi2_jump_factor * last_chi**2:
+            vecs, chis = self._do_fitting(trjx, trjy, None)
+            warm = False
+        vec = np.array(vecs[-1])
+        unreliable = self.fit_traj.unreliable_fitting()
+        with self.timer.stage('calc_traj'):
+            trjx_fit, trjy_fit = self.fit_traj.calc_traj(
+                *vec, size=trjx.size)
+        return dict(
+            vec=vec, chi=chis[-1], nr_iter=len(vecs) - 1, method='full',
+            warm_start=warm, trjx_fit=trjx_fit, trjy_fit=trjy_fit,
+            unreliable=unreliable)
+
+    def _do_fitting(self, trjx, trjy, vec0):
+        with self.timer.stage('do_fitting'):
+            vecs, _, chis = self.fit_traj.do_fitting(
+                trjx, trjy, vec0=vec0, tol=self.tol, max_iter=self.max_iter,
+                full=True)
+        return vecs, chis
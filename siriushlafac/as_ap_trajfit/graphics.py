@@ -0,0 +1,446 @@
+"""Plotting widgets of the Application Interface based on pyqtgraph."""
+
+from contextlib import nullcontext as _nullcontext
+
+import numpy as np
+
+from qtpy.QtCore import QTimer, QRectF
+from qtpy.QtWidgets import QWidget, QGridLayout, QLabel, QSpinBox, \
+    QPushButton, QFileDialog, QHBoxLayout, QComboBox, QProgressBar
+
+import pyqtgraph as pg
+
+from .history import PARAMS
+from .worker import ScanWorker
+
+PARAMS_INDEX = {par: i for i, par in enumerate(PARAMS)}
+
+
+class TrajFitPlotWidget(pg.GraphicsLayoutWidget):
+    """Trajectory, fitting and BPM sum plots updated in place.
+
+    Curves are created once and only have their data replaced on each
+    update. The vertical ranges are recalculated from the data extrema,
+    but only applied when the data leaves the visible range or occupies
+    a small fraction of it, so most updates do not rescale the axes.
+    """
+
+    PADDING = 0.1
+    SHRINK_FRAC = 0.3
+
+    def __init__(self, bpmpos=None, parent=None):
+        """."""
+        super().__init__(parent=parent)
+        self.setBackground('w')
+        self._bpmpos = np.array([]) if bpmpos is None else np.asarray(bpmpos)
+
+        self.plot_x = self.addPlot(row=0, col=0)
+        self.plot_y = self.addPlot(row=1, col=0)
+        self.plot_s = self.addPlot(row=2, col=0)
+        self._ranges = dict()
+        for plt, lab in [
+                (self.plot_x, 'X [mm]'), (self.plot_y, 'Y [mm]'),
+                (self.plot_s, 'Sum [counts]')]:
+            plt.showGrid(x=True, y=True, alpha=0.5)
+            plt.setLabel('left', lab)
+            plt.disableAutoRange()
+            plt.setMouseEnabled(x=True, y=False)
+            self._ranges[plt] = None
+        self.plot_y.setXLink(self.plot_x)
+        self.plot_s.setXLink(self.plot_x)
+        self.plot_x.hideAxis('bottom')
+        self.plot_y.hideAxis('bottom')
+        self.plot_s.setLabel('bottom', 'Position [m]')
+        self.plot_y.addLegend(offset=(-10, 10))
+
+        pen_meas = pg.mkPen('#1f77b4', width=2)
+        pen_fit = pg.mkPen('#ff7f0e', width=1)
+        zer = np.zeros(self._bpmpos.size)
+        opts_meas = dict(
+            pen=pen_meas, symbol='d', symbolSize=7, symbolPen=pen_meas,
+            symbolBrush='#1f77b4')
+        opts_fit = dict(
+            pen=pen_fit, symbol='o', symbolSize=5, symbolPen=pen_fit,
+            symbolBrush='#ff7f0e')
+        self.curve_measx = self.plot_x.plot(self._bpmpos, zer, **opts_meas)
+        self.curve_measy = self.plot_y.plot(
+            self._bpmpos, zer, name='Trajectory', **opts_meas)
+        self.curve_meass = self.plot_s.plot(
+            self._bpmpos, zer, pen=pg.mkPen('k', width=2))
+        self.curve_fitx = self.plot_x.plot(self._bpmpos, zer, **opts_fit)
+        self.curve_fity = self.plot_y.plot(
+            self._bpmpos, zer, name='Fitting', **opts_fit)
+        if self._bpmpos.size:
+            self.set_bpmpos(self._bpmpos)
+        self.set_fitted_params(np.zeros(5))
+
+    def set_bpmpos(self, bpmpos):
+        """Set BPM positions used as abscissa [m]."""
+        self._bpmpos = np.asarray(bpmpos)
+        zer = np.zeros(self._bpmpos.size)
+        for curve in (
+                self.curve_measx, self.curve_measy, self.curve_meass,
+                self.curve_fitx, self.curve_fity):
+            curve.setData(self._bpmpos, zer)
+        self.plot_x.setXRange(self._bpmpos.min(), self._bpmpos.max())
+
+    def set_fitted_params(self, vec):
+        """Show fitted initial conditions in plot titles.
+
+        Args:
+            vec (numpy.ndarray): (x0, x0', y0, y0', delta) in SI units.
+
+        """
+        x, xl, y, yl, de = vec
+        self.plot_x.setTitle(
+            f'x<sub>0</sub> = {x*1e3:.3f}mm &nbsp; '
+            f"x'<sub>0</sub> = {xl*1e3:.3f}mrad &nbsp; "
+            f'δ = {de*100:.2f}%')
+        self.plot_y.setTitle(
+            f'y<sub>0</sub> = {y*1e3:.3f}mm &nbsp; '
+            f"y'<sub>0</sub> = {yl*1e3:.3f}mrad")
+
+    def update_traj(self, trjx, trjy, trjs, trjx_fit, trjy_fit):
+        """Update curves in place.
+
+        Args:
+            trjx (numpy.ndarray): measured horizontal trajectory [m].
+            trjy (numpy.ndarray): measured vertical trajectory [m].
+            trjs (numpy.ndarray): BPM sum signal [counts].
+            trjx_fit (numpy.ndarray): fitted horizontal trajectory [m].
+            trjy_fit (numpy.ndarray): fitted vertical trajectory [m].
+
+        """
+        bpmpos_trun = self._bpmpos[:trjx.size]
+        measx, measy = trjx*1e3, trjy*1e3
+        fitx, fity = trjx_fit*1e3, trjy_fit*1e3
+        self.curve_measx.setData(bpmpos_trun, measx)
+        self.curve_measy.setData(bpmpos_trun, measy)
+        self.curve_meass.setData(self._bpmpos[:trjs.size], trjs)
+        self.curve_fitx.setData(bpmpos_trun, fitx)
+        self.curve_fity.setData(bpmpos_trun, fity)
+        self._autoscale(self.plot_x, measx, fitx)
+        self._autoscale(self.plot_y, measy, fity)
+        self._autoscale(self.plot_s, trjs)
+
+    def _autoscale(self, plt, *data):
+        if not any(dat.size for dat in data):
+            return
+        vmin = min(np.nanmin(dat) for dat in data if dat.size)
+        vmax = max(np.nanmax(dat) for dat in data if dat.size)
+        if not np.isfinite(vmin) or not np.isfinite(vmax):
+            return
+        rng = self._ranges[plt]
+        if rng is not None:
+            lo, hi = rng
+            inside = lo <= vmin and vmax <= hi
+            large = (vmax - vmin) >= self.SHRINK_FRAC * (hi - lo)
+            if inside and large:
+                return
+        pad = self.PADDING * ((vmax - vmin) or abs(vmax) or 1.0)
+        lo, hi = vmin - pad, vmax + pad
+        self._ranges[plt] = (lo, hi)
+        plt.setYRange(lo, hi, padding=0)
+
+
+class FitHistoryWidget(QWidget):
+    """History of fitting results with rolling statistics.
+
+    The plots and statistics are refreshed by a timer, and only when the
+    widget is visible and the history changed, so that the cost does not
+    depend on the fitting rate.
+    """
+
+    LABELS = (
+        ('x<sub>0</sub> [mm]', 1e3), ("x'<sub>0</sub> [mrad]", 1e3),
+        ('y<sub>0</sub> [mm]', 1e3), ("y'<sub>0</sub> [mrad]", 1e3),
+        ('\u03b4 [%]', 1e2), ('\u03c7 [\u03bcm]', 1e6))
+
+    def __init__(self, history, parent=None, update_period=500):
+        """."""
+        super().__init__(parent=parent)
+        self.history = history
+        self._version = -1
+        self._last_dir = ''
+        self.setWindowTitle('Trajectory Fitting History')
+        self._setupui()
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.update_history)
+        self._timer.start(update_period)
+
+    def _setupui(self):
+        lay = QGridLayout(self)
+
+        graph = pg.GraphicsLayoutWidget(self)
+        graph.setBackground('w')
+        self._curves = []
+        self._curves_bad = []
+        self.wid_stats = []
+        plt0 = None
+        for i, (lab, _) in enumerate(self.LABELS):
+            plt = graph.addPlot(
+                row=i, col=0, axisItems={'bottom': pg.DateAxisItem()})
+            plt.showGrid(x=True, y=True, alpha=0.5)
+            plt.setLabel('left', lab)
+            if plt0 is None:
+                plt0 = plt
+            else:
+                plt.setXLink(plt0)
+            if i < len(self.LABELS) - 1:
+                plt.hideAxis('bottom')
+            self._curves.append(plt.plot(
+                [], [], pen=None, symbol='o', symbolSize=4,
+                symbolPen=None, symbolBrush='#1f77b4'))
+            self._curves_bad.append(plt.plot(
+                [], [], pen=None, symbol='x', symbolSize=6,
+                symbolPen=None, symbolBrush='r'))
+            lab_stat = QLabel('- \u00b1 -', self)
+            lay.addWidget(QLabel(lab, self), i+1, 1)
+            lay.addWidget(lab_stat, i+1, 2)
+            self.wid_stats.append(lab_stat)
+        lay.addWidget(graph, 0, 0, len(self.LABELS)+3, 1)
+
+        lay.addWidget(QLabel('<b>Rolling Statistics</b>', self), 0, 1, 1, 2)
+        self.wid_window = QSpinBox(self)
+        self.wid_window.setRange(2, self.history.capacity)
+        self.wid_window.setValue(min(100, self.history.capacity))
+        self.wid_window.valueChanged.connect(self._force_update)
+        self.lab_nrpts = QLabel('', self)
+        row = len(self.LABELS) + 1
+        lay.addWidget(QLabel('Window [# shots]', self), row, 1)
+        lay.addWidget(self.wid_window, row, 2)
+        lay.addWidget(self.lab_nrpts, row+1, 1, 1, 2)
+
+        pbcsv = QPushButton('Export CSV', self)
+        pbcsv.clicked.connect(lambda: self._export('csv'))
+        pbnpz = QPushButton('Export NPZ', self)
+        pbnpz.clicked.connect(lambda: self._export('npz'))
+        pbclr = QPushButton('Clear', self)
+        pbclr.clicked.connect(self._clear)
+        hlay = QHBoxLayout()
+        hlay.addWidget(pbcsv)
+        hlay.addWidget(pbnpz)
+        hlay.addWidget(pbclr)
+        lay.addLayout(hlay, row+2, 1, 1, 2)
+        lay.setColumnStretch(0, 5)
+
+    def _force_update(self):
+        self._version = -1
+        self.update_history()
+
+    def _clear(self):
+        self.history.clear()
+        self.update_history()
+
+    def _export(self, ext):
+        fname, _ = QFileDialog.getSaveFileName(
+            self, caption='Export Fitting History', directory=self._last_dir,
+            filter=f'{ext.upper()} Files (*.{ext})')
+        if not fname:
+            return
+        fname += '' if fname.endswith('.' + ext) else '.' + ext
+        self._last_dir = fname
+        if ext == 'csv':
+            self.history.to_csv(fname)
+        else:
+            self.history.to_npz(fname)
+
+    def update_history(self):
+        """Refresh plots and statistics if the history changed."""
+        if not self.isVisible() or self._version == self.history.version:
+            return
+        self._version = self.history.version
+
+        data = self.history.get_data()
+        tstamp = data['timestamp']
+        vals = np.column_stack([data['vecs'], data['chi']])
+        rel = data['reliable']
+        for i, (_, unit) in enumerate(self.LABELS):
+            self._curves[i].setData(tstamp[rel], vals[rel, i]*unit)
+            self._curves_bad[i].setData(tstamp[~rel], vals[~rel, i]*unit)
+
+        mean, std, nrpts = self.history.calc_stats(
+            last=self.wid_window.value())
+        for lab, (_, unit), ave, sig in zip(
+                self.wid_stats, self.LABELS, mean, std):
+            lab.setText(f'{ave*unit:.3f} \u00b1 {sig*unit:.3f}')
+        self.lab_nrpts.setText(
+            f'{nrpts:d} reliable of last {self.wid_window.value():d} '
+            f'({len(self.history):d} stored)')
+
+
+class ChiLandscapeWidget(QWidget):
+    """Maps of the fitting residue around a fitting solution.
+
+    Shows log10 of the RMS residue on the (x0, x0') and (y0, y0') planes
+    and along delta, as calculated by landscape.LandscapeScanner, with
+    the solution marked. Scans run in a ScanWorker thread.
+    """
+
+    UNITS = dict(x0=1e3, xl0=1e3, y0=1e3, yl0=1e3, delta=1e2)
+    LABELS = dict(
+        x0='x<sub>0</sub> [mm]', xl0="x'<sub>0</sub> [mrad]",
+        y0='y<sub>0</sub> [mm]', yl0="y'<sub>0</sub> [mrad]",
+        delta='\u03b4 [%]')
+    COLORS = [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98),
+              (253, 231, 37)]
+
+    def __init__(self, scanner, parent=None):
+        """."""
+        super().__init__(parent=parent)
+        self.scanner = scanner
+        self._fitres = None
+        self._respmat = None
+        self._lock = _nullcontext()
+        self._worker = None
+        self.setWindowTitle('Fitting Residue Landscape')
+        self._setupui()
+
+    def _setupui(self):
+        lay = QGridLayout(self)
+        graph = pg.GraphicsLayoutWidget(self)
+        graph.setBackground('w')
+        cmap = pg.ColorMap(
+            np.linspace(0, 1, len(self.COLORS)), self.COLORS)
+        lut = cmap.getLookupTable(nPts=256)
+
+        self._images = dict()
+        self._markers = dict()
+        for col, (name, (par0, par1)) in enumerate(
+                (('x', ('x0', 'xl0')), ('y', ('y0', 'yl0')))):
+            plt = graph.addPlot(row=0, col=col)
+            plt.setLabel('bottom', self.LABELS[par0])
+            plt.setLabel('left', self.LABELS[par1])
+            plt.setTitle('log<sub>10</sub>(\u03c7 [\u03bcm])')
+            img = pg.ImageItem(axisOrder='col-major')
+            img.setLookupTable(lut)
+            plt.addItem(img)
+            self._images[name] = img
+            self._markers[name] = plt.plot(
+                [], [], pen=None, symbol='+', symbolSize=14,
+                symbolPen=pg.mkPen('r', width=2))
+        plt = graph.addPlot(row=1, col=0, colspan=2)
+        plt.showGrid(x=True, y=True, alpha=0.5)
+        plt.setLabel('bottom', self.LABELS['delta'])
+        plt.setLabel('left', '\u03c7 [\u03bcm]')
+        self._curve_delta = plt.plot([], [], pen=pg.mkPen('#1f77b4', width=2))
+        self._markers['delta'] = plt.plot(
+            [], [], pen=None, symbol='+', symbolSize=14,
+            symbolPen=pg.mkPen('r', width=2))
+        lay.addWidget(graph, 0, 0, 1, 6)
+
+        self.cbb_method = QComboBox(self)
+        self.cbb_method.addItems(('model', 'linear'))
+        self.cbb_method.setToolTip(
+            'model: trajectories tracked in parallel processes.\n'
+            'linear: response matrix approximation.')
+        self.wid_nrpts = QSpinBox(self)
+        self.wid_nrpts.setRange(5, 201)
+        self.wid_nrpts.setValue(41)
+        self.pusb_scan = QPushButton('Scan', self)
+        self.pusb_scan.clicked.connect(self.start_scan)
+        self.progress = QProgressBar(self)
+        self.lab_status = QLabel('', self)
+        lay.addWidget(QLabel('Method', self), 1, 0)
+        lay.addWidget(self.cbb_method, 1, 1)
+        lay.addWidget(QLabel('Points per Axis', self), 1, 2)
+        lay.addWidget(self.wid_nrpts, 1, 3)
+        lay.addWidget(self.pusb_scan, 1, 4)
+        lay.addWidget(self.progress, 1, 5)
+        lay.addWidget(self.lab_status, 2, 0, 1, 6)
+
+    def set_result(self, fitres, respmat=None, lock=None):
+        """Define fitting result to be scanned.
+
+        Args:
+            fitres (dict): result of InjTrajFitter.fit.
+            respmat (TrajRespMat, optional): response matrix used by the
+                linear method. Defaults to None, which disables it.
+            lock (threading.RLock, optional): lock of the model of
+                respmat, held during linear scans, such as
+                InjTrajFitter.lock. Defaults to None.
+
+        """
+        self._fitres = fitres
+        self._respmat = respmat
+        self._lock = lock or _nullcontext()
+        self.cbb_method.model().item(1).setEnabled(respmat is not None)
+        if respmat is None:
+            self.cbb_method.setCurrentIndex(0)
+
+    def start_scan(self):
+        """Scan residue around the fitting result in a thread."""
+        if self._fitres is None:
+            return
+        if self._worker is not None and self._worker.isRunning():
+            return
+        res, nrpts = self._fitres, self.wid_nrpts.value()
+        respmat, lock = None, _nullcontext()
+        if self.cbb_method.currentText() == 'linear':
+            respmat, lock = self._respmat, self._lock
+
+        def _do_scan(progress):
+            # NOTE: the response matrix may be built from the model here.
+            with lock:
+                return self.scanner.scan(
+                    res['vec'], res['trjx'], res['trjy'], nrpts=nrpts,
+                    respmat=respmat, progress=progress)
+
+        self._worker = ScanWorker(_do_scan, parent=self)
+        self._worker.progressChanged.connect(self._update_progress)
+        self._worker.scanDone.connect(self.update_landscape)
+        self._worker.scanError.connect(
+            lambda err: self.lab_status.setText('Failed: ' + err))
+        self.pusb_scan.setEnabled(False)
+        self._worker.finished.connect(
+            lambda: self.pusb_scan.setEnabled(True))
+        self.progress.setValue(0)
+        self.lab_status.setText('Scanning...')
+        self._worker.start()
+
+    def closeEvent(self, event):
+        """."""
+        if self._worker is not None:
+            self._worker.wait()
+        super().closeEvent(event)
+
+    def _update_progress(self, done, total):
+        self.progress.setMaximum(total)
+        self.progress.setValue(done)
+
+    def update_landscape(self, scan):
+        """Show result of LandscapeScanner.scan."""
+        vec = scan['vec']
+        for name, img in self._images.items():
+            dat = scan[name]
+            (par0, par1), (ax0, ax1) = dat['params'], dat['axes']
+            unit0, unit1 = self.UNITS[par0], self.UNITS[par1]
+            img.setImage(np.log10(np.maximum(dat['chis']*1e6, 1e-3)))
+            dx0 = (ax0[1] - ax0[0]) * unit0
+            dx1 = (ax1[1] - ax1[0]) * unit1
+            img.setRect(QRectF(
+                ax0[0]*unit0 - dx0/2, ax1[0]*unit1 - dx1/2,
+                ax0.size*dx0, ax1.size*dx1))
+            idx0, idx1 = PARAMS_INDEX[par0], PARAMS_INDEX[par1]
+            self._markers[name].setData(
+                [vec[idx0]*unit0], [vec[idx1]*unit1])
+
+        dat = scan['delta']
+        unit = self.UNITS['delta']
+        self._curve_delta.setData(dat['axes'][0]*unit, dat['chis']*1e6)
+        self._markers['delta'].setData(
+            [vec[PARAMS_INDEX['delta']]*unit], [scan['chi']*1e6])
+
+        mins = []
+        for name in ('x', 'y', 'delta'):
+            dat = scan[name]
+            idx = np.unravel_index(np.argmin(dat['chis']), dat['chis'].shape)
+            vals = ', '.join(
+                f'{par}={ax[i]*self.UNITS[par]:.3f}'
+                for par, ax, i in zip(dat['params'], dat['axes'], idx))
+            mins.append(f'{vals} (\u03c7={dat["chis"][idx]*1e6:.1f} um)')
+        self.lab_status.setText(
+            f'{scan["method"].capitalize()} scan in '
+            f'{scan["scan_time"]:.1f} s. '
+            f'\u03c7 at solution: {scan["chi"]*1e6:.1f} um. '
+            'Minima: ' + '; '.join(mins))
@@ -0,0 +1,123 @@
+"""Fixed capacity history of fitting results."""
+
+import numpy as np
+
+PARAMS = ('x0', 'xl0', 'y0', 'yl0', 'delta')
+
+
+class FitHistory:
+    """Ring buffer of the last fitting results.
+
+    Memory is allocated once at creation: appending overwrites the oldest
+    entry when the buffer is full.
+    """
+
+    def __init__(self, capacity=3600):
+        """."""
+        self._capacity = int(capacity)
+        self._vecs = np.full((self._capacity, len(PARAMS)), np.nan)
+        self._chis = np.full(self._capacity, np.nan)
+        self._tstamps = np.full(self._capacity, np.nan)
+        self._reliable = np.zeros(self._capacity, dtype=bool)
+        self._idx = 0
+        self._count = 0
+        self._version = 0
+
+    @property
+    def capacity(self):
+        """."""
+        return self._capacity
+
+    @property
+    def version(self):
+        """Counter incremented at every change of the history."""
+        return self._version
+
+    def __len__(self):
+        """."""
+        return self._count
+
+    def clear(self):
+        """."""
+        self._idx = 0
+        self._count = 0
+        self._version += 1
+
+    def append(self, vec, chi, timestamp, reliable):
+        """Add a fitting result.
+
+        Args:
+            vec (numpy.ndarray): (x0, x0', y0, y0', delta).
+            chi (float): fitting residue [m].
+            timestamp (float): time of the fitting [s].
+            reliable (bool): whether the fitting is reliable.
+
+        """
+        idx = self._idx
+        self._vecs[idx] = vec
+        self._chis[idx] = chi
+        self._tstamps[idx] = timestamp
+        self._reliable[idx] = reliable
+        self._idx = (idx + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+        self._version += 1
+
+    def _order(self, last=None):
+        nrpts = self._count if last is None else min(int(last), self._count)
+        return (np.arange(-nrpts, 0) + self._idx) % self._capacity
+
+    def get_data(self, last=None):
+        """Return stored results from the oldest to the newest.
+
+        Args:
+            last (int, optional): return only the last entries. Defaults
+                to all entries.
+
+        Returns:
+            dict: with keys 'timestamp', 'vecs', 'chi' and 'reliable'.
+
+        """
+        idcs = self._order(last)
+        return dict(
+            timestamp=self._tstamps[idcs], vecs=self._vecs[idcs],
+            chi=self._chis[idcs], reliable=self._reliable[idcs])
+
+    def calc_stats(self, last=None, only_reliable=True):
+        """Mean and standard deviation of the parameters and chi.
+
+        Args:
+            last (int, optional): consider only the last entries. Defaults
+                to all entries.
+            only_reliable (bool, optional): ignore unreliable fittings.
+                Defaults to True.
+
+        Returns:
+            mean (numpy.ndarray): mean of (x0, x0', y0, y0', delta, chi).
+            std (numpy.ndarray): std of (x0, x0', y0, y0', delta, chi).
+            nrpts (int): number of entries considered.
+
+        """
+        idcs = self._order(last)
+        if only_reliable:
+            idcs = idcs[self._reliable[idcs]]
+        if not idcs.size:
+            nan = np.full(len(PARAMS) + 1, np.nan)
+            return nan, nan.copy(), 0
+        data = np.hstack([self._vecs[idcs], self._chis[idcs, None]])
+        return data.mean(axis=0), data.std(axis=0), idcs.size
+
+    def to_csv(self, fname):
+        """Export history to a CSV file, in SI units."""
+        data = self.get_data()
+        table = np.column_stack([
+            data['timestamp'], data['vecs'], data['chi'],
+            data['reliable'].astype(int)])
+        header = ','.join(('timestamp',) + PARAMS + ('chi', 'reliable'))
+        np.savetxt(
+            fname, table, delimiter=',', header=header, comments='',
+            fmt=['%.6f'] + ['%.9e']*(len(PARAMS)+1) + ['%d'])
+
+    def to_npz(self, fname):
+        """Export history to a NPZ file, in SI units."""
+        data = self.get_data()
+        np.savez(fname, params=np.array(PARAMS), **data)
@@ -0,0 +1,206 @@
+"""Scan of the fitting residue around a trajectory fitting solution.
+
+The RMS residue chi is evaluated on grids of the initial conditions
+around the solution: (x0, x0') and (y0, y0') maps and a delta profile,
+keeping the other parameters at the solution. The maps show
+degeneracies and secondary minima that make a fitting unreliable.
+
+With the model, trajectories are calculated by a pool of processes, each
+one with its own copy of the model, built once when the pool starts.
+The linear approximation uses the response matrix of the fitter and is
+evaluated for the whole grid with a single matrix product.
+"""
+
+import os as _os
+import time as _time
+import multiprocessing as _mp
+
+import numpy as np
+
+from .batch import create_fitter
+from .history import PARAMS
+
+SCANS = dict(x=('x0', 'xl0'), y=('y0', 'yl0'), delta=('delta', ))
+DEFAULT_SPANS = dict(x0=1e-3, xl0=0.5e-3, y0=1e-3, yl0=0.5e-3, delta=1e-2)
+
+
+def make_grid(vec, params, spans=None, nrpts=41):
+    """Return grid of initial conditions around vec.
+
+    Args:
+        vec (numpy.ndarray): center (x0, x0', y0, y0', delta).
+        params (tuple): names of the scanned parameters, see PARAMS.
+        spans (dict, optional): half width of the scan of each parameter.
+            Defaults to DEFAULT_SPANS.
+        nrpts (int, optional): points per parameter. Defaults to 41.
+
+    Returns:
+        axes (list): values of each scanned parameter.
+        vecs (numpy.ndarray): (nrpts**len(params), 5) initial conditions,
+            with the first parameter varying slowest.
+
+    """
+    spans = spans or DEFAULT_SPANS
+    vec = np.asarray(vec, dtype=float)
+    idcs = [PARAMS.index(par) for par in params]
+    axes = [
+        vec[idx] + np.linspace(-1, 1, nrpts)*spans[par]
+        for idx, par in zip(idcs, params)]
+    mesh = np.meshgrid(*axes, indexing='ij')
+    vecs = np.tile(vec, (mesh[0].size, 1))
+    for idx, val in zip(idcs, mesh):
+        vecs[:, idx] = val.ravel()
+    return axes, vecs
+
+
+def calc_chis(trajs, trjx, trjy):
+    """RMS residues of stacked (N, 2*size) trajectories."""
+    meas = np.hstack([trjx, trjy])
+    return np.sqrt(np.mean((trajs - meas)**2, axis=1))
+
+
+def calc_model_chis(fit_traj, vecs, trjx, trjy):
+    """RMS residues of the model trajectories of each initial condition.
+
+    Args:
+        fit_traj (SIFitInjTraj or BOFitInjTraj): fitting object.
+        vecs (numpy.ndarray): (N, 5) initial conditions.
+        trjx (numpy.ndarray): horizontal trajectory [m].
+        trjy (numpy.ndarray): vertical trajectory [m].
+
+    Returns:
+        numpy.ndarray: (N, ) RMS residues [m].
+
+    """
+    size = trjx.size
+    trajs = np.array([
+        np.hstack(fit_traj.calc_traj(*vec, size=size)) for vec in vecs])
+    return calc_chis(trajs, trjx, trjy)
+
+
+# Model of each worker process, created by _init_worker, or the error
+# raised when creating it. Initializers must not raise: the pool would
+# replace the dead processes forever and the scan would never finish.
+_FIT_TRAJ = None
+_INIT_ERROR = None
+
+
+def _init_worker(acc, tunes):
+    global _FIT_TRAJ, _INIT_ERROR
+    try:
+        _FIT_TRAJ = create_fitter(acc, tunes=tunes).fit_traj
+    except Exception as err:
+        _INIT_ERROR = f'{type(err).__name__}: {err}'
+
+
+def _calc_chis_worker(args):
+    if _INIT_ERROR is not None:
+        raise RuntimeError('Model could not be built: ' + _INIT_ERROR)
+    return calc_model_chis(_FIT_TRAJ, *args)
+
+
+class LandscapeScanner:
+    """Evaluate residue maps around fitting solutions.
+
+    The process pool is started at the first scan with the model and
+    kept alive for the next ones. It is restarted if the model tunes
+    change.
+    """
+
+    def __init__(self, acc, tunes=None, nrprocs=None):
+        """."""
+        self.acc = acc.upper()
+        self.nrprocs = nrprocs or _os.cpu_count()
+        self._tunes = None if tunes is None else tuple(tunes)
+        self._pool = None
+
+    @property
+    def tunes(self):
+        """Model tunes of the pool processes."""
+        return self._tunes
+
+    @tunes.setter
+    def tunes(self, value):
+        value = None if value is None else tuple(value)
+        if value != self._tunes:
+            self.close()
+        self._tunes = value
+
+    def close(self):
+        """Terminate process pool."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+    def scan(self, vec, trjx, trjy, nrpts=41, spans=None, respmat=None,
+             chunk=32, progress=None):
+        """Scan residue around vec.
+
+        Args:
+            vec (numpy.ndarray): fitted (x0, x0', y0, y0', delta).
+            trjx (numpy.ndarray): horizontal trajectory [m].
+            trjy (numpy.ndarray): vertical trajectory [m].
+            nrpts (int, optional): points per parameter. Defaults to 41.
+            spans (dict, optional): half width of the scan of each
+                parameter. Defaults to DEFAULT_SPANS.
+            respmat (TrajRespMat, optional): if given, the linear
+                approximation is used instead of the model.
+            chunk (int, optional): number of trajectories calculated by
+                each task of the pool. Defaults to 32.
+            progress (callable, optional): called with the number of
+                points done and the total after each task.
+
+        Returns:
+            dict: for each scan in SCANS, a dict with 'params', 'axes'
+                and 'chis', with shape (nrpts, nrpts) or (nrpts, ); also
+                'vec', 'chi', the residue at vec, 'method' and
+                'scan_time'.
+
+        """
+        tini = _time.perf_counter()
+        grids = {
+            name: make_grid(vec, pars, spans=spans, nrpts=nrpts)
+            for name, pars in SCANS.items()}
+        vecs = np.vstack([vec] + [grd[1] for grd in grids.values()])
+
+        if respmat is not None:
+            chis = calc_chis(
+                respmat.calc_trajs(vecs, size=trjx.size), trjx, trjy)
+        else:
+            chis = self._calc_model_chis(vecs, trjx, trjy, chunk, progress)
+
+        res = dict(
+            vec=np.asarray(vec), chi=chis[0],
+            method='linear' if respmat is not None else 'model')
+        idx = 1
+        for name, (axes, grid) in grids.items():
+            shape = tuple(ax.size for ax in axes)
+            res[name] = dict(
+                params=SCANS[name], axes=axes,
+                chis=chis[idx:idx+grid.shape[0]].reshape(shape))
+            idx += grid.shape[0]
+        res['scan_time'] = _time.perf_counter() - tini
+        return res
+
+    def _calc_model_chis(self, vecs, trjx, trjy, chunk, progress):
+        if self._pool is None:
+            ctx = _mp.get_context('spawn')
+            self._pool = ctx.Pool(
+                processes=self.nrprocs, initializer=_init_worker,
+                initargs=(self.acc, self._tunes))
+        tasks = [
+            (vecs[i:i+chunk], trjx, trjy)
+            for i in range(0, vecs.shape[0], chunk)]
+        chis = []
+        try:
+            for res in self._pool.imap(_calc_chis_worker, tasks):
+                chis.append(res)
+                if progress is not None:
+                    progress(
+                        min(len(chis)*chunk, vecs.shape[0]), vecs.shape[0])
+        except Exception:
+            # start a new pool at the next scan.
+            self.close()
+            raise
+        return np.hstack(chis)
@@ -1,54 +1,110 @@
 """Main module of the Application Interface."""
 
-from time import sleep as _sleep
+import time as _time
+import logging as _log
 
 import numpy as np
 import matplotlib.pyplot as mplt
 import matplotlib.gridspec as mgs
 from matplotlib import rcParams
 
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, Signal
 from qtpy.QtGui import QDoubleValidator
 from qtpy.QtWidgets import QWidget, QPushButton, QGridLayout, QSpinBox, \
-    QDoubleSpinBox, QLabel, QGroupBox, QLineEdit, QCheckBox
+    QDoubleSpinBox, QLabel, QGroupBox, QLineEdit, QCheckBox, QComboBox, \
+    QFileDialog
 
 import qtawesome as qta
 
-from siriuspy.sofb.csdev import SOFBFactory
 from siriushla import util
 from siriushla.widgets import MatplotlibWidget, SiriusMainWindow
 
-from apsuite.commisslib.inj_traj_fitting import SIFitInjTraj, \
-    BOFitInjTraj
 from apsuite.optics_analysis import TuneCorr
 
+from ..latency import StageTimer
+from ..widgets import StageTimerWidget
+from .fitting import InjTrajFitter, create_fit_traj, convert_sofb_traj
+from .worker import FitTrajWorker, TuneAdjustWorker, ModelLoader, \
+    SubscriberWorker, ReplayWorker, MultiTurnFitWorker
+from .recorder import TrajRecorder, TrajRecording
+from .modeltune import adjust_model_tunes
+from .graphics import TrajFitPlotWidget, FitHistoryWidget, \
+    ChiLandscapeWidget
+from .landscape import LandscapeScanner
+from .history import FitHistory
+from .service import FitSubscriber, get_address
+from .sync import FrameSynchronizer
+
 rcParams.update({
     'font.size': 12, 'axes.grid': True, 'grid.linestyle': '--',
     'grid.alpha': 0.5})
 
 
 class ASFitTrajWindow(SiriusMainWindow):
-    """."""
+    """Injection trajectory fitting window.
+
+    In viewer mode the window does not build the model nor fit anything:
+    it only shows the results published by the fitting service running at
+    address, see service.FitService.
+
+    SOFB frames can be recorded to a file when online and recordings,
+    such as the one given by replay, can be fitted again in any mode.
+    """
+
+    BACKENDS = ('matplotlib', 'pyqtgraph')
+    HISTORY_SIZE = 10000
 
-    def __init__(self, acc='SI', parent=None):
+    recordingFailed = Signal(object, str)
+
+    def __init__(
+            self, acc='SI', parent=None, backend='matplotlib', isonline=True,
+            viewer=False, address=None, replay=None):
         """."""
         super().__init__(parent=parent)
         acc = acc.upper()
-        self._csorb = SOFBFactory.create(acc)
-        if acc == 'SI':
-            self.fit_traj = SIFitInjTraj()
-        else:
-            self.fit_traj = BOFitInjTraj()
-        self.tunecorr = TuneCorr(
-            self.fit_traj.model, acc, method='Proportional',
-            grouping='TwoKnobs')
-
+        if backend not in self.BACKENDS:
+            raise ValueError(
+                'backend must be one of ' + ', '.join(self.BACKENDS))
+        self._backend = backend
+        self._isonline = bool(isonline)
+        self._isviewer = bool(viewer)
+        self._acc = acc
+        self._tini = _time.perf_counter()
+
+        # Model related objects are built in background by _load_model:
+        self.fit_traj = None
+        self.tunecorr = None
+        self.fitter = None
+        self._worker = None
+        self.timer = StageTimer()
+
+        self._tune_worker = None
+        self._mt_worker = None
+        self._loader = None
+        self._subscriber = None
+        self._recorder = None
+        self.recordingFailed.connect(self._recording_failed)
+        self._sync = FrameSynchronizer(self._new_frame)
+        self._sync_cbs = []
+        self._recording = None
+        self._replay = None
+        self._last_dir = ''
+        self.history = FitHistory(self.HISTORY_SIZE)
+        self._history_wid = None
+        self._landscape_wid = None
+        self._scanner = None
+        self._last_trajs = None
+        self._last_res = None
+        self._bpmpos = None
         self._auto_update = False
-        sofb = self.fit_traj.devices['sofb']
-        orbx = sofb.pv_object('MTurnIdxOrbX-Mon')
-        orbx.add_callback(self._do_auto_update)
 
         self.setupui()
+        if self._isviewer:
+            self._subscribe(address or get_address(acc))
+        else:
+            self._load_model()
+        if replay is not None:
+            self._open_recording(replay)
         self.setObjectName(acc+'App')
         color = util.get_appropriate_color(acc)
         icon = qta.icon('mdi.calculator-variant', 'mdi.chart-line', options=[
@@ -64,11 +120,128 @@ class ASFitTrajWindow(SiriusMainWindow):
             value (bool): desired state.
         """
         self._auto_update = bool(value)
+        self._update_warm_start()
+
+    @property
+    def ismodel_loaded(self):
+        """Whether model was built and the controls are enabled."""
+        return self.fitter is not None
+
+    def closeEvent(self, event):
+        """."""
+        if self._loader is not None:
+            # NOTE: do not wait for the model build, it may take long.
+            self._loader.discard()
+            self._loader = None
+        if self._replay is not None:
+            self._replay.stop()
+        self._sync.disconnect(self._sync_cbs)
+        self._stop_recording()
+        if self._landscape_wid is not None:
+            self._landscape_wid.close()
+            self._scanner.close()
+        if self._subscriber is not None:
+            self._subscriber.stop()
+        if self._worker is not None:
+            self._worker.stop()
+        if self._tune_worker is not None:
+            self._tune_worker.wait()
+        if self._mt_worker is not None:
+            self._mt_worker.wait()
+        super().closeEvent(event)
+
+    def _load_model(self):
+        for wid in self._model_wids:
+            wid.setEnabled(False)
+        self.lab_fitting.setText('Loading model...')
+        # NOTE: the loader has no parent, so it is not deleted with the
+        # window while the build goes on after the window is closed.
+        self._loader = ModelLoader(self._build_model)
+        self._loader.loaded.connect(self._model_loaded)
+        self._loader.loadError.connect(
+            lambda err: self.lab_fitting.setText('Model loading failed!'))
+        self._loader.start()
+
+    def _subscribe(self, address):
+        for wid in self._model_wids:
+            wid.setVisible(False)
+        try:
+            subscriber = FitSubscriber(address)
+        except PermissionError as err:
+            _log.error(str(err))
+            self.statusBar().showMessage(str(err))
+            return
+        self._subscriber = SubscriberWorker(subscriber, parent=self)
+        self._subscriber.fittingDone.connect(self._update_from_service)
+        self._subscriber.statusChanged.connect(self.statusBar().showMessage)
+        self._subscriber.start()
+
+    def _update_from_service(self, res):
+        bpmpos = res['bpmpos']
+        if self._bpmpos is None or self._bpmpos.size != bpmpos.size:
+            self._bpmpos = bpmpos
+            self._set_bpmpos(bpmpos)
+        self._update_results(res)
+
+    def _build_model(self):
+        # NOTE: runs in the loader thread, must not touch widgets.
+        acc, times = self._acc, dict()
+        tini = _time.perf_counter()
+        fit_traj = create_fit_traj(acc, isonline=self._isonline)
+        times['fit_traj'] = _time.perf_counter() - tini
+
+        tini = _time.perf_counter()
+        tunecorr = TuneCorr(
+            fit_traj.model, acc, method='Proportional', grouping='TwoKnobs')
+        times['tunecorr'] = _time.perf_counter() - tini
+
+        tini = _time.perf_counter()
+        tunes = tunecorr.get_tunes(fit_traj.model)
+        times['model_tunes'] = _time.perf_counter() - tini
+        return dict(fit_traj=fit_traj, tunecorr=tunecorr, tunes=tunes,
+                    times=times)
+
+    def _model_loaded(self, objs):
+        if self._loader is None:
+            # window was closed meanwhile.
+            return
+        tini = _time.perf_counter()
+        self.fit_traj = objs['fit_traj']
+        self.tunecorr = objs['tunecorr']
+        fitter = InjTrajFitter(self.fit_traj, self._acc, timer=self.timer)
+        fitter.invalidate_respmat(tunes=objs['tunes'])
+
+        self._worker = FitTrajWorker(fitter, parent=self)
+        self._worker.fittingDone.connect(self._update_results)
+        self._worker.statusChanged.connect(self.lab_fitting.setText)
+        self._worker.countersChanged.connect(self._update_counters)
+        self._worker.start()
+        self.fitter = fitter
+        self._update_fit_settings()
+        self._update_warm_start()
+        self._set_bpmpos(fitter.bpmpos)
+
+        if self._isonline:
+            self._sync_cbs = self._sync.connect(
+                self.fit_traj.devices['sofb'])
+        self.pusb_rec.setEnabled(self._isonline)
+
+        for wid in self._model_wids:
+            wid.setEnabled(True)
+        self.lab_fitting.setText('')
+
+        times = objs['times']
+        times['widgets'] = _time.perf_counter() - tini
+        times['total'] = _time.perf_counter() - self._tini
+        _log.info(
+            f'{self._acc} trajectory fitting startup: ' + ', '.join(
+                f'{name}={tim*1e3:.0f}ms' for name, tim in times.items()))
 
     def setupui(self):
         """."""
         self.setWindowModality(Qt.WindowModal)
-        self.setWindowTitle(self._csorb.acc+" - Trajectory Fitting")
+        title = self._acc + " - Trajectory Fitting"
+        self.setWindowTitle(title + (' (Viewer)' if self._isviewer else ''))
         self.setDocumentMode(False)
         self.setDockNestingEnabled(True)
 
@@ -80,7 +253,7 @@ class ASFitTrajWindow(SiriusMainWindow):
         wid.setLayout(QGridLayout())
 
         wid.layout().addWidget(
-            QLabel(f'<h1> {self._csorb.acc} - Fit Trajectory </h1>', wid),
+            QLabel(f'<h1> {self._acc} - Fit Trajectory </h1>', wid),
             0, 0, 1, 2, alignment=Qt.AlignCenter)
 
         fig_wid = self.make_figure(wid)
@@ -95,12 +268,24 @@ class ASFitTrajWindow(SiriusMainWindow):
         results = self.get_results_widget(wid)
         wid.layout().addWidget(results, 5, 1)
 
+        multi = self.get_multiturn_widget(wid)
+        wid.layout().addWidget(multi, 7, 1)
+
+        replay = self.get_replay_widget(wid)
+        wid.layout().addWidget(replay, 8, 1)
+
         wid.layout().setRowStretch(2, 2)
         wid.layout().setRowStretch(4, 2)
+        wid.layout().setRowStretch(6, 2)
+        self._model_wids = [tune, ctrls, multi, replay]
         return wid
 
     def make_figure(self, parent):
         """."""
+        if self._backend == 'pyqtgraph':
+            self.fig_widget = TrajFitPlotWidget(parent=parent)
+            return self.fig_widget
+
         self.fig = mplt.figure(figsize=(7, 14))
         fig_widget = MatplotlibWidget(self.fig, parent=parent)
 
@@ -110,17 +295,15 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.axes_y = self.fig.add_subplot(gs[1, 0], sharex=self.axes_x)
         self.axes_s = self.fig.add_subplot(gs[2, 0], sharex=self.axes_y)
 
-        bpmpos = self.fit_traj.twiss.spos[self.fit_traj.bpm_idx]
-        zer = np.zeros(bpmpos.size)
         self.line_measx = self.axes_x.plot(
-            bpmpos, zer, '-d', label='Trajectory')[0]
+            [], [], '-d', label='Trajectory')[0]
         self.line_measy = self.axes_y.plot(
-            bpmpos, zer, '-d', label='Trajectory')[0]
-        self.line_meass = self.axes_s.plot(bpmpos, zer, '-k')[0]
+            [], [], '-d', label='Trajectory')[0]
+        self.line_meass = self.axes_s.plot([], [], '-k')[0]
         self.line_fitx = self.axes_x.plot(
-            bpmpos, zer, '-o', label='Fitting', linewidth=1)[0]
+            [], [], '-o', label='Fitting', linewidth=1)[0]
         self.line_fity = self.axes_y.plot(
-            bpmpos, zer, '-o', label='Fitting', linewidth=1)[0]
+            [], [], '-o', label='Fitting', linewidth=1)[0]
         self.axes_x.set_title(
             r"$x_0$ = {:.3f}mm   $x_0'$ = {:.3f}mrad".format(0.0, 0.0) +
             r"   $\delta$ = {:.2f}%".format(0.0))
@@ -137,6 +320,18 @@ class ASFitTrajWindow(SiriusMainWindow):
         [label.set_visible(False) for label in self.axes_y.get_xticklabels()]
         return fig_widget
 
+    def _set_bpmpos(self, bpmpos):
+        if self._backend == 'pyqtgraph':
+            self.fig_widget.set_bpmpos(bpmpos)
+            return
+        zer = np.zeros(bpmpos.size)
+        for line in (
+                self.line_measx, self.line_measy, self.line_meass,
+                self.line_fitx, self.line_fity):
+            line.set_data(bpmpos, zer)
+        self.axes_x.set_xlim(bpmpos.min(), bpmpos.max())
+        self.fig.canvas.draw_idle()
+
     def get_tune_fit_widget(self, parent):
         """."""
         wid = QGroupBox('Model Tune Adjustment', parent)
@@ -144,11 +339,13 @@ class ASFitTrajWindow(SiriusMainWindow):
 
         self.wid_nux = QDoubleSpinBox(wid)
         self.wid_nuy = QDoubleSpinBox(wid)
+        self.wid_tune_tol = QDoubleSpinBox(wid)
         self.lab_tune = QLabel(wid)
-        pusb = QPushButton('Adjust Model Tune', wid)
-        pusb.clicked.connect(self._adjust_tune)
+        self.lab_tune.setWordWrap(True)
+        self.pusb_tune = QPushButton('Adjust Model Tune', wid)
+        self.pusb_tune.clicked.connect(self._adjust_tune)
 
-        if self._csorb.acc == 'SI':
+        if self._acc == 'SI':
             self.wid_nux.setValue(49.09)
             self.wid_nuy.setValue(14.15)
         else:
@@ -158,13 +355,19 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.wid_nuy.setSingleStep(0.001)
         self.wid_nux.setDecimals(4)
         self.wid_nuy.setDecimals(4)
+        self.wid_tune_tol.setDecimals(5)
+        self.wid_tune_tol.setRange(1e-5, 1e-1)
+        self.wid_tune_tol.setSingleStep(1e-4)
+        self.wid_tune_tol.setValue(1e-4)
 
         wid.layout().addWidget(QLabel('\u03bd<sub>x</sub>', wid), 1, 0)
         wid.layout().addWidget(QLabel('\u03bd<sub>y</sub>', wid), 2, 0)
+        wid.layout().addWidget(QLabel('Tolerance', wid), 3, 0)
         wid.layout().addWidget(self.wid_nux, 1, 1)
         wid.layout().addWidget(self.wid_nuy, 2, 1)
-        wid.layout().addWidget(pusb, 3, 0, 1, 2)
-        wid.layout().addWidget(self.lab_tune, 4, 0, 1, 2)
+        wid.layout().addWidget(self.wid_tune_tol, 3, 1)
+        wid.layout().addWidget(self.pusb_tune, 4, 0, 1, 2)
+        wid.layout().addWidget(self.lab_tune, 5, 0, 1, 2)
         return wid
 
     def get_param_control_widget(self, parent):
@@ -176,14 +379,36 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.wid_tol = QLineEdit('100', wid)
         self.wid_thres = QLineEdit('10.0', wid)
         self.lab_fitting = QLabel(wid)
+        self.lab_counters = QLabel(wid)
         pusb = QPushButton('Fit Trajectory', wid)
         chbox = QCheckBox('Automatic', wid)
+        self.chb_warm = QCheckBox('Warm Start', wid)
+        self.chb_warm.setToolTip(
+            'In automatic mode, seed each fitting with the last solution.')
+        self.chb_warm.setChecked(True)
+        self.chb_fast = QCheckBox('Fast Fit', wid)
+        self.chb_fast.setToolTip(
+            'Fit with cached response matrix of the model.\n'
+            'Falls back to the full fitting if the residue '
+            'exceeds the tolerance.')
         pusb.clicked.connect(self._do_fitting)
         chbox.toggled.connect(self.set_auto_update)
+        self.chb_warm.toggled.connect(self._update_warm_start)
+        self.chb_fast.toggled.connect(self._update_fit_settings)
 
         self.wid_nr_iter.setValue(10)
         self.wid_tol.setValidator(QDoubleValidator())
         self.wid_thres.setValidator(QDoubleValidator())
+        self.wid_nr_iter.valueChanged.connect(self._update_fit_settings)
+        self.wid_tol.editingFinished.connect(self._update_fit_settings)
+        self.wid_thres.editingFinished.connect(self._update_fit_settings)
+        self.wid_rate = QDoubleSpinBox(wid)
+        self.wid_rate.setRange(0, 100)
+        self.wid_rate.setValue(10)
+        self.wid_rate.setSpecialValueText('No limit')
+        self.wid_rate.setToolTip('Maximum rate of automatic fittings.')
+        self.wid_rate.valueChanged.connect(self._update_fit_settings)
+        self._update_counters(0, 0)
 
         wid.layout().addWidget(QLabel('# Iterations', wid), 1, 0)
         wid.layout().addWidget(QLabel('Tolerance [um]', wid), 2, 0)
@@ -191,9 +416,16 @@ class ASFitTrajWindow(SiriusMainWindow):
         wid.layout().addWidget(self.wid_nr_iter, 1, 1)
         wid.layout().addWidget(self.wid_tol, 2, 1)
         wid.layout().addWidget(self.wid_thres, 3, 1)
-        wid.layout().addWidget(pusb, 4, 0)
-        wid.layout().addWidget(chbox, 4, 1)
-        wid.layout().addWidget(self.lab_fitting, 5, 0, 1, 2)
+        wid.layout().addWidget(QLabel('Max Rate [Hz]', wid), 4, 0)
+        wid.layout().addWidget(self.wid_rate, 4, 1)
+        wid.layout().addWidget(pusb, 5, 0)
+        wid.layout().addWidget(chbox, 5, 1)
+        wid.layout().addWidget(self.chb_fast, 6, 0)
+        wid.layout().addWidget(self.chb_warm, 6, 1)
+        wid.layout().addWidget(self.lab_fitting, 7, 0, 1, 2)
+        wid.layout().addWidget(self.lab_counters, 8, 0, 1, 2)
+        wid.layout().addWidget(
+            StageTimerWidget(self.timer, parent=wid), 9, 0, 1, 2)
         return wid
 
     def get_results_widget(self, parent):
@@ -207,61 +439,367 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.wid_yl0 = QLabel('0.000', wid)
         self.wid_en0 = QLabel('0.000', wid)
         self.wid_res = QLabel('0.000', wid)
+        self.wid_iter = QLabel('0', wid)
         self.wid_unreliable = QLabel('Warning: Unreliable Fitting!', wid)
         self.wid_unreliable.setStyleSheet('color:red; font-weight:bold;')
         self.wid_unreliable.setVisible(False)
         self.wid_unre_reason = QLabel('', wid)
         self.wid_unre_reason.setStyleSheet('color:red;')
         self.wid_unre_reason.setVisible(False)
+        pusb_hist = QPushButton(qta.icon('mdi.history'), 'History', wid)
+        pusb_hist.clicked.connect(self._show_history)
+        pusb_scan = QPushButton(qta.icon('mdi.grid'), 'Residue Map', wid)
+        pusb_scan.setToolTip(
+            'Scan fitting residue around the last solution to inspect\n'
+            'degeneracies and multiple minima.')
+        pusb_scan.clicked.connect(self._show_landscape)
         wid.layout().addWidget(QLabel('x<sub>0</sub> [mm]', wid), 1, 0)
         wid.layout().addWidget(QLabel("x'<sub>0</sub> [mm]", wid), 2, 0)
         wid.layout().addWidget(QLabel('y<sub>0</sub> [mm]', wid), 3, 0)
         wid.layout().addWidget(QLabel("y'<sub>0</sub> [mm]", wid), 4, 0)
         wid.layout().addWidget(QLabel('\u03b4<sub>0</sub> [%]', wid), 5, 0)
         wid.layout().addWidget(QLabel('\u03c7 [\u03bcm]', wid), 6, 0)
+        wid.layout().addWidget(QLabel('# Iterations', wid), 7, 0)
         wid.layout().addWidget(self.wid_x0, 1, 1)
         wid.layout().addWidget(self.wid_xl0, 2, 1)
         wid.layout().addWidget(self.wid_y0, 3, 1)
         wid.layout().addWidget(self.wid_yl0, 4, 1)
         wid.layout().addWidget(self.wid_en0, 5, 1)
         wid.layout().addWidget(self.wid_res, 6, 1)
-        wid.layout().addWidget(self.wid_unreliable, 7, 0, 1, 2)
-        wid.layout().addWidget(self.wid_unre_reason, 8, 0, 1, 2)
+        wid.layout().addWidget(self.wid_iter, 7, 1)
+        wid.layout().addWidget(self.wid_unreliable, 8, 0, 1, 2)
+        wid.layout().addWidget(self.wid_unre_reason, 9, 0, 1, 2)
+        wid.layout().addWidget(pusb_hist, 10, 0)
+        wid.layout().addWidget(pusb_scan, 10, 1)
         return wid
 
-    def _adjust_tune(self):
-        tunex_goal = float(self.wid_nux.value())
-        tuney_goal = float(self.wid_nuy.value())
+    def get_multiturn_widget(self, parent):
+        """."""
+        wid = QGroupBox('Multi-Turn Fitting', parent)
+        wid.setLayout(QGridLayout())
 
-        self.tunecorr.get_tunes(self.fit_traj.model)
-        tunemat = self.tunecorr.calc_jacobian_matrix()
-        self.tunecorr.correct_parameters(
-            model=self.fit_traj.model,
-            goal_parameters=np.array([tunex_goal, tuney_goal]),
-            jacobian_matrix=tunemat)
+        self.pusb_mt = QPushButton('Fit All Turns', wid)
+        self.pusb_mt.setToolTip(
+            'Fit all turns of SOFB multi-turn trajectory at once\n'
+            'with the response matrix of the model.')
+        self.pusb_mt.clicked.connect(self._do_multiturn_fitting)
+        self.lab_mt_status = QLabel('', wid)
+        labels = [
+            'x<sub>0</sub> [mm]', "x'<sub>0</sub> [mrad]",
+            'y<sub>0</sub> [mm]', "y'<sub>0</sub> [mrad]",
+            '\u03b4<sub>0</sub> [%]']
+        self.wid_mt_params = []
+        for i, lab in enumerate(labels):
+            wid.layout().addWidget(QLabel(lab, wid), i+1, 0)
+            lab_val = QLabel('- \u00b1 -', wid)
+            wid.layout().addWidget(lab_val, i+1, 1)
+            self.wid_mt_params.append(lab_val)
+        wid.layout().addWidget(self.pusb_mt, 0, 0)
+        wid.layout().addWidget(self.lab_mt_status, 0, 1)
+        return wid
+
+    def get_replay_widget(self, parent):
+        """."""
+        wid = QGroupBox('Record && Replay', parent)
+        wid.setLayout(QGridLayout())
+
+        self.pusb_rec = QPushButton(qta.icon('mdi.record'), 'Record', wid)
+        self.pusb_rec.setCheckable(True)
+        self.pusb_rec.setToolTip('Record SOFB trajectory of each shot.')
+        self.pusb_rec.toggled.connect(self._toggle_recording)
+        self.lab_rec = QLabel('', wid)
+
+        pusb_open = QPushButton(qta.icon('mdi.folder-open'), 'Open', wid)
+        pusb_open.clicked.connect(self._open_recording)
+        self.lab_replay = QLabel('No recording.', wid)
+        self.cbb_replay = QComboBox(wid)
+        self.cbb_replay.addItems(ReplayWorker.MODES)
+        self.cbb_replay.setToolTip(
+            'realtime: recorded intervals, divided by speed;\n'
+            'max: as fast as fitted, every frame is fitted;\n'
+            'step: one frame per click of Step.')
+        self.wid_speed = QDoubleSpinBox(wid)
+        self.wid_speed.setRange(0.01, 100)
+        self.wid_speed.setValue(1.0)
+        self.wid_speed.setSuffix('x')
+        self.wid_speed.setToolTip('Speed of realtime replay.')
+        self.pusb_play = QPushButton(qta.icon('mdi.play'), 'Play', wid)
+        self.pusb_play.setCheckable(True)
+        self.pusb_play.toggled.connect(self._toggle_replay)
+        self.pusb_step = QPushButton(qta.icon('mdi.step-forward'), 'Step', wid)
+        self.pusb_step.clicked.connect(self._step_replay)
+
+        wid.layout().addWidget(self.pusb_rec, 0, 0)
+        wid.layout().addWidget(self.lab_rec, 0, 1, 1, 2)
+        wid.layout().addWidget(pusb_open, 1, 0)
+        wid.layout().addWidget(self.lab_replay, 1, 1, 1, 2)
+        wid.layout().addWidget(self.cbb_replay, 2, 0)
+        wid.layout().addWidget(self.wid_speed, 2, 1)
+        wid.layout().addWidget(self.pusb_play, 3, 0)
+        wid.layout().addWidget(self.pusb_step, 3, 1)
+        return wid
+
+    def _toggle_recording(self, value):
+        if not value:
+            self._stop_recording()
+            return
+        fname, _ = QFileDialog.getSaveFileName(
+            self, caption='Record Trajectories', directory=self._last_dir,
+            filter='Trajectory Recordings (*.trj)')
+        if not fname:
+            self.pusb_rec.setChecked(False)
+            return
+        fname += '' if fname.endswith('.trj') else '.trj'
+        self._last_dir = fname
+        self._recorder = TrajRecorder(fname, len(self.fit_traj.bpm_idx))
+        self.lab_rec.setText('Recording...')
+
+    def _stop_recording(self):
+        rec, self._recorder = self._recorder, None
+        if rec is None:
+            return
+        rec.close()
+        self.lab_rec.setText(f'{len(rec):d} frames recorded.')
+
+    def _recording_failed(self, rec, err):
+        _log.error('Recording stopped: ' + err)
+        rec.close()
+        self.pusb_rec.blockSignals(True)
+        self.pusb_rec.setChecked(False)
+        self.pusb_rec.blockSignals(False)
+        self.lab_rec.setText(f'Stopped after {len(rec):d} frames: {err}')
+
+    def _new_frame(self, frame):
+        # NOTE: runs in the EPICS callback thread completing the frame.
+        rec = self._recorder
+        if rec is not None:
+            try:
+                rec.append(
+                    frame['x'], frame['y'], frame['sum'],
+                    timestamp=frame['timestamp'])
+            except ValueError as err:
+                # the recorder may have been closed meanwhile.
+                if not rec.closed:
+                    self._recorder = None
+                    self.recordingFailed.emit(rec, str(err))
+        if self._auto_update:
+            self._worker.submit(trajs=convert_sofb_traj(
+                frame['x'], frame['y'], frame['sum'],
+                self.fitter.count_rel_thres))
+
+    def _open_recording(self, fname=None):
+        if not fname:
+            fname, _ = QFileDialog.getOpenFileName(
+                self, caption='Open Trajectory Recording',
+                directory=self._last_dir,
+                filter='Trajectory Recordings (*.trj)')
+            if not fname:
+                return
+        self.pusb_play.setChecked(False)
+        self._last_dir = fname
+        try:
+            self._recording = TrajRecording(fname)
+        except (OSError, ValueError) as err:
+            self._recording = None
+            self.lab_replay.setText('Could not open file!')
+            self.lab_replay.setToolTip(str(err))
+            return
+        rec = self._recording
+        self.lab_replay.setText(
+            f'{len(rec):d} frames, {rec.duration:.1f} s')
+        self.lab_replay.setToolTip(fname)
+
+    def _toggle_replay(self, value):
+        if not value:
+            if self._replay is not None:
+                self._replay.stop()
+            return
+        if self._recording is None or not self.ismodel_loaded:
+            self.pusb_play.setChecked(False)
+            return
+        start = 0
+        if self._replay is not None and \
+                self._replay.recording is self._recording and \
+                self._replay.index < len(self._recording):
+            start = self._replay.index
+        self._replay = ReplayWorker(
+            self._recording, self._replay_frame,
+            mode=self.cbb_replay.currentText(),
+            speed=self.wid_speed.value(), start=start, parent=self)
+        self._replay.frameChanged.connect(self._update_replay_status)
+        self._replay.finished.connect(
+            lambda: self.pusb_play.setChecked(False))
+        self._replay.start()
+
+    def _step_replay(self):
+        if self.cbb_replay.currentText() != 'step':
+            self.cbb_replay.setCurrentText('step')
+            self.pusb_play.setChecked(False)
+        if not self.pusb_play.isChecked():
+            self.pusb_play.setChecked(True)
+        if self._replay is not None:
+            self._replay.step()
+
+    def _replay_frame(self, frame):
+        # NOTE: runs in the replay thread.
+        _, trjx, trjy, trjs = frame
+        trajs = convert_sofb_traj(
+            trjx, trjy, trjs, self.fitter.count_rel_thres)
+        replay = self._replay
+        if replay.mode != 'max':
+            self._worker.submit(trajs=trajs)
+            return
+        # NOTE: in 'max' mode every frame is fitted: wait for the fitting
+        # worker to take the previous frame instead of replacing it.
+        while not self._worker.submit(trajs=trajs, timeout=0.2):
+            if replay.stopping:
+                return
+
+    def _update_replay_status(self, index, nrframes):
+        self.lab_replay.setText(f'Frame {index:d}/{nrframes:d}')
+
+    def _show_history(self):
+        if self._history_wid is None:
+            self._history_wid = FitHistoryWidget(self.history, parent=self)
+            self._history_wid.setWindowFlags(Qt.Window)
+            self._history_wid.resize(900, 700)
+        self._history_wid.show()
+        self._history_wid.raise_()
+        self._history_wid.update_history()
+
+    def _show_landscape(self):
+        if self._last_res is None:
+            return
+        if self._landscape_wid is None:
+            self._scanner = LandscapeScanner(self._acc)
+            self._landscape_wid = ChiLandscapeWidget(
+                self._scanner, parent=self)
+            self._landscape_wid.setWindowFlags(Qt.Window)
+            self._landscape_wid.resize(1000, 700)
+        respmat = lock = None
+        if self.ismodel_loaded:
+            respmat, lock = self.fitter.respmat, self.fitter.lock
+            self._scanner.tunes = respmat.tunes
+        elif 'tunes' in self._last_res:
+            self._scanner.tunes = self._last_res['tunes']
+        else:
+            # NOTE: services of older versions do not publish the tunes.
+            self.lab_fitting.setText('Unknown model tunes, cannot scan.')
+            return
+        self._landscape_wid.set_result(
+            self._last_res, respmat=respmat, lock=lock)
+        self._landscape_wid.show()
+        self._landscape_wid.raise_()
+        self._landscape_wid.start_scan()
+
+    def _do_multiturn_fitting(self):
+        if self._mt_worker is not None and self._mt_worker.isRunning():
+            return
+        fitter = self.fitter
+
+        def _do_fit():
+            return fitter.fit_batch(*fitter.get_multiturn_traj())
+
+        self._mt_worker = MultiTurnFitWorker(_do_fit, parent=self)
+        self._mt_worker.fittingDone.connect(self._multiturn_fitted)
+        self._mt_worker.fittingError.connect(self._multiturn_fit_failed)
+        self.pusb_mt.setEnabled(False)
+        self.lab_mt_status.setText('Fitting...')
+        self._mt_worker.start()
+
+    def _multiturn_fit_failed(self, err):
+        self.pusb_mt.setEnabled(True)
+        self.lab_mt_status.setText('Failed!')
+        self.lab_mt_status.setToolTip(err)
+
+    def _multiturn_fitted(self, res):
+        self.pusb_mt.setEnabled(True)
+        conv = res['converged']
+        self.lab_mt_status.setText(
+            f'{conv.sum():d}/{conv.size:d} turns in '
+            f'{res["fit_time"]*1e3:.1f} ms')
+        self.lab_mt_status.setToolTip('')
+        units = [1e3, 1e3, 1e3, 1e3, 1e2]
+        for lab, ave, std, unit in zip(
+                self.wid_mt_params, res['mean'], res['std'], units):
+            lab.setText(f'{ave*unit:.3f} \u00b1 {std*unit:.3f}')
 
-        self.lab_tune.setText('Done!')
+    def _adjust_tune(self):
+        if self._tune_worker is not None and self._tune_worker.isRunning():
+            return
+        goal = np.array([self.wid_nux.value(), self.wid_nuy.value()])
+        tol = self.wid_tune_tol.value()
+
+        def _do_adjust():
+            with self.fitter.lock:
+                res = adjust_model_tunes(
+                    self.tunecorr, self._acc, self.fit_traj.model,
+                    goal, tol=tol)
+                self.fitter.notify_model_changed(tunes=res[0])
+            return res
+
+        self._tune_worker = TuneAdjustWorker(_do_adjust, parent=self)
+        self._tune_worker.adjustDone.connect(self._tune_adjusted)
+        self._tune_worker.adjustError.connect(self._tune_adjust_failed)
+        self.pusb_tune.setEnabled(False)
+        self.lab_tune.setText('Adjusting...')
+        self._tune_worker.start()
+
+    def _tune_adjust_failed(self, err):
+        self.pusb_tune.setEnabled(True)
+        self.lab_tune.setText('Failed: ' + err)
+
+    def _tune_adjusted(self, tunex, tuney, nr_iter, converged):
+        self.pusb_tune.setEnabled(True)
+        txt = 'Done!' if converged else 'Not converged!'
+        self.lab_tune.setText(
+            f'{txt} \u03bd<sub>x</sub> = {tunex:.4f}, '
+            f'\u03bd<sub>y</sub> = {tuney:.4f} '
+            f'({nr_iter:d} iterations)')
+
+    def _update_fit_settings(self, *args):
+        _ = args
+        if not self.ismodel_loaded:
+            return
+        try:
+            self.fitter.tol = float(self.wid_tol.text()) * 1e-6
+            self.fitter.count_rel_thres = float(self.wid_thres.text())/100
+        except ValueError:
+            return
+        self.fitter.max_iter = self.wid_nr_iter.value()
+        self.fitter.fast_fit = self.chb_fast.isChecked()
+        self._worker.max_rate = self.wid_rate.value()
 
-    def _do_auto_update(self, *args, **kwargs):
-        _ = args, kwargs
-        if not self._auto_update:
+    def _update_warm_start(self, *args):
+        _ = args
+        if not self.ismodel_loaded:
             return
-        _sleep(0.1)
-        self._do_fitting()
+        self.fitter.warm_start = \
+            self._auto_update and self.chb_warm.isChecked()
+
+    def _update_counters(self, nr_processed, nr_dropped):
+        sync = self._sync
+        self.lab_counters.setText(
+            f'Processed: {nr_processed:d}   Dropped: {nr_dropped:d}\n'
+            f'Frames: {sync.nr_frames:d}   '
+            f'Incomplete: {sync.nr_incomplete:d}   '
+            f'Mismatched: {sync.nr_mismatched:d}')
 
     def _do_fitting(self):
-        trjx, trjy, trjs = self.fit_traj.get_traj_from_sofb()
-        # trjx, trjy, trjs = self.fit_traj.simulate_sofb(
-        #     -8.2e-3, 0.1e-3, y0=0.4e-3, yl0=0, delta=0.002,
-        #     errx=0.5e-3, erry=0.3e-3)
-
-        tol = float(self.wid_tol.text()) * 1e-6
-        max_iter = self.wid_nr_iter.value()
-        self.fit_traj.params.count_rel_thres = float(self.wid_thres.text())/100
-        vecs, _, chis = self.fit_traj.do_fitting(
-            trjx, trjy, tol=tol, max_iter=max_iter, full=True)
-        x, xl, y, yl, de = vecs[-1]
-        chi = chis[-1]
+        if self._isonline:
+            self._worker.submit()
+        elif self._last_trajs is not None:
+            self._worker.submit(trajs=self._last_trajs)
+
+    def _update_results(self, res):
+        with self.timer.stage('gui_update'):
+            self._do_update_results(res)
+
+    def _do_update_results(self, res):
+        x, xl, y, yl, de = res['vec']
+        chi = res['chi']
+        self._last_trajs = res['trjx'], res['trjy'], res['trjs']
+        self._last_res = res
 
         self.wid_x0.setText(f'{x*1e3:.3f}')
         self.wid_xl0.setText(f'{xl*1e3:.3f}')
@@ -269,16 +807,41 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.wid_yl0.setText(f'{yl*1e3:.3f}')
         self.wid_en0.setText(f'{de*1e2:.3f}')
         self.wid_res.setText(f'{chi*1e6:.1f}')
+        if res['method'] == 'fast':
+            txt = 'fast fit'
+        else:
+            txt = ('warm' if res['warm_start'] else 'cold') + ' start'
+        self.wid_iter.setText('{:d} ({:s}, {:.1f} ms)'.format(
+            res['nr_iter'], txt, res['fit_time']*1e3))
+        self._update_figure(res)
+
+        unre_fit = res['unreliable']
+        self.history.append(res['vec'], chi, res['timestamp'], not unre_fit)
+        self.wid_unreliable.setVisible(bool(unre_fit))
+        self.wid_unre_reason.setVisible(bool(unre_fit))
+        self.wid_unre_reason.setText(unre_fit)
+
+    def _update_figure(self, res):
+        with self.timer.stage('redraw'):
+            self._do_update_figure(res)
+
+    def _do_update_figure(self, res):
+        if self._backend == 'pyqtgraph':
+            self.fig_widget.set_fitted_params(res['vec'])
+            self.fig_widget.update_traj(
+                res['trjx'], res['trjy'], res['trjs'],
+                res['trjx_fit'], res['trjy_fit'])
+            return
+
+        x, xl, y, yl, de = res['vec']
+        trjx, trjy, trjs = res['trjx'], res['trjy'], res['trjs']
         self.axes_x.set_title(
             r"$x_0$ = {:.3f}mm   $x_0'$ = {:.3f}mrad".format(x*1e3, xl*1e3) +
             r"   $\delta$ = {:.2f}%".format(de*100))
         self.axes_y.set_title(
             r"$y_0$ = {:.3f}mm   $y_0'$ = {:.3f}mrad".format(y*1e3, yl*1e3))
 
-        self.lab_fitting.setText('Calculating Trajectory...')
-
-        trjx_fit, trjy_fit = self.fit_traj.calc_traj(*vecs[-1], size=trjx.size)
-        bpmpos = self.fit_traj.twiss.spos[self.fit_traj.bpm_idx]
+        bpmpos = res['bpmpos']
         bpmpos_trun = bpmpos[:trjx.size]
 
         self.line_measx.set_xdata(bpmpos_trun)
@@ -289,8 +852,8 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.line_measx.set_ydata(trjx*1e3)
         self.line_measy.set_ydata(trjy*1e3)
         self.line_meass.set_ydata(trjs)
-        self.line_fitx.set_ydata(trjx_fit*1e3)
-        self.line_fity.set_ydata(trjy_fit*1e3)
+        self.line_fitx.set_ydata(res['trjx_fit']*1e3)
+        self.line_fity.set_ydata(res['trjy_fit']*1e3)
         self.axes_x.relim()
         self.axes_y.relim()
         self.axes_s.relim()
@@ -298,10 +861,3 @@ class ASFitTrajWindow(SiriusMainWindow):
         self.axes_y.autoscale_view()
         self.axes_s.autoscale_view()
         self.fig.canvas.draw()
-
-        self.lab_fitting.setText('Done!')
-
-        unre_fit = self.fit_traj.unreliable_fitting()
-        self.wid_unreliable.setVisible(bool(unre_fit))
-        self.wid_unre_reason.setVisible(bool(unre_fit))
-        self.wid_unre_reason.setText(unre_fit)
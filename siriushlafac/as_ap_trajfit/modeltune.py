@@ -0,0 +1,66 @@
+"""Adjustment of the model tunes used in the trajectory fitting."""
+
+import numpy as np
+
+# Tune Jacobians already calculated, by accelerator and model object.
+_JACOBIANS = dict()
+
+
+def get_tune_jacobian(tunecorr, acc, model, recalc=False):
+    """Return tune Jacobian of the model, calculating it only once.
+
+    Args:
+        tunecorr (apsuite.optics_analysis.TuneCorr): tune correction object
+            created with model.
+        acc (str): accelerator name.
+        model (pyaccel.accelerator.Accelerator): model.
+        recalc (bool, optional): force calculation. Defaults to False.
+
+    Returns:
+        numpy.ndarray: tune Jacobian matrix.
+
+    """
+    key = (acc.upper(), id(model))
+    cached = _JACOBIANS.get(key)
+    if recalc or cached is None or cached[0] is not model:
+        cached = (model, tunecorr.calc_jacobian_matrix())
+        _JACOBIANS[key] = cached
+    return cached[1]
+
+
+def adjust_model_tunes(
+        tunecorr, acc, model, goal, tol=1e-4, max_iter=10):
+    """Correct model tunes iteratively until they reach the goal.
+
+    The tune Jacobian is only calculated if a correction is needed.
+
+    Args:
+        tunecorr (apsuite.optics_analysis.TuneCorr): tune correction object
+            created with model.
+        acc (str): accelerator name.
+        model (pyaccel.accelerator.Accelerator): model to be corrected.
+        goal (tuple): desired tunes (nux, nuy).
+        tol (float, optional): maximum tune deviation. Defaults to 1e-4.
+        max_iter (int, optional): maximum number of corrections.
+            Defaults to 10.
+
+    Returns:
+        tunes (numpy.ndarray): achieved tunes (nux, nuy).
+        nr_iter (int): number of corrections applied.
+        converged (bool): whether the tunes are within tolerance.
+
+    """
+    goal = np.asarray(goal, dtype=float)
+    jacobian = None
+    nr_iter = 0
+    while True:
+        tunes = np.array(tunecorr.get_tunes(model), dtype=float)
+        if np.all(np.abs(tunes - goal) < tol):
+            return tunes, nr_iter, True
+        if nr_iter >= max_iter:
+            return tunes, nr_iter, False
+        if jacobian is None:
+            jacobian = get_tune_jacobian(tunecorr, acc, model)
+        tunecorr.correct_parameters(
+            model=model, goal_parameters=goal, jacobian_matrix=jacobian)
+        nr_iter += 1
@@ -0,0 +1,203 @@
+"""Record and replay of SOFB trajectory streams.
+
+Frames are stored in a binary file with a fixed size header followed by
+fixed size records, each one with the timestamp and the raw horizontal
+and vertical trajectories [um] and BPM sum signal of SOFB. The file is
+memory-mapped, so appending a frame is a copy to memory, and it grows in
+chunks when full. The number of valid records is written in the header
+after each record, so a file being recorded can be read at any time.
+"""
+
+import os as _os
+import time as _time
+from threading import Lock as _Lock
+
+import numpy as np
+
+MAGIC = b'SITRJREC'
+VERSION = 1
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'), ('version', '<u4'), ('nbpm', '<u4'),
+    ('capacity', '<u8'), ('count', '<u8')])
+
+
+def get_record_dtype(nbpm):
+    """Return dtype of the records of a file with nbpm BPMs."""
+    return np.dtype([
+        ('timestamp', '<f8'), ('x', '<f4', (nbpm, )),
+        ('y', '<f4', (nbpm, )), ('sum', '<f4', (nbpm, ))])
+
+
+def _map_header(fname, mode):
+    header = np.memmap(
+        fname, dtype=HEADER_DTYPE, mode=mode, offset=0, shape=(1, ))
+    if header['magic'][0] != MAGIC:
+        raise ValueError(f'{fname} is not a trajectory recording.')
+    if header['version'][0] != VERSION:
+        raise ValueError(
+            f'Unknown version {header["version"][0]:d} of {fname}.')
+    return header
+
+
+class TrajRecorder:
+    """Append SOFB trajectory frames to a memory-mapped file.
+
+    Usage:
+        rec = TrajRecorder('injection.trj', nbpm=160)
+        rec.append(sofb.trajx, sofb.trajy, sofb.sum)
+        ...
+        rec.close()
+    """
+
+    def __init__(self, fname, nbpm, chunk=1000):
+        """Create a new recording, overwriting fname if it exists.
+
+        Args:
+            fname (str): file name.
+            nbpm (int): number of BPMs of each frame.
+            chunk (int, optional): number of records the file grows
+                when full. Defaults to 1000.
+
+        """
+        self.fname = fname
+        self.nbpm = int(nbpm)
+        self.chunk = int(chunk)
+        self._dtype = get_record_dtype(self.nbpm)
+        self._lock = _Lock()
+        self._header = None
+        self._records = None
+
+        with open(fname, 'wb') as fil:
+            header = np.zeros(1, dtype=HEADER_DTYPE)
+            header['magic'] = MAGIC
+            header['version'] = VERSION
+            header['nbpm'] = self.nbpm
+            fil.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+        self._header = _map_header(fname, 'r+')
+        self._resize(self.chunk)
+
+    def __len__(self):
+        """."""
+        return int(self._header['count'][0])
+
+    @property
+    def closed(self):
+        """."""
+        return self._records is None
+
+    def append(self, trjx, trjy, trjs, timestamp=None):
+        """Append a frame.
+
+        Args:
+            trjx (numpy.ndarray): horizontal trajectory [um].
+            trjy (numpy.ndarray): vertical trajectory [um].
+            trjs (numpy.ndarray): BPM sum signal [counts].
+            timestamp (float, optional): frame timestamp. Defaults to the
+                current time.
+
+        """
+        if timestamp is None:
+            timestamp = _time.time()
+        with self._lock:
+            if self._records is None:
+                raise ValueError('Recorder is closed.')
+            idx = len(self)
+            if idx >= self._records.size:
+                self._resize(self._records.size + self.chunk)
+            rec = self._records[idx]
+            rec['timestamp'] = timestamp
+            rec['x'] = trjx
+            rec['y'] = trjy
+            rec['sum'] = trjs
+            self._header['count'] = idx + 1
+
+    def flush(self):
+        """Write changes to disk."""
+        with self._lock:
+            if self._records is not None:
+                self._records.flush()
+                self._header.flush()
+
+    def close(self):
+        """Flush and close file, discarding unused records."""
+        with self._lock:
+            if self._records is None:
+                return
+            count = len(self)
+            self._records.flush()
+            self._records = None
+            self._header['capacity'] = count
+            self._header.flush()
+            self._header = _map_header(self.fname, 'r')
+            _os.truncate(
+                self.fname, HEADER_SIZE + count*self._dtype.itemsize)
+
+    def _resize(self, capacity):
+        if self._records is not None:
+            self._records.flush()
+            self._records = None
+        _os.truncate(self.fname, HEADER_SIZE + capacity*self._dtype.itemsize)
+        self._records = np.memmap(
+            self.fname, dtype=self._dtype, mode='r+', offset=HEADER_SIZE,
+            shape=(capacity, ))
+        self._header['capacity'] = capacity
+
+
+class TrajRecording:
+    """Read-only access to a trajectory recording.
+
+    Records are memory-mapped, so opening large files is immediate and
+    only the frames actually read are loaded from disk.
+    """
+
+    def __init__(self, fname):
+        """."""
+        self.fname = fname
+        self._header = _map_header(fname, 'r')
+        self.nbpm = int(self._header['nbpm'][0])
+        self._dtype = get_record_dtype(self.nbpm)
+        self._records = None
+        self.reload()
+
+    def __len__(self):
+        """."""
+        return self._records.size
+
+    def reload(self):
+        """Map records again, to see frames appended after opening."""
+        count = int(self._header['count'][0])
+        self._records = np.memmap(
+            self.fname, dtype=self._dtype, mode='r', offset=HEADER_SIZE,
+            shape=(count, )) if count else np.zeros(0, dtype=self._dtype)
+
+    @property
+    def timestamps(self):
+        """."""
+        return self._records['timestamp']
+
+    @property
+    def duration(self):
+        """Time between first and last frames [s]."""
+        if not len(self):
+            return 0.0
+        return float(self.timestamps[-1] - self.timestamps[0])
+
+    def get_frame(self, idx):
+        """Return frame.
+
+        Args:
+            idx (int): frame index.
+
+        Returns:
+            timestamp (float): frame timestamp.
+            trjx (numpy.ndarray): horizontal trajectory [um].
+            trjy (numpy.ndarray): vertical trajectory [um].
+            trjs (numpy.ndarray): BPM sum signal [counts].
+
+        """
+        rec = self._records[idx]
+        return (
+            float(rec['timestamp']), np.array(rec['x'], dtype=float),
+            np.array(rec['y'], dtype=float),
+            np.array(rec['sum'], dtype=float))
@@ -0,0 +1,225 @@
+"""Linearized trajectory fitting with a cached response matrix."""
+
+import os as _os
+import logging as _log
+
+import numpy as np
+
+from ..cache import get_cache_dir as _get_cache_dir
+
+
+class TrajRespMat:
+    """Linear response of the trajectory to the initial conditions.
+
+    The response matrix of the trajectories at the BPMs to the initial
+    conditions (x0, x0', y0, y0', delta) is calculated once by central
+    finite differences of fit_traj.calc_traj around a reference vector.
+    Each fitting is then a single least squares solution, using a
+    pseudo-inverse cached for each number of valid BPMs.
+
+    The matrix depends only on the model, so it must be discarded when
+    the model changes. It can be saved to disk, identified by the
+    accelerator and the model tunes.
+    """
+
+    DELTAS = np.array([10e-6, 10e-6, 10e-6, 10e-6, 1e-5])
+    MIN_NR_BPMS = 3
+
+    def __init__(self, fit_traj, acc, tunes=None):
+        """."""
+        self.fit_traj = fit_traj
+        self.acc = acc.upper()
+        self.tunes = None if tunes is None else tuple(tunes)
+        self.vec_ref = np.zeros(5)
+        self.traj_ref = None
+        self.matrix = None
+        self._pinvs = dict()
+
+    @property
+    def nr_bpms(self):
+        """."""
+        return len(self.fit_traj.bpm_idx)
+
+    @property
+    def filename(self):
+        """Cache file name or None if model tunes are unknown."""
+        if self.tunes is None:
+            return None
+        fname = 'respmat_{:s}_nux{:.4f}_nuy{:.4f}.npz'.format(
+            self.acc, *self.tunes)
+        return _os.path.join(_get_cache_dir('trajfit'), fname)
+
+    @property
+    def isready(self):
+        """."""
+        return self.matrix is not None
+
+    def build(self):
+        """Calculate response matrix from the model."""
+        nbpm = self.nr_bpms
+        self.traj_ref = np.hstack(
+            self.fit_traj.calc_traj(*self.vec_ref, size=nbpm))
+        mat = np.zeros((2*nbpm, self.vec_ref.size))
+        for i, dlt in enumerate(self.DELTAS):
+            vec = self.vec_ref.copy()
+            vec[i] += dlt/2
+            trajp = np.hstack(self.fit_traj.calc_traj(*vec, size=nbpm))
+            vec[i] -= dlt
+            trajn = np.hstack(self.fit_traj.calc_traj(*vec, size=nbpm))
+            mat[:, i] = (trajp - trajn) / dlt
+        self.matrix = mat
+        self._pinvs = dict()
+
+    def save(self):
+        """Save response matrix in the cache directory."""
+        fname = self.filename
+        if fname is None or not self.isready:
+            return
+        np.savez(
+            fname, matrix=self.matrix, traj_ref=self.traj_ref,
+            vec_ref=self.vec_ref)
+
+    def load(self):
+        """Load response matrix from the cache directory.
+
+        Returns:
+            bool: whether a valid matrix was found.
+
+        """
+        fname = self.filename
+        if fname is None or not _os.path.isfile(fname):
+            return False
+        try:
+            with np.load(fname) as data:
+                matrix = data['matrix']
+                traj_ref = data['traj_ref']
+                vec_ref = data['vec_ref']
+        except (OSError, KeyError, ValueError) as err:
+            _log.warning('Could not load response matrix: ' + str(err))
+            return False
+        if matrix.shape != (2*self.nr_bpms, self.vec_ref.size):
+            return False
+        self.matrix, self.traj_ref, self.vec_ref = matrix, traj_ref, vec_ref
+        self._pinvs = dict()
+        return True
+
+    def load_or_build(self):
+        """Load response matrix from disk or calculate and save it."""
+        if self.load():
+            return
+        self.build()
+        try:
+            self.save()
+        except OSError as err:
+            _log.warning('Could not save response matrix: ' + str(err))
+
+    def get_submatrix(self, size):
+        """Response matrix rows of the first size BPMs of each plane."""
+        nbpm = self.nr_bpms
+        return np.vstack([self.matrix[:size], self.matrix[nbpm:nbpm+size]])
+
+    def get_pinv(self, size):
+        """Pseudo-inverse of the response matrix of the first size BPMs."""
+        pinv = self._pinvs.get(size)
+        if pinv is None:
+            pinv = np.linalg.pinv(self.get_submatrix(size))
+            self._pinvs[size] = pinv
+        return pinv
+
+    def calc_trajs(self, vecs, size=None):
+        """Calculate trajectories of many initial conditions at once.
+
+        Args:
+            vecs (numpy.ndarray): (N, 5) initial conditions.
+            size (int, optional): number of BPMs. Defaults to all.
+
+        Returns:
+            numpy.ndarray: (N, 2*size) horizontal and vertical
+                trajectories [m], concatenated.
+
+        """
+        if not self.isready:
+            self.load_or_build()
+        nbpm = self.nr_bpms
+        size = nbpm if size is None else size
+        ref = np.hstack(
+            [self.traj_ref[:size], self.traj_ref[nbpm:nbpm+size]])
+        dvecs = np.atleast_2d(vecs) - self.vec_ref
+        return ref + dvecs @ self.get_submatrix(size).T
+
+    def fit(self, trjx, trjy):
+        """Fit trajectory with the linear model.
+
+        Args:
+            trjx (numpy.ndarray): horizontal trajectory [m].
+            trjy (numpy.ndarray): vertical trajectory [m].
+
+        Returns:
+            vec (numpy.ndarray): fitted (x0, x0', y0, y0', delta).
+            chi (float): RMS of fitting residue [m].
+            trjx_fit (numpy.ndarray): fitted horizontal trajectory [m].
+            trjy_fit (numpy.ndarray): fitted vertical trajectory [m].
+
+        """
+        if not self.isready:
+            self.load_or_build()
+        size = trjx.size
+        if size < self.MIN_NR_BPMS:
+            raise ValueError('Too few BPMs for linear fitting.')
+        nbpm = self.nr_bpms
+        ref = np.hstack(
+            [self.traj_ref[:size], self.traj_ref[nbpm:nbpm+size]])
+        dtraj = np.hstack([trjx, trjy]) - ref
+        dvec = self.get_pinv(size) @ dtraj
+        traj_fit = ref + self.get_submatrix(size) @ dvec
+        chi = np.sqrt(np.mean((traj_fit - ref - dtraj)**2))
+        return self.vec_ref + dvec, chi, traj_fit[:size], traj_fit[size:]
+
+    def fit_batch(self, trjx, trjy, valid=None):
+        """Fit a stack of trajectories at once with the linear model.
+
+        The normal equations of all shots are assembled with a single
+        matrix product and solved as a stack of 5x5 systems, so the cost
+        is roughly independent of the number of shots.
+
+        Args:
+            trjx (numpy.ndarray): (N, nbpm) horizontal trajectories [m].
+            trjy (numpy.ndarray): (N, nbpm) vertical trajectories [m].
+            valid (numpy.ndarray, optional): (N, nbpm) boolean mask of the
+                BPMs to be considered in each shot. Defaults to all BPMs
+                with finite values.
+
+        Returns:
+            vecs (numpy.ndarray): (N, 5) fitted (x0, x0', y0, y0', delta).
+            chis (numpy.ndarray): (N, ) RMS of fitting residues [m].
+
+        """
+        if not self.isready:
+            self.load_or_build()
+        nbpm = self.nr_bpms
+        trjx = np.atleast_2d(trjx)[:, :nbpm]
+        trjy = np.atleast_2d(trjy)[:, :nbpm]
+        size = trjx.shape[1]
+        mat = self.get_submatrix(size)
+        ref = np.hstack(
+            [self.traj_ref[:size], self.traj_ref[nbpm:nbpm+size]])
+
+        dtraj = np.hstack([trjx, trjy]) - ref
+        if valid is None:
+            valid = np.isfinite(dtraj)
+        else:
+            valid = np.atleast_2d(valid)[:, :size]
+            valid = np.hstack([valid, valid]) & np.isfinite(dtraj)
+        wgt = valid.astype(float)
+        dtraj = np.where(valid, dtraj, 0.0)
+
+        npar = mat.shape[1]
+        outer = (mat[:, :, None] * mat[:, None, :]).reshape(-1, npar*npar)
+        mtm = (wgt @ outer).reshape(-1, npar, npar)
+        mtb = (wgt * dtraj) @ mat
+        dvecs = (np.linalg.pinv(mtm) @ mtb[:, :, None])[:, :, 0]
+
+        res = (dvecs @ mat.T - dtraj) * wgt
+        nrpts = np.maximum(wgt.sum(axis=1), 1)
+        chis = np.sqrt((res*res).sum(axis=1) / nrpts)
+        return self.vec_ref + dvecs, chis
@@ -0,0 +1,360 @@
+"""Fitting service sharing injection trajectory fits among interfaces.
+
+A single headless process fits the SOFB trajectory once per shot and
+publishes the results to any number of clients connected through
+multiprocessing.connection sockets. Interfaces in viewer mode only
+subscribe to the results, so opening more of them does not increase the
+load of fitting.
+
+Messages are pickled, so connections must only be accepted from trusted
+clients. They are authenticated with a key taken from the environment
+variable SIRIUSHLAFAC_TRAJFIT_AUTHKEY or, if it is not defined, from a
+file in the cache directory, readable only by its owner, which is
+created with a random key the first time. The service listens on
+localhost by default.
+"""
+
+import os as _os
+import stat as _stat
+import time as _time
+import secrets as _secrets
+import queue as _queue
+import logging as _log
+from threading import Thread as _Thread, Event as _Event, Lock as _Lock
+from multiprocessing import AuthenticationError as _AuthenticationError
+from multiprocessing.connection import Listener as _Listener, \
+    Client as _Client
+
+from ..cache import get_cache_dir as _get_cache_dir
+from .batch import create_fitter
+from .fitting import convert_sofb_traj
+from .sync import FrameSynchronizer
+from .worker import LatestWinsQueue
+
+DEFAULT_PORTS = dict(SI=6070, BO=6071)
+AUTHKEY_ENV = 'SIRIUSHLAFAC_TRAJFIT_AUTHKEY'
+AUTHKEY_FILE = 'authkey'
+PUBLISHED_KEYS = (
+    'vec', 'chi', 'nr_iter', 'method', 'warm_start', 'fit_time', 'trjx',
+    'trjy', 'trjs', 'trjx_fit', 'trjy_fit', 'bpmpos', 'unreliable',
+    'timestamp', 'tunes')
+
+
+def get_address(acc, host='localhost', port=None):
+    """Return socket address of the fitting service of the accelerator."""
+    if port is None:
+        port = DEFAULT_PORTS[acc.upper()]
+    return (host, int(port))
+
+
+def get_authkey():
+    """Return authentication key of the fitting service connections.
+
+    The key is taken from the AUTHKEY_ENV environment variable or from
+    the AUTHKEY_FILE of the trajfit cache directory, which is created
+    with a random key, readable only by the user, if it does not exist.
+
+    Raises:
+        PermissionError: if the key file is accessible by other users.
+
+    Returns:
+        bytes: key.
+
+    """
+    key = _os.environ.get(AUTHKEY_ENV)
+    if key:
+        return key.encode()
+    fname = _os.path.join(_get_cache_dir('trajfit'), AUTHKEY_FILE)
+    try:
+        fd = _os.open(fname, _os.O_WRONLY | _os.O_CREAT | _os.O_EXCL, 0o600)
+    except FileExistsError:
+        pass
+    else:
+        with _os.fdopen(fd, 'w') as fil:
+            fil.write(_secrets.token_hex(32))
+        _log.info(f'Created fitting service key file {fname:s}.')
+    mode = _os.stat(fname).st_mode
+    if mode & (_stat.S_IRWXG | _stat.S_IRWXO):
+        raise PermissionError(
+            f'Key file {fname:s} must be accessible only by its owner.')
+    with open(fname, 'r') as fil:
+        key = fil.read().strip()
+    if not key:
+        raise PermissionError(f'Key file {fname:s} is empty.')
+    return key.encode()
+
+
+class _ClientSender(_Thread):
+    """Send results to one client, dropping stale ones if it is slow."""
+
+    def __init__(self, conn, on_close):
+        super().__init__(daemon=True)
+        self.conn = conn
+        self.queue = LatestWinsQueue()
+        self._on_close = on_close
+        self._stop_evt = _Event()
+
+    def stop(self):
+        self._stop_evt.set()
+
+    def run(self):
+        while not self._stop_evt.is_set():
+            try:
+                msg = self.queue.get(timeout=0.2)
+            except _queue.Empty:
+                continue
+            try:
+                self.conn.send(msg)
+            except (OSError, EOFError, ValueError):
+                break
+        self.conn.close()
+        self._on_close(self)
+
+
+class FitPublisher:
+    """Accept client connections and publish fitting results to them.
+
+    Each client is served by its own thread, so a slow client only drops
+    results for itself and never delays the fitting loop.
+    """
+
+    def __init__(self, address, authkey=None):
+        """."""
+        self.address = address
+        self._authkey = authkey or get_authkey()
+        self._listener = None
+        self._senders = set()
+        self._lock = _Lock()
+        self._thread = None
+        self._closed = _Event()
+
+    @property
+    def nr_clients(self):
+        """."""
+        return len(self._senders)
+
+    @property
+    def nr_dropped(self):
+        """Number of results dropped by slow clients."""
+        with self._lock:
+            return sum(snd.queue.nr_dropped for snd in self._senders)
+
+    def start(self):
+        """Start listening to connections."""
+        if not self.address[0]:
+            _log.warning(
+                'Listening on all interfaces, any client with the key can '
+                'connect.')
+        self._listener = _Listener(self.address, authkey=self._authkey)
+        self._thread = _Thread(target=self._accept, daemon=True)
+        self._thread.start()
+        _log.info('Publishing fitting results at {:s}:{:d}'.format(
+            *self.address))
+
+    def close(self):
+        """Stop listening and close all connections."""
+        if self._listener is not None:
+            # NOTE: closing the listener does not interrupt a blocking
+            # accept, so the accepting thread is woken by a connection.
+            self._closed.set()
+            host, port = self.address
+            try:
+                _Client(
+                    (host or 'localhost', port), authkey=self._authkey).close()
+            except (OSError, EOFError):
+                pass
+            self._thread.join()
+            self._listener.close()
+        with self._lock:
+            for snd in self._senders:
+                snd.stop()
+
+    def publish(self, res):
+        """Send the published keys of a fitting result to all clients."""
+        msg = {key: res[key] for key in PUBLISHED_KEYS if key in res}
+        with self._lock:
+            for snd in self._senders:
+                snd.queue.put(msg)
+
+    def _accept(self):
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            except OSError:
+                # listener was closed.
+                return
+            except Exception as err:
+                # failed authentication or handshake of a single client.
+                _log.warning('Refused connection: ' + str(err))
+                continue
+            if self._closed.is_set():
+                conn.close()
+                return
+            snd = _ClientSender(conn, self._remove)
+            with self._lock:
+                self._senders.add(snd)
+            snd.start()
+            _log.info(f'Client connected ({self.nr_clients:d} clients).')
+
+    def _remove(self, snd):
+        with self._lock:
+            self._senders.discard(snd)
+        _log.info(f'Client disconnected ({self.nr_clients:d} clients).')
+
+
+class FitSubscriber:
+    """Client receiving fitting results from the fitting service."""
+
+    def __init__(self, address, authkey=None):
+        """."""
+        self.address = address
+        self._authkey = authkey or get_authkey()
+        self._conn = None
+
+    @property
+    def connected(self):
+        """."""
+        return self._conn is not None
+
+    def connect(self):
+        """Connect to the service.
+
+        Raises:
+            multiprocessing.AuthenticationError: if the service refused
+                the key. Retrying is useless in this case.
+
+        Returns:
+            bool: whether connection succeeded.
+
+        """
+        try:
+            self._conn = _Client(self.address, authkey=self._authkey)
+        except (OSError, EOFError) as err:
+            _log.debug('Could not connect to fitting service: ' + str(err))
+            self._conn = None
+        except _AuthenticationError as err:
+            self._conn = None
+            raise _AuthenticationError(
+                'Fitting service refused the key (' + str(err) + '). Use '
+                f'the key of the service, with {AUTHKEY_ENV:s}.') from err
+        return self.connected
+
+    def close(self):
+        """."""
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = None
+
+    def recv(self, timeout=None):
+        """Receive newest fitting result.
+
+        Results already waiting in the connection are skipped, so the
+        client always gets the latest one.
+
+        Args:
+            timeout (float, optional): time to wait in seconds. Defaults to
+                None, which waits forever.
+
+        Raises:
+            ConnectionError: if not connected or connection is lost.
+
+        Returns:
+            dict: fitting result or None if timeout expired.
+
+        """
+        if self._conn is None:
+            raise ConnectionError('Not connected.')
+        res = None
+        try:
+            if self._conn.poll(timeout):
+                res = self._conn.recv()
+            while res is not None and self._conn.poll(0):
+                res = self._conn.recv()
+        except (OSError, EOFError) as err:
+            self.close()
+            raise ConnectionError(str(err))
+        return res
+
+
+class FitService:
+    """Headless process fitting the SOFB trajectory of each shot.
+
+    Complete SOFB frames are assembled by a FrameSynchronizer, exactly as
+    in the automatic mode of the interface, fitted at most max_rate times
+    per second (no limit if 0) and published by a FitPublisher.
+    """
+
+    def __init__(
+            self, acc, address=None, authkey=None, tunes=None,
+            fast_fit=False, tol=100e-6, max_iter=10, thres=0.1,
+            max_rate=10.0):
+        """."""
+        self.acc = acc.upper()
+        self.address = address or get_address(self.acc)
+        self.tunes = tunes
+        self.max_rate = max_rate
+        self.fitter = None
+        self.publisher = FitPublisher(self.address, authkey=authkey)
+        self._settings = dict(
+            fast_fit=fast_fit, tol=tol, max_iter=max_iter, thres=thres)
+        self._queue = LatestWinsQueue()
+        self._sync = FrameSynchronizer(self._queue.put)
+        self._stop_evt = _Event()
+        self.nr_processed = 0
+
+    def setup(self):
+        """Build model and fitter, connected to SOFB."""
+        tini = _time.perf_counter()
+        self.fitter = create_fitter(
+            self.acc, tunes=self.tunes, isonline=True, **self._settings)
+        self.fitter.warm_start = True
+        _log.info('Model built in {:.1f} s.'.format(
+            _time.perf_counter() - tini))
+
+    def run(self):
+        """Run service until interrupted."""
+        if self.fitter is None:
+            self.setup()
+        cbs = self._sync.connect(self.fitter.fit_traj.devices['sofb'])
+        self.publisher.start()
+        tlast = 0.0
+        try:
+            while not self._stop_evt.is_set():
+                if self.max_rate > 0:
+                    dtime = tlast + 1/self.max_rate - _time.perf_counter()
+                    if dtime > 0 and self._stop_evt.wait(dtime):
+                        break
+                try:
+                    frame = self._queue.get(timeout=0.2)
+                except _queue.Empty:
+                    continue
+                tlast = _time.perf_counter()
+                self._process(frame)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._sync.disconnect(cbs)
+            self.publisher.close()
+
+    def stop(self):
+        """."""
+        self._stop_evt.set()
+
+    def _process(self, frame):
+        try:
+            res = self.fitter.fit(*convert_sofb_traj(
+                frame['x'], frame['y'], frame['sum'],
+                self.fitter.count_rel_thres))
+        except Exception as err:
+            _log.error('Problem fitting trajectory.')
+            _log.error(str(err))
+            return
+        self.publisher.publish(res)
+        self.nr_processed += 1
+        if not self.nr_processed % 100:
+            _log.info(
+                f'{self.nr_processed:d} fits, '
+                f'{self._queue.nr_dropped:d} shots dropped, '
+                f'{self._sync.nr_incomplete:d} incomplete and '
+                f'{self._sync.nr_mismatched:d} mismatched frames, '
+                f'{self.publisher.nr_clients:d} clients.')
@@ -0,0 +1,114 @@
+"""Synchronization of the SOFB trajectory PVs of each shot.
+
+SOFB publishes the horizontal and vertical trajectories and the BPM sum
+of each shot in separate PVs, whose monitor callbacks arrive in any
+order and in different threads. FrameSynchronizer pairs them by
+timestamp and delivers complete frames as soon as the last one arrives.
+"""
+
+import logging as _log
+from threading import Lock as _Lock
+
+import numpy as np
+
+SOFB_PVS = dict(
+    x='MTurnIdxOrbX-Mon', y='MTurnIdxOrbY-Mon', sum='MTurnIdxSum-Mon')
+
+
+class FrameSynchronizer:
+    """Assemble frames from values of several PVs with equal timestamps.
+
+    A frame is complete when all keys have a value with timestamps
+    within tolerance. Partial frames are discarded and counted when:
+        - a new value of a key already in the frame arrives before the
+          frame is complete (nr_incomplete);
+        - a value arrives with timestamp differing by more than
+          tolerance from the values already in the frame (nr_mismatched).
+
+    The callback receives a dict with the value of each key, converted to
+    numpy arrays, and 'timestamp', the newest timestamp of the frame. It
+    runs in the thread of the update completing the frame.
+    """
+
+    def __init__(self, callback, keys=tuple(SOFB_PVS), tolerance=0.01):
+        """."""
+        self.keys = tuple(keys)
+        self.tolerance = tolerance
+        self._callback = callback
+        self._lock = _Lock()
+        self._slots = dict()
+        self.nr_frames = 0
+        self.nr_incomplete = 0
+        self.nr_mismatched = 0
+
+    def reset_counters(self):
+        """."""
+        with self._lock:
+            self.nr_frames = 0
+            self.nr_incomplete = 0
+            self.nr_mismatched = 0
+
+    def update(self, key, value, timestamp):
+        """Update value of key.
+
+        Args:
+            key (str): one of keys.
+            value (numpy.ndarray): new value.
+            timestamp (float): timestamp of the value.
+
+        """
+        with self._lock:
+            if key in self._slots:
+                self.nr_incomplete += 1
+                self._slots = dict()
+            elif any(
+                    abs(tim - timestamp) > self.tolerance
+                    for _, tim in self._slots.values()):
+                self.nr_mismatched += 1
+                self._slots = dict()
+            self._slots[key] = (value, timestamp)
+            if len(self._slots) < len(self.keys):
+                return
+            slots, self._slots = self._slots, dict()
+            self.nr_frames += 1
+
+        frame = {key: np.array(val) for key, (val, _) in slots.items()}
+        frame['timestamp'] = max(tim for _, tim in slots.values())
+        try:
+            self._callback(frame)
+        except Exception as err:
+            _log.error('Problem processing frame: ' + str(err))
+
+    def get_pv_callback(self, key):
+        """Return PV monitor callback updating key."""
+        def _callback(*args, value=None, timestamp=None, **kwargs):
+            _ = args, kwargs
+            if value is not None:
+                self.update(key, value, timestamp)
+        return _callback
+
+    def connect(self, device, pvs=None):
+        """Add callbacks to the PVs of device.
+
+        Args:
+            device (siriuspy.devices.Device): device with the PVs.
+            pvs (dict, optional): PV name of each key. Defaults to
+                SOFB_PVS.
+
+        Returns:
+            list: (pv, index) of each added callback, to be used by
+                disconnect.
+
+        """
+        pvs = pvs or SOFB_PVS
+        cbs = []
+        for key in self.keys:
+            pvo = device.pv_object(pvs[key])
+            cbs.append((pvo, pvo.add_callback(self.get_pv_callback(key))))
+        return cbs
+
+    @staticmethod
+    def disconnect(cbs):
+        """Remove callbacks added by connect."""
+        for pvo, idx in cbs:
+            pvo.remove_callback(idx)
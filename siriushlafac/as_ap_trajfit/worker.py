@@ -0,0 +1,416 @@
+"""Fitting worker thread of the Application Interface."""
+
+import time as _time
+import queue as _queue
+import logging as _log
+from threading import Condition as _Condition, Event as _Event, \
+    Semaphore as _Semaphore, Thread as _Thread
+from multiprocessing import AuthenticationError as _AuthenticationError
+
+from qtpy.QtCore import QObject, QThread, Signal
+
+
+class LatestWinsQueue:
+    """Single slot queue: a new item replaces the one still pending.
+
+    Replaced items are counted as dropped. It is safe to put items from
+    any thread, including EPICS callback threads.
+    """
+
+    def __init__(self):
+        """."""
+        self._cond = _Condition()
+        self._item = None
+        self._pending = False
+        self.nr_dropped = 0
+
+    @property
+    def pending(self):
+        """Whether there is an item waiting to be consumed."""
+        return self._pending
+
+    def put(self, item, timeout=None):
+        """Put item in the queue, dropping the pending one.
+
+        Args:
+            item (object): item to be put.
+            timeout (float, optional): if given, wait up to timeout
+                seconds for the pending item to be consumed instead of
+                dropping it. Defaults to None.
+
+        Returns:
+            bool: whether a pending item was dropped or, with timeout,
+                whether the item was put.
+
+        """
+        with self._cond:
+            if timeout is not None:
+                if not self._cond.wait_for(
+                        lambda: not self._pending, timeout):
+                    return False
+            dropped = self._pending
+            self.nr_dropped += int(dropped)
+            self._item = item
+            self._pending = True
+            self._cond.notify_all()
+        return dropped if timeout is None else True
+
+    def get(self, timeout=None):
+        """Get newest item, waiting up to timeout seconds.
+
+        Raises:
+            queue.Empty: if no item arrives within timeout.
+
+        """
+        with self._cond:
+            if not self._pending:
+                self._cond.wait(timeout)
+            if not self._pending:
+                raise _queue.Empty
+            item, self._item = self._item, None
+            self._pending = False
+            self._cond.notify_all()
+        return item
+
+    def clear(self):
+        """Drop pending item without counting it."""
+        with self._cond:
+            self._item = None
+            self._pending = False
+
+
+class FitTrajWorker(QThread):
+    """Thread running trajectory fits requested by the interface.
+
+    Only the newest request is processed: requests arriving while a fit
+    is running replace each other and the stale ones are dropped. Fits
+    start at most max_rate times per second (no limit if 0), so requests
+    arriving faster are dropped as well. Results are delivered through
+    Qt signals, to be consumed by widgets living in the GUI thread.
+    """
+
+    fittingDone = Signal(dict)
+    fittingError = Signal(str)
+    statusChanged = Signal(str)
+    countersChanged = Signal(int, int)
+
+    def __init__(self, fitter, parent=None):
+        """."""
+        super().__init__(parent)
+        self.fitter = fitter
+        self._queue = LatestWinsQueue()
+        self._stop_evt = _Event()
+        self.nr_processed = 0
+        self.max_rate = 0.0
+
+    @property
+    def nr_dropped(self):
+        """Number of requests dropped because a newer one arrived."""
+        return self._queue.nr_dropped
+
+    def submit(self, trajs=None, timeout=None):
+        """Request a new fit.
+
+        Args:
+            trajs (tuple, optional): (trjx, trjy, trjs) to be fitted. If
+                None, the trajectory is read from SOFB. Defaults to None.
+            timeout (float, optional): if given, wait up to timeout
+                seconds for the pending request to be taken by the
+                thread, instead of dropping it. Defaults to None.
+
+        Returns:
+            bool: whether the request was queued. Always True without
+                timeout.
+
+        """
+        queued = self._queue.put(trajs, timeout=timeout)
+        self.countersChanged.emit(self.nr_processed, self.nr_dropped)
+        return queued or timeout is None
+
+    def reset_counters(self):
+        """."""
+        self.nr_processed = 0
+        self._queue.nr_dropped = 0
+        self.countersChanged.emit(self.nr_processed, self.nr_dropped)
+
+    def stop(self):
+        """Stop thread and wait for it to finish."""
+        self._stop_evt.set()
+        self.wait()
+
+    def run(self):
+        """."""
+        tlast = 0.0
+        while not self._stop_evt.is_set():
+            if self.max_rate > 0:
+                # requests arriving while waiting replace each other.
+                dtime = tlast + 1/self.max_rate - _time.perf_counter()
+                if dtime > 0 and self._stop_evt.wait(dtime):
+                    break
+            try:
+                trajs = self._queue.get(timeout=0.2)
+            except _queue.Empty:
+                continue
+            tlast = _time.perf_counter()
+            try:
+                self._process(trajs)
+            except Exception as err:
+                _log.error('Problem fitting trajectory.')
+                _log.error(str(err))
+                self.statusChanged.emit('Fitting failed!')
+                self.fittingError.emit(str(err))
+            self.nr_processed += 1
+            self.countersChanged.emit(self.nr_processed, self.nr_dropped)
+
+    def _process(self, trajs):
+        self.statusChanged.emit('Fitting Trajectory...')
+        if trajs is None:
+            trajs = self.fitter.get_traj()
+        res = self.fitter.fit(*trajs)
+        self.statusChanged.emit('Done!')
+        self.fittingDone.emit(res)
+
+
+class TuneAdjustWorker(QThread):
+    """Thread running a model tune adjustment.
+
+    The adjustment function must return the achieved tunes, the number of
+    iterations and whether it converged.
+    """
+
+    adjustDone = Signal(float, float, int, bool)
+    adjustError = Signal(str)
+
+    def __init__(self, func, parent=None):
+        """."""
+        super().__init__(parent)
+        self._func = func
+
+    def run(self):
+        """."""
+        try:
+            tunes, nr_iter, converged = self._func()
+        except Exception as err:
+            _log.error('Problem adjusting model tunes.')
+            _log.error(str(err))
+            self.adjustError.emit(str(err))
+            return
+        self.adjustDone.emit(tunes[0], tunes[1], nr_iter, converged)
+
+
+class MultiTurnFitWorker(QThread):
+    """Thread reading and fitting all turns of the SOFB trajectory.
+
+    The fitting function must return the result of
+    InjTrajFitter.fit_batch.
+    """
+
+    fittingDone = Signal(dict)
+    fittingError = Signal(str)
+
+    def __init__(self, func, parent=None):
+        """."""
+        super().__init__(parent)
+        self._func = func
+
+    def run(self):
+        """."""
+        try:
+            res = self._func()
+        except Exception as err:
+            _log.error('Problem fitting multi-turn trajectory.')
+            _log.error(str(err))
+            self.fittingError.emit(str(err))
+            return
+        self.fittingDone.emit(res)
+
+
+class ModelLoader(QObject):
+    """Build the objects that are slow to create in a daemon thread.
+
+    The build function must return a dict, delivered by the loaded signal
+    to the GUI thread. The thread does not hold the application: a window
+    closed during the build discards the loader, which then only lets the
+    build finish in background, without emitting its result.
+    """
+
+    loaded = Signal(dict)
+    loadError = Signal(str)
+
+    def __init__(self, func, parent=None):
+        """."""
+        super().__init__(parent)
+        self._func = func
+        self._discarded = _Event()
+        self._thread = _Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """."""
+        self._thread.start()
+
+    def isRunning(self):
+        """."""
+        return self._thread.is_alive()
+
+    def discard(self):
+        """Do not emit the result of the build."""
+        self._discarded.set()
+
+    def _run(self):
+        try:
+            objs = self._func()
+        except Exception as err:
+            _log.error('Problem building model.')
+            _log.error(str(err))
+            if not self._discarded.is_set():
+                self.loadError.emit(str(err))
+            return
+        if not self._discarded.is_set():
+            self.loaded.emit(objs)
+
+
+class SubscriberWorker(QThread):
+    """Thread receiving fitting results published by the fitting service.
+
+    It reconnects periodically while the service is not reachable, but
+    stops if the service refuses the authentication key.
+    """
+
+    fittingDone = Signal(dict)
+    statusChanged = Signal(str)
+
+    RECONNECT_PERIOD = 2.0
+
+    def __init__(self, subscriber, parent=None):
+        """."""
+        super().__init__(parent)
+        self.subscriber = subscriber
+        self._stop_evt = _Event()
+
+    def stop(self):
+        """Stop thread and wait for it to finish."""
+        self._stop_evt.set()
+        self.wait()
+
+    def run(self):
+        """."""
+        addr = '{:s}:{:d}'.format(*self.subscriber.address)
+        while not self._stop_evt.is_set():
+            if not self.subscriber.connected:
+                try:
+                    connected = self.subscriber.connect()
+                except _AuthenticationError as err:
+                    _log.error(str(err))
+                    self.statusChanged.emit(str(err))
+                    break
+                if not connected:
+                    self.statusChanged.emit(
+                        f'Fitting service at {addr} not available.')
+                    self._stop_evt.wait(self.RECONNECT_PERIOD)
+                    continue
+                self.statusChanged.emit(f'Connected to {addr}.')
+            try:
+                res = self.subscriber.recv(timeout=0.2)
+            except ConnectionError:
+                self.statusChanged.emit(f'Connection to {addr} lost.')
+                continue
+            if res is not None:
+                self.fittingDone.emit(res)
+        self.subscriber.close()
+
+
+class ReplayWorker(QThread):
+    """Thread feeding frames of a trajectory recording to a callback.
+
+    Modes:
+        'realtime': frames are delivered with the recorded intervals,
+            divided by speed.
+        'max': frames are delivered as fast as the callback accepts
+            them: the next frame is delivered when the callback returns.
+        'step': each call to step delivers the next frame.
+
+    The callback receives the frame as returned by
+    TrajRecording.get_frame.
+    """
+
+    MODES = ('realtime', 'max', 'step')
+
+    frameChanged = Signal(int, int)
+
+    def __init__(self, recording, callback, mode='realtime', speed=1.0,
+                 start=0, parent=None):
+        """."""
+        super().__init__(parent)
+        if mode not in self.MODES:
+            raise ValueError('mode must be one of ' + ', '.join(self.MODES))
+        self.recording = recording
+        self.mode = mode
+        self.speed = speed
+        self.index = int(start)
+        self._callback = callback
+        self._stop_evt = _Event()
+        self._steps = _Semaphore(0)
+
+    def step(self):
+        """Deliver next frame, in step mode."""
+        self._steps.release()
+
+    @property
+    def stopping(self):
+        """Whether the thread was asked to stop."""
+        return self._stop_evt.is_set()
+
+    def stop(self):
+        """Stop thread and wait for it to finish."""
+        self._stop_evt.set()
+        self._steps.release()
+        self.wait()
+
+    def run(self):
+        """."""
+        nrframes = len(self.recording)
+        tref = wref = None
+        while not self._stop_evt.is_set() and self.index < nrframes:
+            frame = self.recording.get_frame(self.index)
+            if self.mode == 'step':
+                self._steps.acquire()
+                if self._stop_evt.is_set():
+                    break
+            elif self.mode == 'realtime':
+                if tref is None:
+                    tref, wref = frame[0], _time.perf_counter()
+                dtime = (frame[0] - tref)/self.speed
+                dtime -= _time.perf_counter() - wref
+                if dtime > 0 and self._stop_evt.wait(dtime):
+                    break
+            self._callback(frame)
+            self.index += 1
+            self.frameChanged.emit(self.index, nrframes)
+
+
+class ScanWorker(QThread):
+    """Thread running a residue landscape scan.
+
+    The scan function receives a progress callback and must return the
+    scan result dict.
+    """
+
+    scanDone = Signal(dict)
+    scanError = Signal(str)
+    progressChanged = Signal(int, int)
+
+    def __init__(self, func, parent=None):
+        """."""
+        super().__init__(parent)
+        self._func = func
+
+    def run(self):
+        """."""
+        try:
+            res = self._func(self.progressChanged.emit)
+        except Exception as err:
+            _log.error('Problem scanning residue.')
+            _log.error(str(err))
+            self.scanError.emit(str(err))
+            return
+        self.scanDone.emit(res)
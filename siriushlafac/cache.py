@@ -0,0 +1,45 @@
+"""Persistent cache of data calculated by the applications."""
+
+import os as _os
+import re as _re
+import pathlib as _pathlib
+
+
+def get_cache_dir(*subdirs):
+    """Return cache directory, creating it if necessary.
+
+    The base directory can be defined by the SIRIUSHLAFAC_CACHE_DIR
+    environment variable. It defaults to siriushlafac folder inside
+    XDG_CACHE_HOME or ~/.cache.
+
+    Args:
+        subdirs (str): subdirectories of the base cache directory.
+
+    Returns:
+        str: path to the cache directory.
+
+    """
+    base = _os.environ.get('SIRIUSHLAFAC_CACHE_DIR')
+    if not base:
+        base = _os.environ.get('XDG_CACHE_HOME') or _os.path.join(
+            _pathlib.Path.home().as_posix(), '.cache')
+        base = _os.path.join(base, 'siriushlafac')
+    path = _os.path.join(base, *subdirs)
+    _os.makedirs(path, exist_ok=True)
+    return path
+
+
+def get_cache_key(*parts):
+    """Join parts in a string that can be used as a file name.
+
+    Floats are written with 4 decimals and None as 'none'. Characters
+    other than letters, digits, '.', '-' and '_' are replaced by '_'.
+    """
+    strs = []
+    for part in parts:
+        if part is None:
+            part = 'none'
+        elif isinstance(part, float):
+            part = f'{part:.4f}'
+        strs.append(_re.sub(r'[^\w.\-]', '_', str(part)))
+    return '_'.join(strs)
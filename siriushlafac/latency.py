@@ -0,0 +1,139 @@
+"""Lightweight per-stage latency measurement."""
+
+import json as _json
+import time as _time
+import logging as _log
+from threading import Lock as _Lock
+
+import numpy as np
+
+
+class _NullStage:
+    """Context manager doing nothing, used when timing is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+
+    __slots__ = ('_timer', '_name', '_tini')
+
+    def __init__(self, timer, name):
+        self._timer = timer
+        self._name = name
+        self._tini = 0.0
+
+    def __enter__(self):
+        self._tini = _time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self._timer.record(self._name, _time.perf_counter() - self._tini)
+        return False
+
+
+class StageTimer:
+    """Keep rolling statistics of the duration of named stages.
+
+    Usage:
+        timer = StageTimer(enabled=True)
+        with timer.stage('do_fitting'):
+            ...
+
+    The last `window` durations of each stage are kept in preallocated
+    ring buffers. When disabled, stage returns a shared no-op context
+    manager, so the instrumentation costs one method call per stage.
+    """
+
+    def __init__(self, window=500, enabled=False):
+        """."""
+        self._window = int(window)
+        self._enabled = bool(enabled)
+        self._lock = _Lock()
+        self._buffers = dict()
+
+    @property
+    def enabled(self):
+        """."""
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, value):
+        self._enabled = bool(value)
+
+    def stage(self, name):
+        """Return context manager timing the stage name."""
+        if not self._enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, duration):
+        """Record a duration [s] of stage name."""
+        with self._lock:
+            buf = self._buffers.get(name)
+            if buf is None:
+                buf = [np.zeros(self._window), 0]
+                self._buffers[name] = buf
+            buf[0][buf[1] % self._window] = duration
+            buf[1] += 1
+
+    def clear(self):
+        """."""
+        with self._lock:
+            self._buffers = dict()
+
+    def get_stats(self):
+        """Return statistics of each stage.
+
+        Returns:
+            dict: for each stage, a dict with 'count', 'p50', 'p95' and
+                'max', the percentiles and maximum of the durations [s]
+                of the last `window` executions.
+
+        """
+        with self._lock:
+            bufs = {
+                name: (buf[0][:min(buf[1], self._window)].copy(), buf[1])
+                for name, buf in self._buffers.items()}
+        stats = dict()
+        for name, (vals, count) in bufs.items():
+            if not vals.size:
+                continue
+            p50, p95 = np.percentile(vals, [50, 95])
+            stats[name] = dict(
+                count=count, p50=float(p50), p95=float(p95),
+                max=float(vals.max()))
+        return stats
+
+    def format_stats(self, sep='\n'):
+        """Return statistics as text, with durations in ms."""
+        lines = []
+        for name, sta in self.get_stats().items():
+            lines.append(
+                f'{name}: p50={sta["p50"]*1e3:.2f} '
+                f'p95={sta["p95"]*1e3:.2f} max={sta["max"]*1e3:.2f} ms')
+        return sep.join(lines)
+
+    def dump(self, fname=None):
+        """Log statistics and optionally save them to a JSON file.
+
+        Args:
+            fname (str, optional): file name. Defaults to None.
+
+        """
+        stats = self.get_stats()
+        for line in self.format_stats(sep='\n').split('\n'):
+            if line:
+                _log.info(line)
+        if fname is not None:
+            with open(fname, 'w') as fil:
+                _json.dump(
+                    dict(timestamp=_time.time(), stats=stats), fil,
+                    indent=2)
@@ -0,0 +1,66 @@
+"""Analysis of coupling measurements with oversampled tunes.
+
+When the tunes of each point are averaged over several readings, the
+data of MeasCoupling also has 'tunes_std', the standard deviation of the
+readings, and 'nr_samples', the number of readings of each point. The
+fitting is then weighted by the standard errors of the mean tunes.
+"""
+
+import logging as _log
+
+import numpy as np
+
+from .fitting import calc_init_params, fit_coupling, sort_tunes, \
+    sort_tune_errors
+
+
+def get_tune_errors(data):
+    """Return (N, 2) standard errors of the mean tunes or None."""
+    std = data.get('tunes_std')
+    if std is None:
+        return None
+    std = np.asarray(std, dtype=float).reshape(-1, 2)
+    nrs = np.asarray(data.get('nr_samples', 1), dtype=float)
+    return std / np.sqrt(nrs).reshape(-1, 1)
+
+
+def process_data(meas_coup):
+    """Process measurement, weighting the fitting by the tune errors.
+
+    Data without tune errors, or with errors that are not all positive,
+    is processed by MeasCoupling.process_data. As there, the coupling
+    resolution of the measurement parameters is the initial coupling of
+    the fitting.
+
+    Args:
+        meas_coup (MeasCoupling): measurement object. Its analysis is
+            replaced by a dict with the keys of MeasCoupling.analysis,
+            'qcurr', 'tune1', 'tune2', 'fitted_param' and
+            'fitting_error', and also 'tune1_err', 'tune2_err' and
+            'chi2', the reduced chi^2 of the fitting.
+
+    """
+    data = meas_coup.data
+    errs = get_tune_errors(data)
+    if errs is None:
+        meas_coup.process_data()
+        return
+    if not np.all(errs > 0):
+        _log.warning('Tune errors are not all positive, fit not weighted.')
+        meas_coup.process_data()
+        return
+
+    curr = np.asarray(data['current'], dtype=float)
+    tunes = np.asarray(data['tunes'], dtype=float).reshape(-1, 2)
+    tune1, tune2 = sort_tunes(tunes[:, 0], tunes[:, 1])
+    params0 = calc_init_params(curr, tune1, tune2)
+    params0[-1] = meas_coup.params.coupling_resolution
+    res = fit_coupling(
+        curr, tunes[:, 0], tunes[:, 1], sigma1=errs[:, 0],
+        sigma2=errs[:, 1], params0=params0)
+    err1, err2 = sort_tune_errors(
+        tunes[:, 0], tunes[:, 1], errs[:, 0], errs[:, 1])
+    meas_coup.analysis = dict(
+        qcurr=curr, tune1=tune1, tune2=tune2, tune1_err=err1,
+        tune2_err=err2, fitted_param=dict(x=res['params']),
+        fitting_error=res['errors'], chi2=res['chi2'])
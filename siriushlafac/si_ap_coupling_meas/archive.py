@@ -0,0 +1,254 @@
+"""Storage and catalog of coupling measurement files.
+
+Measurements are saved in compressed numpy archives (.npz) with the
+arrays of the scan and a small JSON member with the parameters and the
+fitting results. Opening an archive only reads its table of contents and
+each member is decompressed when accessed, so the summary of a file is
+read without loading the scan data.
+
+The catalog indexes the measurements of a directory tree, either in this
+format or in the pickle files of MeasCoupling.save_data. It is cached on
+disk and updated incrementally, reading only new or modified files.
+"""
+
+import os as _os
+import json as _json
+import time as _time
+import logging as _log
+
+import numpy as np
+
+from apsuite.commisslib.meas_coupling_tune import MeasCoupling
+
+from ..cache import get_cache_dir, get_cache_key
+from .fitting import fit_coupling
+from .memo import SIDECAR_SUFFIX
+
+EXT = 'npz'
+PICKLE_EXT = 'pickle'
+FORMAT_VERSION = 1
+PARAMS_SAVED = (
+    'quadfam_name', 'nr_points', 'time_wait', 'neg_percent', 'pos_percent',
+    'coupling_resolution')
+SUMMARY_KEYS = (
+    'timestamp', 'family', 'nr_points', 'coupling', 'coupling_error')
+
+
+def get_family(qname):
+    """Return quadrupole family of a power supply name."""
+    return qname.split(':')[-1].split('-')[-1] if qname else ''
+
+
+def save_meas(fname, meas_coup):
+    """Save MeasCoupling data, parameters and fitting in an npz file.
+
+    Args:
+        fname (str): file name.
+        meas_coup (MeasCoupling): measurement object.
+
+    """
+    data, anl = meas_coup.data, meas_coup.analysis
+    params = {
+        key: getattr(meas_coup.params, key) for key in PARAMS_SAVED}
+    metadata = dict(
+        version=FORMAT_VERSION, params=params,
+        timestamp=float(data.get('timestamp', _time.time())),
+        qname=data.get('qname', ''))
+    arrays = dict(
+        current=np.asarray(data['current'], dtype=float),
+        tunes=np.asarray(data['tunes'], dtype=float).reshape(-1, 2))
+    if data.get('tunes_std') is not None:
+        arrays['tunes_std'] = np.asarray(data['tunes_std'], dtype=float)
+        arrays['nr_samples'] = np.asarray(data['nr_samples'], dtype=int)
+        if data.get('tunes_samples') is not None:
+            arrays['tunes_samples'] = np.vstack(data['tunes_samples'])
+    if 'fitted_param' in anl:
+        arrays['fitted_param'] = np.asarray(
+            anl['fitted_param']['x'], dtype=float)
+        arrays['fitting_error'] = np.asarray(
+            anl['fitting_error'], dtype=float)
+    np.savez_compressed(
+        fname, metadata=np.array(_json.dumps(metadata)), **arrays)
+
+
+def load_meas(fname):
+    """Load file saved by save_meas or MeasCoupling.save_data.
+
+    Returns:
+        dict: 'params', 'data' and 'analysis' dicts; the latter has
+            'fitted_param' and 'fitting_error' if they were saved.
+
+    """
+    if not fname.endswith(EXT):
+        content = MeasCoupling.load_data(fname)
+        return dict(
+            params=dict(content.get('params', dict())),
+            data=dict(content.get('data', dict())),
+            analysis=dict())
+
+    with np.load(fname, allow_pickle=False) as npz:
+        metadata = _json.loads(str(npz['metadata']))
+        data = dict(
+            timestamp=metadata['timestamp'], qname=metadata['qname'],
+            current=npz['current'], tunes=npz['tunes'])
+        if 'tunes_std' in npz.files:
+            data.update(
+                tunes_std=npz['tunes_std'], nr_samples=npz['nr_samples'])
+        if 'tunes_samples' in npz.files:
+            data['tunes_samples'] = np.split(
+                npz['tunes_samples'], np.cumsum(data['nr_samples'])[:-1])
+        anl = dict()
+        if 'fitted_param' in npz.files:
+            anl = dict(
+                fitted_param=dict(x=npz['fitted_param']),
+                fitting_error=npz['fitting_error'])
+    return dict(params=metadata['params'], data=data, analysis=anl)
+
+
+def apply_meas(meas_coup, content):
+    """Apply content returned by load_meas to MeasCoupling."""
+    for key, val in content['params'].items():
+        if hasattr(meas_coup.params, key):
+            setattr(meas_coup.params, key, val)
+    meas_coup.data = content['data']
+    meas_coup.analysis = dict()
+
+
+def read_summary(fname):
+    """Return summary of a measurement file.
+
+    For npz files only the metadata and the fitting results are read.
+    Pickle files are fully loaded and, as they do not store the fitting,
+    the coupling is fit.
+
+    Returns:
+        dict: summary with SUMMARY_KEYS, or None if the file is not a
+            coupling measurement.
+
+    """
+    if fname.endswith(EXT):
+        with np.load(fname, allow_pickle=False) as npz:
+            if 'metadata' not in npz.files:
+                return None
+            metadata = _json.loads(str(npz['metadata']))
+            nr_points = int(npz['current'].size)
+            if 'fitted_param' in npz.files:
+                coup = abs(float(npz['fitted_param'][-1]))
+                coup_err = float(npz['fitting_error'][-1])
+            else:
+                coup, coup_err = _fit(npz['current'], npz['tunes'])
+        return dict(
+            timestamp=metadata['timestamp'],
+            family=get_family(metadata['qname']),
+            nr_points=nr_points, coupling=coup, coupling_error=coup_err)
+
+    content = MeasCoupling.load_data(fname)
+    data = content.get('data', dict())
+    if 'tunes' not in data or 'current' not in data:
+        return None
+    coup, coup_err = _fit(data['current'], data['tunes'])
+    return dict(
+        timestamp=float(
+            data.get('timestamp', _os.path.getmtime(fname))),
+        family=get_family(data.get('qname', '')),
+        nr_points=int(np.size(data['current'])),
+        coupling=coup, coupling_error=coup_err)
+
+
+def find_files(root):
+    """Return npz and pickle files of the directory tree, sorted.
+
+    Sidecar files of the analysis cache are not included.
+    """
+    exts = ('.' + EXT, '.' + PICKLE_EXT)
+    fnames = []
+    for dirpath, _, files in _os.walk(root):
+        fnames.extend(
+            _os.path.join(dirpath, fil) for fil in files
+            if fil.endswith(exts) and not fil.endswith(SIDECAR_SUFFIX))
+    return sorted(fnames)
+
+
+def _fit(curr, tunes):
+    tunes = np.asarray(tunes).reshape(-1, 2)
+    try:
+        res = fit_coupling(curr, tunes[:, 0], tunes[:, 1])
+    except (ValueError, np.linalg.LinAlgError):
+        return np.nan, np.nan
+    return float(res['coupling']), float(res['coupling_error'])
+
+
+class CouplingCatalog:
+    """Index of the coupling measurements in a directory tree.
+
+    Each entry has the file 'path' and the SUMMARY_KEYS. Files that are
+    not coupling measurements are remembered, so they are not read again
+    in the next updates.
+    """
+
+    def __init__(self, root):
+        """."""
+        self.root = _os.path.abspath(root)
+        self.fname = _os.path.join(
+            get_cache_dir('coupmeas'),
+            'catalog_' + get_cache_key(self.root) + '.json')
+        self._files = dict()
+        self._load()
+
+    @property
+    def entries(self):
+        """Coupling measurements, sorted by timestamp."""
+        entries = [
+            dict(path=path, **info['summary'])
+            for path, info in self._files.items() if info['summary']]
+        return sorted(entries, key=lambda ent: ent['timestamp'])
+
+    def update(self, progress=None):
+        """Read new and modified files and save catalog.
+
+        Args:
+            progress (callable, optional): called with the number of
+                files checked and the total.
+
+        Returns:
+            list: entries, see entries property.
+
+        """
+        fnames = find_files(self.root)
+        files = dict()
+        for i, fname in enumerate(fnames):
+            try:
+                stat = _os.stat(fname)
+            except OSError:
+                continue
+            info = self._files.get(fname)
+            if info is None or info['mtime'] != stat.st_mtime or \
+                    info['size'] != stat.st_size:
+                try:
+                    summ = read_summary(fname)
+                except Exception as err:
+                    _log.warning(f'Could not read {fname}: {err}')
+                    summ = None
+                info = dict(
+                    mtime=stat.st_mtime, size=stat.st_size, summary=summ)
+            files[fname] = info
+            if progress is not None:
+                progress(i + 1, len(fnames))
+        self._files = files
+        self._save()
+        return self.entries
+
+    def _load(self):
+        try:
+            with open(self.fname, 'r') as fil:
+                content = _json.load(fil)
+        except (OSError, ValueError):
+            return
+        if content.get('version') == FORMAT_VERSION:
+            self._files = content['files']
+
+    def _save(self):
+        tmp = f'{self.fname}.tmp{_os.getpid()}'
+        with open(tmp, 'w') as fil:
+            _json.dump(dict(version=FORMAT_VERSION, files=self._files), fil)
+        _os.replace(tmp, self.fname)
@@ -0,0 +1,175 @@
+"""Headless reprocessing of archived coupling measurements."""
+
+import os as _os
+import csv as _csv
+import time as _time
+import logging as _log
+import multiprocessing as _mp
+from datetime import datetime as _datetime
+
+import numpy as np
+
+from apsuite.commisslib.meas_coupling_tune import MeasCoupling
+
+from .analysis import process_data
+from .archive import find_files, load_meas, apply_meas, get_family
+from .fitting import PARAMS
+
+COLUMNS = (
+    'timestamp', 'date', 'family', 'coupling[%]', 'coupling_error[%]',
+    'nr_points') + PARAMS + tuple(par + '_error' for par in PARAMS) + (
+        'status', 'file')
+
+# MeasCoupling of each worker process, created by _init_worker.
+_MEAS = None
+_COUP_RES = None
+
+
+def process_file(meas_coup, fname, coupling_resolution=None):
+    """Process a measurement file, see analysis.process_data.
+
+    Args:
+        meas_coup (MeasCoupling): offline measurement object.
+        fname (str): file name.
+        coupling_resolution (float, optional): coupling resolution used
+            in the analysis. Defaults to the value saved in the file.
+
+    Returns:
+        list: row following COLUMNS, or None if the file is not a
+            coupling measurement. If the fitting failed, the fitting
+            columns are NaN and the status tells why.
+
+    """
+    content = load_meas(fname)
+    data = content['data']
+    if 'tunes' not in data or 'current' not in data:
+        return None
+    apply_meas(meas_coup, content)
+    if coupling_resolution is not None:
+        meas_coup.params.coupling_resolution = coupling_resolution
+    params = errors = np.full(len(PARAMS), np.nan)
+    status = 'ok'
+    meas_coup.analysis = dict()
+    try:
+        process_data(meas_coup)
+        anl = meas_coup.analysis
+        if 'fitted_param' in anl:
+            params = np.asarray(anl['fitted_param']['x'], dtype=float)
+            errors = np.asarray(anl['fitting_error'], dtype=float)
+        else:
+            status = 'failed: no fitting result'
+    except Exception as err:
+        status = f'failed: {err}'
+    if status != 'ok':
+        _log.warning(f'Could not fit {fname}, {status}')
+
+    tstamp = float(data.get('timestamp', _os.path.getmtime(fname)))
+    date = _time.strftime('%Y-%m-%d %H:%M:%S', _time.localtime(tstamp))
+    return [
+        tstamp, date, get_family(data.get('qname', '')),
+        abs(params[-1])*100, errors[-1]*100, int(np.size(data['current']))
+        ] + list(params) + list(errors) + [status, fname]
+
+
+def _init_worker(coupling_resolution):
+    global _MEAS, _COUP_RES
+    _MEAS = MeasCoupling(isonline=False)
+    _COUP_RES = coupling_resolution
+
+
+def _process_file_worker(fname):
+    try:
+        return process_file(_MEAS, fname, _COUP_RES)
+    except Exception as err:
+        _log.warning(f'Could not process {fname}: {err}')
+        return None
+
+
+def run_batch(directory, output, nrprocs=None, coupling_resolution=None):
+    """Reprocess all measurements in a directory using a process pool.
+
+    Args:
+        directory (str): directory searched recursively for npz and
+            pickle files.
+        output (str): name of the CSV file with the trend table, sorted
+            by timestamp.
+        nrprocs (int, optional): number of processes. Defaults to the
+            number of CPUs.
+        coupling_resolution (float, optional): coupling resolution used
+            in the analysis. Defaults to the value saved in each file.
+
+    Returns:
+        list: rows of the trend table.
+
+    """
+    fnames = find_files(directory)
+    if not fnames:
+        _log.warning('No files found in ' + directory)
+        return []
+    nrprocs = nrprocs or _os.cpu_count()
+    nrprocs = min(nrprocs, len(fnames))
+    chunk = max(1, len(fnames) // (4*nrprocs))
+    _log.info(
+        f'Processing {len(fnames):d} files in {nrprocs:d} processes.')
+
+    tini = _time.time()
+    rows = []
+    ctx = _mp.get_context('spawn')
+    with ctx.Pool(
+            processes=nrprocs, initializer=_init_worker,
+            initargs=(coupling_resolution, )) as pool:
+        results = pool.imap_unordered(
+            _process_file_worker, fnames, chunksize=chunk)
+        for i, row in enumerate(results):
+            if row is not None:
+                rows.append(row)
+            if not (i+1) % 100 or i+1 == len(fnames):
+                _log.info(f'{i+1:d}/{len(fnames):d} files done.')
+    rows.sort(key=lambda row: row[0])
+
+    with open(output, 'w', newline='') as fil:
+        writer = _csv.writer(fil)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+    nr_failed = sum(
+        row[COLUMNS.index('status')] != 'ok' for row in rows)
+    _log.info(
+        f'{len(rows):d} measurements processed in '
+        f'{_time.time()-tini:.1f} s, {nr_failed:d} failed.')
+    return rows
+
+
+def plot_trend(rows, fname):
+    """Save plot of the coupling of each family along time.
+
+    Args:
+        rows (list): rows of the trend table, see run_batch.
+        fname (str): image file name.
+
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as mplt
+    import matplotlib.dates as mdates
+
+    fig, axes = mplt.subplots(1, 1, figsize=(10, 5))
+    idx = COLUMNS.index
+    rows = [row for row in rows if row[idx('status')] == 'ok']
+    for fam in sorted({row[idx('family')] for row in rows}):
+        sel = [row for row in rows if row[idx('family')] == fam]
+        dates = [
+            _datetime.fromtimestamp(row[idx('timestamp')]) for row in sel]
+        axes.errorbar(
+            dates, [row[idx('coupling[%]')] for row in sel],
+            yerr=[row[idx('coupling_error[%]')] for row in sel],
+            fmt='o', capsize=3, label=fam or 'unknown')
+    axes.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
+    fig.autofmt_xdate()
+    axes.set_xlabel('Date')
+    axes.set_ylabel('Coupling [%]')
+    axes.set_title('SI Transverse Linear Coupling')
+    axes.grid(True, linestyle='--', alpha=0.5)
+    axes.legend(loc='best')
+    fig.tight_layout()
+    fig.savefig(fname, dpi=100)
+    mplt.close(fig)
@@ -0,0 +1,247 @@
+"""Bootstrap of the coupling fitting.
+
+The measured points are resampled with replacement many times and the
+model is fit to each resample. The spread of the fitted coupling gives
+a confidence interval that does not rely on the linearization of the
+least squares errors, which is unreliable for marginal data.
+
+A resample is represented by the number of times each point was drawn,
+used as weights of the residues, so all resamples share the same
+currents. This allows fitting a whole batch of resamples at once with a
+vectorized Levenberg-Marquardt, in which the model and its Jacobian are
+evaluated for all of them with a few array operations. Batches are
+distributed to a process pool when there are enough of them to pay
+for starting it; for the usual few thousand resamples fitting them in
+this process is much faster.
+"""
+
+import os as _os
+import time as _time
+import multiprocessing as _mp
+
+import numpy as np
+
+from .fitting import PARAMS, calc_normal_modes
+
+_NPARS = len(PARAMS)
+
+
+def calc_normal_modes_jac(params, curr):
+    """Normal mode tunes and their derivatives on the parameters.
+
+    Args:
+        params (numpy.ndarray): (B, 5) parameters, see fitting.PARAMS.
+        curr (numpy.ndarray): (N, ) quadrupole currents.
+
+    Returns:
+        tunes (numpy.ndarray): (B, 2*N) upper and lower mode tunes.
+        jac (numpy.ndarray): (B, 2*N, 5) derivatives of tunes.
+
+    """
+    coeff1, offset1, coeff2, offset2, coup = [
+        params[:, i, None] for i in range(_NPARS)]
+    fx_ = coeff1*curr + offset1
+    fy_ = coeff2*curr + offset2
+    diff = fx_ - fy_
+    sqrt = np.sqrt(diff**2 + coup**2)
+    sqrt = np.maximum(sqrt, np.finfo(float).tiny)
+    avg = (fx_ + fy_)/2
+    tunes = np.concatenate([avg + sqrt/2, avg - sqrt/2], axis=1)
+
+    dsd = diff/sqrt/2
+    dsc = coup/sqrt/2
+    curr = curr * np.ones_like(diff)
+    jac1 = np.stack([
+        curr*(0.5 + dsd), 0.5 + dsd, curr*(0.5 - dsd), 0.5 - dsd,
+        dsc], axis=-1)
+    jac2 = np.stack([
+        curr*(0.5 - dsd), 0.5 - dsd, curr*(0.5 + dsd), 0.5 + dsd,
+        -dsc], axis=-1)
+    return tunes, np.concatenate([jac1, jac2], axis=1)
+
+
+def fit_batch(curr, tune1, tune2, weights, params0, max_iter=50,
+              tol=1e-10):
+    """Fit the model to a batch of weighted data sets.
+
+    Args:
+        curr (numpy.ndarray): (N, ) quadrupole currents.
+        tune1 (numpy.ndarray): (N, ) upper mode tunes.
+        tune2 (numpy.ndarray): (N, ) lower mode tunes.
+        weights (numpy.ndarray): (B, 2*N) weights of the squared residues
+            of each data set, in the order of calc_normal_modes_jac.
+        params0 (numpy.ndarray): (5, ) initial parameters.
+        max_iter (int, optional): maximum number of iterations.
+            Defaults to 50.
+        tol (float, optional): relative decrease of the cost for
+            convergence. Defaults to 1e-10.
+
+    Returns:
+        params (numpy.ndarray): (B, 5) fitted parameters.
+        converged (numpy.ndarray): (B, ) whether each fitting converged.
+
+    """
+    meas = np.r_[tune1, tune2]
+    nrb = weights.shape[0]
+    params = np.tile(np.asarray(params0, dtype=float), (nrb, 1))
+    lamb = np.full(nrb, 1e-3)
+    converged = np.zeros(nrb, dtype=bool)
+    eye = np.eye(_NPARS)
+
+    tunes, jac = calc_normal_modes_jac(params, curr)
+    res = tunes - meas
+    cost = np.sum(weights*res**2, axis=1)
+    for _ in range(max_iter):
+        act = ~converged
+        if not act.any():
+            break
+        wjac = jac[act] * weights[act, :, None]
+        mat = np.einsum('bni,bnj->bij', wjac, jac[act])
+        grad = np.einsum('bni,bn->bi', wjac, res[act])
+        diag = np.einsum('bii->bi', mat)[:, :, None] * eye
+        mat = mat + lamb[act, None, None]*(diag + 1e-12*eye)
+        try:
+            step = np.linalg.solve(mat, -grad[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            break
+        new = params[act] + step
+        ntunes, njac = calc_normal_modes_jac(new, curr)
+        nres = ntunes - meas
+        ncost = np.sum(weights[act]*nres**2, axis=1)
+
+        better = ncost < cost[act]
+        idcs = np.nonzero(act)[0]
+        upd = idcs[better]
+        conv = np.abs(cost[act] - ncost) <= tol*cost[act]
+        params[upd] = new[better]
+        jac[upd], res[upd] = njac[better], nres[better]
+        cost[upd] = ncost[better]
+        lamb[upd] /= 10
+        lamb[idcs[~better]] *= 10
+        converged[idcs[conv | (lamb[idcs] > 1e10)]] = True
+    params[:, -1] = np.abs(params[:, -1])
+    return params, converged
+
+
+def resample_weights(nr_points, nr_boot, rng):
+    """Return (nr_boot, nr_points) number of draws of each point."""
+    idcs = rng.integers(0, nr_points, size=(nr_boot, nr_points))
+    idcs += np.arange(nr_boot)[:, None]*nr_points
+    counts = np.bincount(idcs.ravel(), minlength=nr_boot*nr_points)
+    return counts.reshape(nr_boot, nr_points).astype(float)
+
+
+def _boot_worker(args):
+    curr, tune1, tune2, wgts, params0, nr_boot, seed = args
+    rng = np.random.default_rng(seed)
+    counts = resample_weights(curr.size, nr_boot, rng)
+    weights = np.hstack([counts*wgts[:curr.size], counts*wgts[curr.size:]])
+    return fit_batch(curr, tune1, tune2, weights, params0)
+
+
+class Bootstrapper:
+    """Bootstrap the coupling fitting using a process pool.
+
+    The pool is only used for runs of at least min_pool_boot resamples.
+    It is started at the first of them and kept alive for the next ones.
+    Other runs, or all of them if nrprocs is 1, are fit in this process.
+    """
+
+    MIN_POOL_BOOT = 20000
+
+    def __init__(self, nrprocs=1, min_pool_boot=MIN_POOL_BOOT):
+        """.
+
+        Args:
+            nrprocs (int, optional): number of processes. None means the
+                number of CPUs. Defaults to 1.
+            min_pool_boot (int, optional): minimum number of resamples
+                to use the process pool. Defaults to MIN_POOL_BOOT.
+
+        """
+        self.nrprocs = nrprocs or _os.cpu_count()
+        self.min_pool_boot = min_pool_boot
+        self._pool = None
+
+    def close(self):
+        """Terminate process pool."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+    def run(self, curr, tune1, tune2, params0, nr_boot=2000, sigma1=None,
+            sigma2=None, conf=0.68, seed=None, batch=250, progress=None):
+        """Bootstrap fitting.
+
+        Args:
+            curr (numpy.ndarray): (N, ) quadrupole currents.
+            tune1 (numpy.ndarray): (N, ) upper mode tunes.
+            tune2 (numpy.ndarray): (N, ) lower mode tunes.
+            params0 (numpy.ndarray): parameters fitted to all data, used
+                as initial parameters.
+            nr_boot (int, optional): number of resamples. Defaults to
+                2000.
+            sigma1 (numpy.ndarray, optional): errors of tune1. If both
+                sigmas are given the residues are weighted.
+            sigma2 (numpy.ndarray, optional): errors of tune2.
+            conf (float, optional): confidence level. Defaults to 0.68.
+            seed (int, optional): random seed. Defaults to None.
+            batch (int, optional): number of resamples of each task.
+                Defaults to 250.
+            progress (callable, optional): called with the number of
+                resamples done and the total after each task.
+
+        Returns:
+            dict: 'params', (M, 5) parameters of the M converged
+                resamples, 'coupling', (M, ) their couplings,
+                'interval', the confidence interval of the coupling,
+                'conf', 'nr_boot', 'nr_failed' and 'boot_time'; also
+                'curr', a fine grid of currents, and 'band1' and
+                'band2', (2, K) confidence bands of the normal mode
+                tunes on this grid.
+
+        """
+        tini = _time.perf_counter()
+        curr, tune1, tune2 = [
+            np.asarray(val, dtype=float) for val in (curr, tune1, tune2)]
+        if sigma1 is not None and sigma2 is not None:
+            wgts = np.r_[1/np.asarray(sigma1)**2, 1/np.asarray(sigma2)**2]
+        else:
+            wgts = np.ones(2*curr.size)
+        seeds = np.random.SeedSequence(seed).spawn(
+            int(np.ceil(nr_boot/batch)))
+        tasks = [
+            (curr, tune1, tune2, wgts, params0,
+             min(batch, nr_boot - i*batch), sed)
+            for i, sed in enumerate(seeds)]
+
+        results = []
+        for res in self._map(tasks, nr_boot):
+            results.append(res)
+            if progress is not None:
+                progress(min(len(results)*batch, nr_boot), nr_boot)
+        params = np.vstack([res[0] for res in results])
+        conv = np.hstack([res[1] for res in results])
+        params = params[conv & np.all(np.isfinite(params), axis=1)]
+
+        alpha = (1 - conf)/2*100
+        fine = np.linspace(curr.min(), curr.max(), 10*curr.size)
+        modes1, modes2 = calc_normal_modes(params, fine)
+        return dict(
+            params=params, coupling=params[:, -1],
+            interval=np.percentile(params[:, -1], [alpha, 100-alpha]),
+            conf=conf, nr_boot=nr_boot, nr_failed=nr_boot - params.shape[0],
+            curr=fine,
+            band1=np.percentile(modes1, [alpha, 100-alpha], axis=0),
+            band2=np.percentile(modes2, [alpha, 100-alpha], axis=0),
+            boot_time=_time.perf_counter() - tini)
+
+    def _map(self, tasks, nr_boot):
+        if self.nrprocs == 1 or len(tasks) == 1 or \
+                nr_boot < self.min_pool_boot:
+            return map(_boot_worker, tasks)
+        if self._pool is None:
+            ctx = _mp.get_context('spawn')
+            self._pool = ctx.Pool(processes=self.nrprocs)
+        return self._pool.imap(_boot_worker, tasks)
@@ -0,0 +1,291 @@
+"""Fitting of the transverse coupling from tune crossing scans.
+
+Near the crossing of the horizontal and vertical tunes, the normal mode
+tunes are
+
+    nu_1,2 = (fx + fy)/2 +- sqrt((fx - fy)^2 + C^2)/2,
+
+where fx = coeff1*I + offset1 and fy = coeff2*I + offset2 are the
+uncoupled tunes, linear with the quadrupole current I, and C is the
+minimum tune distance, which measures the coupling. nu_1 is the upper
+mode and nu_2 the lower one.
+
+The functions here are independent of MeasCoupling, so that fits can
+be repeated cheaply as scan points arrive, and are vectorized on the
+parameters, so that many fits can be evaluated at once.
+"""
+
+import numpy as np
+from scipy.optimize import least_squares as _least_squares
+
+PARAMS = ('coeff1', 'offset1', 'coeff2', 'offset2', 'coupling')
+MIN_POINTS = 3
+
+
+def calc_normal_modes(params, curr):
+    """Normal mode tunes of the model.
+
+    Args:
+        params (numpy.ndarray): (..., 5) parameters, see PARAMS.
+        curr (numpy.ndarray): (M, ) quadrupole currents.
+
+    Returns:
+        tune1 (numpy.ndarray): (..., M) upper normal mode tunes.
+        tune2 (numpy.ndarray): (..., M) lower normal mode tunes.
+
+    """
+    params = np.asarray(params, dtype=float)
+    curr = np.asarray(curr, dtype=float)
+    coeff1, offset1, coeff2, offset2, coup = [
+        params[..., i, None] for i in range(len(PARAMS))]
+    fx_ = coeff1*curr + offset1
+    fy_ = coeff2*curr + offset2
+    avg = (fx_ + fy_)/2
+    sqrt = np.sqrt((fx_ - fy_)**2 + coup**2)/2
+    return avg + sqrt, avg - sqrt
+
+
+def sort_tunes(tune1, tune2):
+    """Return upper and lower tunes of each point."""
+    tune1, tune2 = np.asarray(tune1), np.asarray(tune2)
+    return np.maximum(tune1, tune2), np.minimum(tune1, tune2)
+
+
+def sort_tune_errors(tune1, tune2, sigma1, sigma2):
+    """Return errors of the upper and lower tunes, see sort_tunes."""
+    swap = np.asarray(tune1) < np.asarray(tune2)
+    return np.where(swap, sigma2, sigma1), np.where(swap, sigma1, sigma2)
+
+
+def _linfit(curr, tune):
+    if curr.size > 1 and np.ptp(curr) > 0:
+        return np.polyfit(curr, tune, 1)
+    return np.array([0.0, np.mean(tune)])
+
+
+def calc_init_params(curr, tune1, tune2):
+    """Estimate parameters from the data, assuming the tunes cross.
+
+    Below the median current the upper mode follows one uncoupled tune
+    and the lower mode the other; above it they are swapped.
+
+    Args:
+        curr (numpy.ndarray): quadrupole currents.
+        tune1 (numpy.ndarray): upper normal mode tunes.
+        tune2 (numpy.ndarray): lower normal mode tunes.
+
+    Returns:
+        numpy.ndarray: initial parameters.
+
+    """
+    curr, tune1, tune2 = map(np.asarray, (curr, tune1, tune2))
+    low = curr <= np.median(curr)
+    high = ~low
+    if not high.any():
+        high = low
+    coeff1, offset1 = _linfit(
+        np.r_[curr[low], curr[high]], np.r_[tune1[low], tune2[high]])
+    coeff2, offset2 = _linfit(
+        np.r_[curr[low], curr[high]], np.r_[tune2[low], tune1[high]])
+    coup = np.min(tune1 - tune2)
+    return np.array([coeff1, offset1, coeff2, offset2, coup])
+
+
+def _residue(params, curr, tune1, tune2, wgt1, wgt2):
+    fit1, fit2 = calc_normal_modes(params, curr)
+    return np.r_[(fit1 - tune1)*wgt1, (fit2 - tune2)*wgt2]
+
+
+def calc_param_errors(jac, cost=None, nr_dof=None):
+    """Standard errors of the parameters from the residue Jacobian.
+
+    Args:
+        jac (numpy.ndarray): Jacobian of the residue at the solution.
+        cost (float, optional): half of the sum of squared residues. If
+            given, the covariance is scaled by the reduced chi^2, which
+            is appropriate when the tune errors are not known.
+        nr_dof (int, optional): number of degrees of freedom, required
+            with cost.
+
+    Returns:
+        numpy.ndarray: standard errors.
+
+    """
+    _, svals, vtrans = np.linalg.svd(jac, full_matrices=False)
+    thres = np.finfo(float).eps * max(jac.shape) * svals[0]
+    sel = svals > thres
+    svals, vtrans = svals[sel], vtrans[sel]
+    pcov = (vtrans.T / svals**2) @ vtrans
+    if cost is not None and nr_dof > 0:
+        pcov *= 2*cost/nr_dof
+    return np.sqrt(np.diag(pcov))
+
+
+def fit_coupling(
+        curr, tune1, tune2, sigma1=None, sigma2=None, params0=None):
+    """Fit normal mode tunes model to the data.
+
+    Args:
+        curr (numpy.ndarray): (N, ) quadrupole currents.
+        tune1 (numpy.ndarray): (N, ) tunes of one mode.
+        tune2 (numpy.ndarray): (N, ) tunes of the other mode.
+        sigma1 (numpy.ndarray, optional): (N, ) errors of tune1. If both
+            sigmas are given the fit is weighted and they are taken as
+            absolute errors. Defaults to None.
+        sigma2 (numpy.ndarray, optional): (N, ) errors of tune2.
+        params0 (numpy.ndarray, optional): initial parameters. Defaults to
+            the estimate of calc_init_params.
+
+    Raises:
+        ValueError: if there are less than MIN_POINTS points.
+
+    Returns:
+        dict: 'params', 'errors', 'coupling', 'coupling_error' (absolute
+            tune units), 'chi2', reduced chi^2 of the fit, and 'nr_points'.
+
+    """
+    curr = np.asarray(curr, dtype=float)
+    if curr.size < MIN_POINTS:
+        raise ValueError(
+            f'At least {MIN_POINTS:d} points are needed for fitting.')
+    weighted = sigma1 is not None and sigma2 is not None
+    if weighted:
+        sigma1, sigma2 = sort_tune_errors(tune1, tune2, sigma1, sigma2)
+        wgt1 = 1/np.maximum(sigma1, np.finfo(float).tiny)
+        wgt2 = 1/np.maximum(sigma2, np.finfo(float).tiny)
+    else:
+        wgt1 = wgt2 = 1.0
+    tune1, tune2 = sort_tunes(tune1, tune2)
+    if params0 is None:
+        params0 = calc_init_params(curr, tune1, tune2)
+
+    res = _least_squares(
+        _residue, params0, args=(curr, tune1, tune2, wgt1, wgt2),
+        method='lm')
+    nr_dof = 2*curr.size - len(PARAMS)
+    errors = calc_param_errors(
+        res.jac, cost=None if weighted else res.cost, nr_dof=nr_dof)
+    params = res.x.copy()
+    params[-1] = abs(params[-1])
+    return dict(
+        params=params, errors=errors, coupling=params[-1],
+        coupling_error=errors[-1], nr_points=curr.size,
+        chi2=2*res.cost/nr_dof if nr_dof > 0 else np.nan)
+
+
+def calc_crossing(params):
+    """Return current and half width of the tune crossing.
+
+    The crossing is where the uncoupled tunes are equal and its half
+    width is the current interval in which their distance is smaller
+    than the coupling.
+
+    Args:
+        params (numpy.ndarray): parameters, see PARAMS.
+
+    Returns:
+        curr (float): crossing current, nan if the tunes are parallel.
+        width (float): half width of the crossing.
+
+    """
+    coeff1, offset1, coeff2, offset2, coup = params
+    dcoeff = coeff1 - coeff2
+    if dcoeff == 0:
+        return np.nan, np.nan
+    return (offset2 - offset1)/dcoeff, abs(coup/dcoeff)
+
+
+def suggest_current(result, measured, curr_min, curr_max, nr_widths=3):
+    """Return next current of an adaptive scan.
+
+    The current is chosen in the region of nr_widths half widths around
+    the estimated crossing as far as possible from the measured currents.
+    If there is no fit or the crossing is out of the limits, the largest
+    gap of the whole interval is filled.
+
+    Args:
+        result (dict): fitting result, see fit_coupling. May be None.
+        measured (list): measured currents.
+        curr_min (float): lower current limit.
+        curr_max (float): upper current limit.
+        nr_widths (float, optional): half widths of the crossing region.
+            Defaults to 3.
+
+    Returns:
+        float: next current.
+
+    """
+    low, high = curr_min, curr_max
+    if result is not None:
+        cross, width = calc_crossing(result['params'])
+        if curr_min <= cross <= curr_max:
+            width = max(nr_widths*width, (curr_max - curr_min)/50)
+            low, high = max(cross - width, low), min(cross + width, high)
+    cands = np.linspace(low, high, 101)
+    dist = np.min(np.abs(cands[:, None] - np.asarray(measured)), axis=1)
+    return float(cands[np.argmax(dist)])
+
+
+class IncrementalCouplingFit:
+    """Refit the coupling as scan points arrive.
+
+    Each fit starts from the parameters of the previous one, which is
+    much faster than estimating them again and converges to the same
+    solution, since a single point changes the solution slightly.
+    """
+
+    def __init__(self):
+        """."""
+        self.curr = []
+        self.tune1 = []
+        self.tune2 = []
+        self.sigma1 = []
+        self.sigma2 = []
+        self.result = None
+
+    @property
+    def nr_points(self):
+        """."""
+        return len(self.curr)
+
+    def reset(self):
+        """."""
+        self.__init__()
+
+    def add_point(self, curr, tune1, tune2, sigma1=None, sigma2=None):
+        """Add point and refit.
+
+        Args:
+            curr (float): quadrupole current.
+            tune1 (float): tune of one mode.
+            tune2 (float): tune of the other mode.
+            sigma1 (float, optional): error of tune1. Defaults to None.
+            sigma2 (float, optional): error of tune2. Defaults to None.
+
+        Returns:
+            dict: fitting result, see fit_coupling, or None if there are
+                not enough points.
+
+        """
+        self.curr.append(curr)
+        self.tune1.append(tune1)
+        self.tune2.append(tune2)
+        self.sigma1.append(sigma1)
+        self.sigma2.append(sigma2)
+        return self.refit()
+
+    def refit(self):
+        """Fit all points, warm started by the last result."""
+        if self.nr_points < MIN_POINTS:
+            return None
+        sigma1 = sigma2 = None
+        if None not in self.sigma1 and None not in self.sigma2:
+            sigma1, sigma2 = np.array(self.sigma1), np.array(self.sigma2)
+        params0 = None if self.result is None else self.result['params']
+        try:
+            self.result = fit_coupling(
+                self.curr, self.tune1, self.tune2, sigma1=sigma1,
+                sigma2=sigma2, params0=params0)
+        except (ValueError, np.linalg.LinAlgError):
+            self.result = None
+        return self.result
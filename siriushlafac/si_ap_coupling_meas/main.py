@@ -1,7 +1,7 @@
 """Main module of the Application Interface."""
 import os as _os
+import time as _time
 import logging as _log
-from threading import Thread
 import pathlib as _pathlib
 
 import numpy as np
@@ -13,7 +13,7 @@ from qtpy.QtCore import Qt
 from qtpy.QtGui import QDoubleValidator
 from qtpy.QtWidgets import QWidget, QPushButton, QGridLayout, QSpinBox, \
     QLabel, QGroupBox, QLineEdit, QComboBox, QHBoxLayout, QFileDialog, \
-    QVBoxLayout
+    QVBoxLayout, QCheckBox, QTabWidget
 
 import qtawesome as qta
 
@@ -28,6 +28,18 @@ from siriushla.widgets import MatplotlibWidget, SiriusMainWindow, \
 
 from apsuite.commisslib.meas_coupling_tune import MeasCoupling
 
+from ..latency import StageTimer
+from ..widgets import StageTimerWidget
+from . import archive as _archive
+from .bootstrap import Bootstrapper
+from .archive import CouplingCatalog, save_meas, load_meas, apply_meas
+from .analysis import process_data
+from .fitting import calc_normal_modes, sort_tunes, sort_tune_errors
+from .memo import AnalysisCache, get_analysis_key
+from .scheduler import MeasScheduler, DONE, STOPPED, FAILED
+from .worker import CouplingScanWorker, TaskWorker
+from .widgets import CatalogWidget, MeasQueueWidget, BootstrapWidget
+
 rcParams.update({
     'font.size': 12, 'axes.grid': True, 'grid.linestyle': '--',
     'grid.alpha': 0.5})
@@ -35,18 +47,36 @@ rcParams.update({
 
 class SICoupMeasWindow(SiriusMainWindow):
     """."""
-    EXT = 'pickle'
-    EXT_FLT = f'Pickle Files (*.{EXT:s})'
+    EXT = _archive.EXT
+    PICKLE_EXT = _archive.PICKLE_EXT
+    EXT_FLT = f'Compressed Arrays (*.{EXT:s});;' + \
+        f'Pickle Files (*.{PICKLE_EXT:s})'
     DEFAULT_DIR = _pathlib.Path.home().as_posix()
     DEFAULT_DIR += _os.path.sep + _os.path.join(
         'mounts', 'screens-iocs', 'data_by_day')
     print(DEFAULT_DIR)
+    OVERSAMPLING = 10
 
     def __init__(self, parent=None):
         """."""
         super().__init__(parent=parent)
         self.meas_coup = MeasCoupling()
         self._last_dir = self.DEFAULT_DIR
+        self.timer = StageTimer()
+        self._worker = None
+        self._loader = None
+        self._live_data = []
+        self._errbars = []
+        self._bands = []
+        self._last_res = None
+        self._bootstrapper = None
+        self._bootstrap_wid = None
+        self._data_fname = None
+        self.anl_cache = AnalysisCache()
+        self.catalog = CouplingCatalog(self.DEFAULT_DIR)
+        self.scheduler = MeasScheduler()
+        self._queue_running = False
+        self._scan_tini = 0.0
 
         self.setupui()
         self.setObjectName('SIApp')
@@ -55,7 +85,8 @@ class SICoupMeasWindow(SiriusMainWindow):
             dict(scale_factor=0.5, color=color, offset=(0.2, -0.3)),
             dict(scale_factor=1, color=color, offset=(0, 0.0))])
         self.setWindowIcon(icon)
-        self.resize(1100, 700)
+        self.resize(1100, 900)
+        self.wid_catalog.update_catalog()
 
     def setupui(self):
         """."""
@@ -80,17 +111,29 @@ class SICoupMeasWindow(SiriusMainWindow):
         status = self.get_measurement_status_widget(wid)
         fig_wid = self.make_figure(wid)
         saveload = self.get_saveload_widget(wid)
+        self.wid_catalog = CatalogWidget(
+            self.catalog, families=self.meas_coup.params.QUADS, parent=wid)
+        self.wid_catalog.fileSelected.connect(self._load_file)
+        self.wid_queue = MeasQueueWidget(self.scheduler, parent=wid)
+        self.wid_queue.addRequested.connect(self._add_to_queue)
+        self.wid_queue.runRequested.connect(self.run_queue)
+        self.wid_queue.stopRequested.connect(self.stop_queue)
+        tabs = QTabWidget(wid)
+        tabs.addTab(self.wid_catalog, 'Catalog')
+        tabs.addTab(self.wid_queue, 'Queue')
 
         wid.layout().addWidget(ctrls, 1, 0)
         wid.layout().addWidget(anal, 2, 0)
         wid.layout().addWidget(status, 3, 0)
+        wid.layout().addWidget(tabs, 4, 0)
         # wid.layout().addWidget(fig_wid, 1, 1, 3, 1)
         # wid.layout().addWidget(saveload, 3, 0)
         lay = QVBoxLayout()
         lay.addWidget(saveload)
         lay.addWidget(fig_wid)
-        wid.layout().addLayout(lay, 1, 1, 3, 1)
-        wid.layout().setRowStretch(3, 10)
+        wid.layout().addLayout(lay, 1, 1, 4, 1)
+        wid.layout().setRowStretch(3, 5)
+        wid.layout().setRowStretch(4, 10)
         return wid
 
     def make_figure(self, parent):
@@ -160,10 +203,50 @@ class SICoupMeasWindow(SiriusMainWindow):
             str(self.meas_coup.params.pos_percent*100))
         self.wid_pos_percent.setValidator(QDoubleValidator())
 
+        self.chb_adaptive = QCheckBox('Adaptive, Target Error [%]', wid)
+        self.chb_adaptive.setToolTip(
+            'Measure a few coarse points and then concentrate them around '
+            'the tune crossing,\nuntil the coupling error reaches the '
+            'target or # of Points are measured.')
+        self.wid_target_error = QLineEdit(wid)
+        self.wid_target_error.setText('0.02')
+        self.wid_target_error.setValidator(QDoubleValidator())
+        self.wid_target_error.setEnabled(False)
+        self.chb_adaptive.toggled.connect(self.wid_target_error.setEnabled)
+
+        self.chb_settling = QCheckBox('Stop Waiting When Settled', wid)
+        self.chb_settling.setToolTip(
+            'Measure each point as soon as the current readback and the '
+            'tunes are stable,\nwaiting at most the time to wait.')
+        self.wid_curr_tol = QLineEdit(wid)
+        self.wid_curr_tol.setText('0.001')
+        self.wid_curr_tol.setValidator(QDoubleValidator())
+        self.wid_tune_tol = QLineEdit(wid)
+        self.wid_tune_tol.setText('0.0001')
+        self.wid_tune_tol.setValidator(QDoubleValidator())
+        for wid_tol in (self.wid_curr_tol, self.wid_tune_tol):
+            wid_tol.setEnabled(False)
+            self.chb_settling.toggled.connect(wid_tol.setEnabled)
+
+        self.wid_nr_samples = QSpinBox(wid)
+        self.wid_nr_samples.setRange(1, 1000)
+        self.wid_nr_samples.setValue(1)
+        self.wid_nr_samples.setToolTip(
+            'Tune readings averaged at each point, one per tune update. '
+            'With more than one,\nthe fitting is weighted by the errors '
+            'of the mean tunes.')
+        self.wid_sample_timeout = QLineEdit(wid)
+        self.wid_sample_timeout.setText(
+            str(CouplingScanWorker.DEFAULT_SAMPLE_TIMEOUT))
+        self.wid_sample_timeout.setValidator(QDoubleValidator())
+        self.wid_sample_timeout.setToolTip(
+            'Maximum time to wait for each tune update.')
+        self.chb_keep_samples = QCheckBox('Keep Raw Tune Readings', wid)
+
         pusb_start = QPushButton(qta.icon('mdi.play'), 'Start', wid)
         pusb_start.clicked.connect(self.start_meas)
         pusb_stop = QPushButton(qta.icon('mdi.stop'), 'Stop', wid)
-        pusb_stop.clicked.connect(self.meas_coup.stop)
+        pusb_stop.clicked.connect(self.stop_meas)
 
         wid.layout().addWidget(QLabel('Quadrupole Family Name', wid), 1, 1)
         wid.layout().addWidget(QLabel('Quadrupole Current [A]', wid), 2, 1)
@@ -178,13 +261,25 @@ class SICoupMeasWindow(SiriusMainWindow):
         wid.layout().addWidget(self.wid_time_wait, 5, 2)
         wid.layout().addWidget(self.wid_neg_percent, 6, 2)
         wid.layout().addWidget(self.wid_pos_percent, 7, 2)
+        wid.layout().addWidget(self.chb_adaptive, 8, 1)
+        wid.layout().addWidget(self.wid_target_error, 8, 2)
+        wid.layout().addWidget(self.chb_settling, 9, 1, 1, 2)
+        wid.layout().addWidget(QLabel('Current Tolerance [A]', wid), 10, 1)
+        wid.layout().addWidget(self.wid_curr_tol, 10, 2)
+        wid.layout().addWidget(QLabel('Tune Tolerance', wid), 11, 1)
+        wid.layout().addWidget(self.wid_tune_tol, 11, 2)
+        wid.layout().addWidget(QLabel('Tune Readings per Point', wid), 12, 1)
+        wid.layout().addWidget(self.wid_nr_samples, 12, 2)
+        wid.layout().addWidget(QLabel('Reading Timeout [s]', wid), 13, 1)
+        wid.layout().addWidget(self.wid_sample_timeout, 13, 2)
+        wid.layout().addWidget(self.chb_keep_samples, 14, 1, 1, 2)
         lay = QHBoxLayout()
         lay.addStretch()
         lay.addWidget(pusb_start)
         lay.addStretch()
         lay.addWidget(pusb_stop)
         lay.addStretch()
-        wid.layout().addLayout(lay, 9, 1, 1, 2)
+        wid.layout().addLayout(lay, 15, 1, 1, 2)
         wid.layout().setColumnStretch(0, 2)
         wid.layout().setColumnStretch(3, 2)
         return wid
@@ -200,10 +295,23 @@ class SICoupMeasWindow(SiriusMainWindow):
 
         pusb_proc = QPushButton(qta.icon('mdi.chart-line'), 'Process', wid)
         pusb_proc.clicked.connect(self._plot_results)
+        self.chb_disk_cache = QCheckBox('Cache on Disk', wid)
+        self.chb_disk_cache.setToolTip(
+            'Save analysis results next to the loaded data file.')
+        pusb_boot = QPushButton(
+            qta.icon('mdi.chart-bell-curve'), 'Bootstrap', wid)
+        pusb_boot.setToolTip(
+            'Confidence interval of the coupling by refitting resamples '
+            'of the measured points.')
+        pusb_boot.clicked.connect(self._show_bootstrap)
 
         wid.layout().addWidget(QLabel('Coupling Resolution [%]', wid), 0, 0)
         wid.layout().addWidget(self.wid_coupling_resolution, 0, 1)
+        wid.layout().addWidget(self.chb_disk_cache, 0, 2, Qt.AlignRight)
         wid.layout().addWidget(pusb_proc, 0, 3)
+        wid.layout().addWidget(pusb_boot, 0, 4)
+        wid.layout().addWidget(
+            StageTimerWidget(self.timer, parent=wid), 1, 0, 1, 5)
         wid.layout().setColumnStretch(2, 5)
         return wid
 
@@ -241,17 +349,23 @@ class SICoupMeasWindow(SiriusMainWindow):
         return svld_wid
 
     def _save_data_to_file(self, _):
-        filename = QFileDialog.getSaveFileName(
+        fname, flt = QFileDialog.getSaveFileName(
             caption='Define a File Name to Save Data',
             directory=self._last_dir,
             filter=self.EXT_FLT)
-        fname = filename[0]
         if not fname:
             return
         self._last_dir, _ = _os.path.split(fname)
         self.loaded_label.setText('')
-        fname += '' if fname.endswith(self.EXT) else ('.' + self.EXT)
-        self.meas_coup.save_data(fname, overwrite=True)
+        ext = self.PICKLE_EXT if self.PICKLE_EXT in flt else self.EXT
+        fname += '' if fname.endswith(ext) else ('.' + ext)
+        if ext == self.PICKLE_EXT:
+            self.meas_coup.save_data(fname, overwrite=True)
+        else:
+            save_meas(fname, self.meas_coup)
+        self._data_fname = fname
+        if fname.startswith(self.catalog.root):
+            self.wid_catalog.update_catalog()
 
     def _load_data_from_file(self):
         filename = QFileDialog.getOpenFileName(
@@ -262,8 +376,25 @@ class SICoupMeasWindow(SiriusMainWindow):
         if not fname:
             return
         self._last_dir, _ = _os.path.split(fname)
+        self._load_file(fname)
 
-        self.meas_coup.load_and_apply_old_data(fname)
+    def _load_file(self, fname):
+        if self.ismeasuring:
+            _log.error('Cannot load data while measuring.')
+            return
+        if self._loader is not None and self._loader.isRunning():
+            return
+        self.loaded_label.setText('Loading...')
+        self._loader = TaskWorker(lambda _: load_meas(fname), parent=self)
+        self._loader.done.connect(
+            lambda content: self._apply_loaded(fname, content))
+        self._loader.failed.connect(
+            lambda err: self.loaded_label.setText('Failed to load file.'))
+        self._loader.start()
+
+    def _apply_loaded(self, fname, content):
+        apply_meas(self.meas_coup, content)
+        self._data_fname = fname
         splitted = fname.split('/')
         stn = splitted[0]
         leng = len(stn)
@@ -303,64 +434,324 @@ class SICoupMeasWindow(SiriusMainWindow):
 
         self.lab_tune.setText('Done!')
 
+    @property
+    def ismeasuring(self):
+        """."""
+        return self.meas_coup.ismeasuring or (
+            self._worker is not None and self._worker.isRunning())
+
     def start_meas(self):
         """."""
-        if self.meas_coup.ismeasuring:
+        if self.ismeasuring:
             _log.error('There is another measurement happening.')
             return
-        Thread(target=self._do_meas, daemon=True).start()
-
-    def _do_meas(self):
-
-        self.meas_coup.params.quadfam_name = self.wid_quadfam.currentText()
-        self.meas_coup.params.nr_points = int(self.wid_nr_points.value())
-        self.meas_coup.params.time_wait = float(self.wid_time_wait.text())
-        self.meas_coup.params.neg_percent = float(
-            self.wid_neg_percent.text()) / 100
-        self.meas_coup.params.pos_percent = float(
-            self.wid_pos_percent.text()) / 100
-
+        self._start_scan(self._get_settings())
+
+    def _get_settings(self):
+        return dict(
+            quadfam_name=self.wid_quadfam.currentText(),
+            nr_points=int(self.wid_nr_points.value()),
+            time_wait=float(self.wid_time_wait.text()),
+            neg_percent=float(self.wid_neg_percent.text()) / 100,
+            pos_percent=float(self.wid_pos_percent.text()) / 100,
+            adaptive=self.chb_adaptive.isChecked(),
+            target_error=float(self.wid_target_error.text()) / 100,
+            settling=self.chb_settling.isChecked(),
+            curr_tol=float(self.wid_curr_tol.text()),
+            tune_tol=float(self.wid_tune_tol.text()),
+            nr_samples=int(self.wid_nr_samples.value()),
+            sample_timeout=float(self.wid_sample_timeout.text()),
+            keep_samples=self.chb_keep_samples.isChecked())
+
+    def _start_scan(self, settings):
         self.loaded_label.setText('')
+        self._data_fname = None
+        self._clear_plot()
+        self.axes.set_xlabel(f'{settings["quadfam_name"]} Current [A]')
+
+        self._worker = CouplingScanWorker(
+            self.meas_coup, settings, parent=self)
+        self._worker.pointMeasured.connect(self._add_point)
+        self._worker.fitUpdated.connect(self._update_live_fit)
+        self._worker.scanFinished.connect(self._scan_finished)
+        self._scan_tini = _time.time()
+        self._worker.start()
+
+    def stop_meas(self):
+        """."""
+        self.meas_coup.stop()
+        if self._worker is not None:
+            self._worker.stop()
 
-        self.meas_coup.wait_for_connection()
-        self.meas_coup.start()
-        self.meas_coup.wait_measurement()
-        self._plot_results()
+    def run_queue(self):
+        """Measure queued jobs one after the other."""
+        if self.ismeasuring:
+            _log.error('There is another measurement happening.')
+            return
+        self.scheduler.requeue()
+        self._queue_running = True
+        self._run_next_job()
+
+    def stop_queue(self):
+        """Stop running job and the queue."""
+        self._queue_running = False
+        self.stop_meas()
+
+    def _add_to_queue(self, all_families):
+        settings = self._get_settings()
+        fams = self.meas_coup.params.QUADS if all_families else \
+            [settings['quadfam_name']]
+        for fam in fams:
+            self.scheduler.add(dict(settings, quadfam_name=fam))
+        self.wid_queue.update_table()
+
+    def _run_next_job(self):
+        idx = self.scheduler.start_next()
+        self.wid_queue.update_table()
+        if idx is None:
+            self._queue_running = False
+            _log.info('Queue finished.')
+            return
+        settings = self.scheduler.jobs[idx]['settings']
+        _log.info(
+            f'Queue: measuring {settings["quadfam_name"]:s} '
+            f'({idx+1:d}/{len(self.scheduler.jobs):d}).')
+        self.wid_quadfam.setCurrentText(settings['quadfam_name'])
+        self._start_scan(settings)
+
+    def _finish_job(self, completed):
+        duration = _time.time() - self._scan_tini
+        status = DONE if completed else (
+            STOPPED if self._worker.stopped else FAILED)
+        anl = self.meas_coup.analysis
+        result = self._worker.fitter.result
+        if status == FAILED:
+            result = None
+        elif 'fitted_param' in anl:
+            result = dict(
+                coupling=abs(anl['fitted_param']['x'][-1]),
+                coupling_error=anl['fitting_error'][-1])
+        fname = self._autosave() if completed else ''
+        self.scheduler.finish(status, duration, result=result, fname=fname)
+        self.wid_queue.update_table()
+        if status == STOPPED:
+            self._queue_running = False
+            _log.info('Queue stopped.')
+        elif self._queue_running:
+            self._run_next_job()
+
+    def _autosave(self):
+        data = self.meas_coup.data
+        tstamp = _time.localtime(data['timestamp'])
+        path = _os.path.join(
+            self.catalog.root, _time.strftime('%Y-%m-%d', tstamp))
+        fname = _os.path.join(path, 'si_coupling_{:s}_{:s}.{:s}'.format(
+            self.meas_coup.params.quadfam_name,
+            _time.strftime('%Hh%Mm%Ss', tstamp), self.EXT))
+        try:
+            _os.makedirs(path, exist_ok=True)
+            save_meas(fname, self.meas_coup)
+        except OSError as err:
+            _log.error(f'Could not save {fname}: {err}')
+            return ''
+        _log.info('Saved ' + fname)
+        self._data_fname = fname
+        self.wid_catalog.update_catalog()
+        return fname
+
+    def closeEvent(self, event):
+        """."""
+        self._queue_running = False
+        if self._worker is not None:
+            self._worker.stop()
+            self._worker.wait()
+        if self._loader is not None:
+            self._loader.wait()
+        self.wid_catalog.wait()
+        if self._bootstrap_wid is not None:
+            self._bootstrap_wid.wait()
+            self._bootstrap_wid.close()
+        if self._bootstrapper is not None:
+            self._bootstrapper.close()
+        super().closeEvent(event)
+
+    def _clear_plot(self):
+        self._live_data = []
+        self._last_res = None
+        self._set_errorbars()
+        self._set_bands()
+        for line in (
+                self.line_tune1, self.line_tune2, self.line_fit1,
+                self.line_fit2):
+            line.set_data([], [])
+        self.axes.set_title(
+            'Transverse Linear Coupling: (Nan ± Nan) %', fontsize='x-large')
+        self.fig.canvas.draw_idle()
+
+    def _set_errorbars(self, curr=None, tunes=(), errs=()):
+        for cont in self._errbars:
+            cont.remove()
+        self._errbars = []
+        if curr is None:
+            return
+        for tune, err, color in zip(tunes, errs, ('C0', 'C1')):
+            self._errbars.append(self.axes.errorbar(
+                curr, tune, yerr=err, fmt='none', ecolor=color, capsize=3))
+
+    def _set_bands(self, res=None):
+        for band in self._bands:
+            band.remove()
+        self._bands = []
+        if res is None:
+            return
+        for band in (res['band1'], res['band2']):
+            self._bands.append(self.axes.fill_between(
+                res['curr'], band[0], band[1], color='tab:gray', alpha=0.3,
+                linewidth=0))
+        self.fig.canvas.draw_idle()
+
+    def _show_bootstrap(self):
+        res = self._last_res
+        if res is None or 'fitted_param' not in res:
+            _log.error('There is no fitting to bootstrap.')
+            return
+        if self._bootstrap_wid is None:
+            self._bootstrapper = Bootstrapper(nrprocs=None)
+            self._bootstrap_wid = BootstrapWidget(
+                self._bootstrapper, parent=self)
+            self._bootstrap_wid.setWindowFlags(Qt.Window)
+            self._bootstrap_wid.resize(700, 500)
+            self._bootstrap_wid.bootstrapDone.connect(self._set_bands)
+        self._set_bands()
+        self._bootstrap_wid.set_data(
+            res['qcurr'], res['tune1'], res['tune2'], res['fitted_param'],
+            res['fitting_error'][-1], sigma1=res.get('tune1_err'),
+            sigma2=res.get('tune2_err'))
+        self._bootstrap_wid.show()
+        self._bootstrap_wid.raise_()
+
+    def _add_point(self, idx, curr, tune1, tune2, err1, err2):
+        _ = idx
+        if self.scheduler.current is not None:
+            self.scheduler.point_done()
+            self.wid_queue.update_table()
+        self._live_data.append((curr, tune1, tune2, err1, err2))
+        curr, tune1, tune2, err1, err2 = np.array(self._live_data).T
+        err1, err2 = sort_tune_errors(tune1, tune2, err1, err2)
+        tune1, tune2 = sort_tunes(tune1, tune2)
+        self.line_tune1.set_data(curr, tune1)
+        self.line_tune2.set_data(curr, tune2)
+        if np.any(err1 > 0) or np.any(err2 > 0):
+            self._set_errorbars(curr, (tune1, tune2), (err1, err2))
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.fig.canvas.draw_idle()
+
+    def _update_live_fit(self, res):
+        curr = np.array(self._live_data)[:, 0]
+        curr = np.linspace(curr.min(), curr.max(), 10*curr.size)
+        fit1, fit2 = calc_normal_modes(res['params'], curr)
+        self.line_fit1.set_data(curr, fit1)
+        self.line_fit2.set_data(curr, fit2)
+        self.axes.set_title(
+            'Transverse Linear Coupling: ({:.2f} ± {:.2f}) % '
+            '[{:d} points]'.format(
+                res['coupling']*100, res['coupling_error']*100,
+                res['nr_points']), fontsize='x-large')
+        self.fig.canvas.draw_idle()
+
+    def _scan_finished(self, completed):
+        if self.meas_coup.data.get('current') is not None and \
+                len(self.meas_coup.data['current']):
+            self._plot_results()
+        if self.scheduler.current is not None:
+            self._finish_job(completed)
 
     def _process_data(self):
         try:
-            self.meas_coup.process_data()
+            with self.timer.stage('process_data'):
+                process_data(self.meas_coup)
         except Exception as err:
             _log.error('Problem processing data.')
             _log.error(str(err))
 
-    def _plot_results(self):
-        self.meas_coup.params.coupling_resolution = float(
-            self.wid_coupling_resolution.text()) / 100
+    def _analyze(self):
+        """Return analysis results, from the cache when possible."""
+        data = self.meas_coup.data
+        if data.get('current') is None or data.get('tunes') is None:
+            self._process_data()
+            return None
+        params = self.meas_coup.params
+        key = get_analysis_key(
+            data, coupling_resolution=params.coupling_resolution,
+            oversampling=self.OVERSAMPLING)
+        fname = self._data_fname if self.chb_disk_cache.isChecked() else None
+        with self.timer.stage('cache_lookup'):
+            res = self.anl_cache.get(key, fname=fname)
+        if res is not None:
+            self.meas_coup.analysis = anl = dict()
+            anl.update(
+                qcurr=res['qcurr'], tune1=res['tune1'], tune2=res['tune2'])
+            if 'tune1_err' in res:
+                anl.update(
+                    tune1_err=res['tune1_err'], tune2_err=res['tune2_err'])
+            if 'fitted_param' in res:
+                anl.update(
+                    fitted_param=dict(x=res['fitted_param']),
+                    fitting_error=res['fitting_error'])
+            return res
+
+        self.meas_coup.analysis = dict()
         self._process_data()
         anl = self.meas_coup.analysis
         if 'qcurr' not in anl:
+            return None
+        res = dict(qcurr=anl['qcurr'], tune1=anl['tune1'], tune2=anl['tune2'])
+        if 'tune1_err' in anl:
+            res.update(tune1_err=anl['tune1_err'], tune2_err=anl['tune2_err'])
+        if 'fitted_param' in anl:
+            with self.timer.stage('get_normal_modes'):
+                fittune1, fittune2, qcurr_interp = \
+                    self.meas_coup.get_normal_modes(
+                        params=anl['fitted_param']['x'], curr=anl['qcurr'],
+                        oversampling=self.OVERSAMPLING)
+            res.update(
+                fitted_param=anl['fitted_param']['x'],
+                fitting_error=anl['fitting_error'], fit_curr=qcurr_interp,
+                fit_tune1=fittune1, fit_tune2=fittune2)
+        self.anl_cache.put(key, res, fname=fname)
+        return res
+
+    def _plot_results(self):
+        self.meas_coup.params.coupling_resolution = float(
+            self.wid_coupling_resolution.text()) / 100
+        res = self._analyze()
+        self._last_res = res
+        self._set_bands()
+        if res is None:
             _log.error('There is no data to plot.')
             return
-        qcurr, tune1, tune2 = anl['qcurr'], anl['tune1'], anl['tune2']
+        qcurr, tune1, tune2 = res['qcurr'], res['tune1'], res['tune2']
         self.line_tune1.set_xdata(qcurr)
         self.line_tune2.set_xdata(qcurr)
         self.line_tune1.set_ydata(tune1)
         self.line_tune2.set_ydata(tune2)
+        if 'tune1_err' in res:
+            self._set_errorbars(
+                qcurr, (tune1, tune2), (res['tune1_err'], res['tune2_err']))
+        else:
+            self._set_errorbars()
         self.axes.set_xlabel(f'{self.meas_coup.data["qname"]} Current [A]')
 
-        if 'fitted_param' in anl:
-            fit_vec = anl['fitted_param']['x']
-            fittune1, fittune2, qcurr_interp = self.meas_coup.get_normal_modes(
-                params=fit_vec, curr=qcurr, oversampling=10)
-
-            self.line_fit1.set_xdata(qcurr_interp)
-            self.line_fit2.set_xdata(qcurr_interp)
-            self.line_fit1.set_ydata(fittune1)
-            self.line_fit2.set_ydata(fittune2)
+        if 'fitted_param' in res:
+            fit_vec = res['fitted_param']
+            self.line_fit1.set_xdata(res['fit_curr'])
+            self.line_fit2.set_xdata(res['fit_curr'])
+            self.line_fit1.set_ydata(res['fit_tune1'])
+            self.line_fit2.set_ydata(res['fit_tune2'])
             self.axes.set_title(
                 'Transverse Linear Coupling: ({:.2f} ± {:.2f}) %'.format(
-                    fit_vec[-1]*100, anl['fitting_error'][-1] * 100))
+                    fit_vec[-1]*100, res['fitting_error'][-1] * 100))
         else:
             self.line_fit1.set_xdata([])
             self.line_fit2.set_xdata([])
@@ -368,9 +759,10 @@ class SICoupMeasWindow(SiriusMainWindow):
             self.line_fit2.set_ydata([])
             self.axes.set_title('Transverse Linear Coupling: (Nan ± Nan) %')
 
-        self.axes.relim()
-        self.axes.autoscale_view()
-        self.fig.canvas.draw()
+        with self.timer.stage('canvas_draw'):
+            self.axes.relim()
+            self.axes.autoscale_view()
+            self.fig.canvas.draw()
 
     def _update_quadcurr_wid(self, text):
         self._currpvname = self._currpvname.substitute(dev=text)
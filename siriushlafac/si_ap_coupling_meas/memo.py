@@ -0,0 +1,147 @@
+"""Memoization of coupling analysis results.
+
+Results are identified by a hash of the measurement data and of the
+analysis parameters, so they are reused whenever the same measurement is
+processed again with the same parameters, no matter where it came from.
+They are kept in a small in-memory LRU and, optionally, in a sidecar
+file next to the data file.
+"""
+
+import os as _os
+import hashlib as _hashlib
+import logging as _log
+from collections import OrderedDict as _OrderedDict
+from threading import Lock as _Lock
+
+import numpy as np
+
+SIDECAR_SUFFIX = '.analysis.npz'
+
+
+def get_analysis_key(data, **params):
+    """Return hash of measurement data and analysis parameters.
+
+    Args:
+        data (dict): MeasCoupling.data, with 'current', 'tunes' and
+            'qname' and, optionally, 'tunes_std' and 'nr_samples'.
+        params: analysis parameters, such as coupling_resolution.
+
+    Returns:
+        str: hexadecimal digest.
+
+    """
+    hsh = _hashlib.sha1()
+    for key in ('current', 'tunes', 'tunes_std', 'nr_samples'):
+        if data.get(key) is None:
+            continue
+        hsh.update(key.encode())
+        arr = np.ascontiguousarray(data[key], dtype=float)
+        hsh.update(str(arr.shape).encode())
+        hsh.update(arr.tobytes())
+    hsh.update(str(data.get('qname', '')).encode())
+    for key in sorted(params):
+        hsh.update(f'{key}={params[key]!r};'.encode())
+    return hsh.hexdigest()
+
+
+def get_sidecar_name(fname):
+    """Return name of the analysis file of data file fname."""
+    return fname + SIDECAR_SUFFIX
+
+
+class AnalysisCache:
+    """LRU of analysis results, optionally persisted next to data files.
+
+    Results are dicts of numpy arrays.
+    """
+
+    def __init__(self, maxsize=32):
+        """."""
+        self.maxsize = maxsize
+        self._items = _OrderedDict()
+        self._lock = _Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        """."""
+        return len(self._items)
+
+    def clear(self):
+        """."""
+        with self._lock:
+            self._items.clear()
+
+    def get(self, key, fname=None):
+        """Return result of key or None if it is not cached.
+
+        Args:
+            key (str): see get_analysis_key.
+            fname (str, optional): data file. If given and the result is
+                not in memory, it is looked for in the sidecar file.
+
+        Returns:
+            dict: analysis result.
+
+        """
+        with self._lock:
+            res = self._items.get(key)
+            if res is not None:
+                self._items.move_to_end(key)
+        if res is None and fname is not None:
+            res = self._load_sidecar(key, fname)
+            if res is not None:
+                self._store(key, res)
+        with self._lock:
+            if res is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return res
+
+    def put(self, key, result, fname=None):
+        """Store result of key.
+
+        Args:
+            key (str): see get_analysis_key.
+            result (dict): analysis result.
+            fname (str, optional): data file. If given, the result is
+                also saved in its sidecar file.
+
+        """
+        result = {name: np.asarray(val) for name, val in result.items()}
+        self._store(key, result)
+        if fname is not None:
+            self._save_sidecar(key, result, fname)
+
+    def _store(self, key, result):
+        with self._lock:
+            self._items[key] = result
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    @staticmethod
+    def _load_sidecar(key, fname):
+        sidecar = get_sidecar_name(fname)
+        if not _os.path.isfile(sidecar):
+            return None
+        try:
+            with np.load(sidecar, allow_pickle=False) as npz:
+                if str(npz['key']) != key:
+                    return None
+                return {
+                    name: npz[name] for name in npz.files if name != 'key'}
+        except (OSError, ValueError, KeyError) as err:
+            _log.warning(f'Could not read {sidecar}: {err}')
+        return None
+
+    @staticmethod
+    def _save_sidecar(key, result, fname):
+        sidecar = get_sidecar_name(fname)
+        tmp = f'{sidecar}.tmp{_os.getpid()}.npz'
+        try:
+            np.savez(tmp, key=np.array(key), **result)
+            _os.replace(tmp, sidecar)
+        except OSError as err:
+            _log.warning(f'Could not save {sidecar}: {err}')
@@ -0,0 +1,160 @@
+"""Oversampling of the tunes at each point of a coupling scan."""
+
+import time as _time
+import logging as _log
+
+import numpy as np
+
+TUNE_UPDATE_PERIOD = 0.5
+
+
+class TuneReader:
+    """Read the tunes with the number of their updates seen so far.
+
+    An update is detected by a change of the timestamps of the tune PVs,
+    when the tune device gives access to them, or else of the tune
+    values. The timestamps are only compared with each other, never with
+    the clock of this computer. The older timestamp of both planes is
+    used, so an update means that both tunes were refreshed.
+    """
+
+    PROPTY = 'TuneFrac-Mon'
+
+    def __init__(self, tune):
+        """.
+
+        Args:
+            tune (siriuspy.devices.Tune): tune device.
+
+        """
+        self.tune = tune
+        self._pvs = self._get_pvs(tune)
+        self._stamp = self._get_stamp((tune.tunex, tune.tuney))
+        self.count = 0
+
+    def read(self):
+        """Return horizontal and vertical tunes and the update count.
+
+        Readings whose count is larger than the one read after a change,
+        such as of a current setpoint, were updated after the change.
+        """
+        tunes = (self.tune.tunex, self.tune.tuney)
+        stamp = self._get_stamp(tunes)
+        if stamp != self._stamp:
+            self._stamp = stamp
+            self.count += 1
+        return tunes, self.count
+
+    def _get_stamp(self, tunes):
+        if self._pvs is not None:
+            stamps = [pvo.timestamp for pvo in self._pvs]
+            if None not in stamps:
+                return min(stamps)
+        return tunes
+
+    @classmethod
+    def _get_pvs(cls, tune):
+        try:
+            return [
+                dev.pv_object(cls.PROPTY)
+                for dev in (tune.dev_tune_frac_h, tune.dev_tune_frac_v)]
+        except (AttributeError, KeyError, TypeError):
+            return None
+
+
+class RunningStats:
+    """Streaming mean and standard deviation (Welford's algorithm).
+
+    Values are accumulated without storing them, unless keep is True.
+    """
+
+    def __init__(self, size=2, keep=False):
+        """.
+
+        Args:
+            size (int, optional): number of components of each value.
+                Defaults to 2.
+            keep (bool, optional): whether to store the values. Defaults
+                to False.
+
+        """
+        self.count = 0
+        self.mean = np.zeros(size)
+        self._m2 = np.zeros(size)
+        self.samples = [] if keep else None
+
+    def update(self, value):
+        """Add value."""
+        value = np.asarray(value, dtype=float)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        if self.samples is not None:
+            self.samples.append(value)
+
+    @property
+    def var(self):
+        """Sample variance, zero for less than two values."""
+        if self.count < 2:
+            return np.zeros_like(self._m2)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        """Sample standard deviation."""
+        return np.sqrt(self.var)
+
+    @property
+    def error(self):
+        """Standard error of the mean."""
+        return self.std / np.sqrt(max(self.count, 1))
+
+
+def sample_tunes(read_tunes, nr_samples, timeout, stop_evt=None, keep=False,
+                 period=0.02):
+    """Read the tunes at several updates.
+
+    Each reading, including the first, is taken at a new update of the
+    tunes, so the same value is never read twice, nor a value read before
+    the sampling, which would underestimate the errors.
+
+    Args:
+        read_tunes (callable): returns horizontal and vertical tunes and
+            the number of their updates, as TuneReader.read.
+        nr_samples (int): number of readings.
+        timeout (float): maximum time to wait for each update [s]. If it
+            expires, the sampling stops with fewer readings, but the last
+            tunes are read if there is no reading at all.
+        stop_evt (threading.Event, optional): interrupts the sampling
+            when set. Defaults to None.
+        keep (bool, optional): whether to keep the readings. Defaults to
+            False.
+        period (float, optional): polling period [s]. Defaults to 0.02.
+
+    Returns:
+        RunningStats: statistics of the readings.
+
+    """
+    stats = RunningStats(size=2, keep=keep)
+    tunes, last = read_tunes()
+    while stats.count < nr_samples:
+        tini = _time.monotonic()
+        while True:
+            if stop_evt is None:
+                _time.sleep(period)
+            elif stop_evt.wait(period):
+                return stats
+            tunes, count = read_tunes()
+            if count != last:
+                break
+            if _time.monotonic() - tini > timeout:
+                _log.warning(
+                    f'Tunes not updated in {timeout:.1f} s, '
+                    f'{stats.count:d} of {nr_samples:d} readings taken.')
+                if not stats.count:
+                    stats.update(tunes)
+                return stats
+        last = count
+        stats.update(tunes)
+    return stats
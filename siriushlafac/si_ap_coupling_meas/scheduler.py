@@ -0,0 +1,113 @@
+"""Queue of coupling measurements of several quadrupole families."""
+
+import numpy as np
+
+QUEUED, RUNNING, DONE, STOPPED, FAILED = \
+    'queued', 'running', 'done', 'stopped', 'failed'
+
+
+class MeasScheduler:
+    """List of scan settings measured one after the other.
+
+    Each job is a dict with the scan 'settings', see CouplingScanWorker,
+    its 'status', the number of points measured, 'nr_done', the scan
+    'duration' [s], the fitted 'coupling' and 'coupling_error' and the
+    file name, 'fname', where it was saved.
+    """
+
+    # Time spent in each point besides time_wait, used in the estimates
+    # before the first job is done [s].
+    POINT_OVERHEAD = 1.0
+
+    def __init__(self):
+        """."""
+        self.jobs = []
+
+    @property
+    def current(self):
+        """Index of the running job or None."""
+        for idx, job in enumerate(self.jobs):
+            if job['status'] == RUNNING:
+                return idx
+        return None
+
+    def add(self, settings):
+        """Add job at the end of the queue."""
+        self.jobs.append(dict(
+            settings=dict(settings), status=QUEUED, nr_done=0,
+            duration=np.nan, coupling=np.nan, coupling_error=np.nan,
+            fname=''))
+
+    def remove(self, idx):
+        """Remove job, unless it is running."""
+        if self.jobs[idx]['status'] != RUNNING:
+            del self.jobs[idx]
+
+    def clear(self):
+        """Remove all jobs, except the running one."""
+        self.jobs = [job for job in self.jobs if job['status'] == RUNNING]
+
+    def requeue(self):
+        """Queue again stopped and failed jobs."""
+        for job in self.jobs:
+            if job['status'] in (STOPPED, FAILED):
+                job.update(status=QUEUED, nr_done=0)
+
+    def start_next(self):
+        """Mark next queued job as running and return its index or None."""
+        for idx, job in enumerate(self.jobs):
+            if job['status'] == QUEUED:
+                job['status'] = RUNNING
+                return idx
+        return None
+
+    def point_done(self):
+        """Count a point of the running job."""
+        idx = self.current
+        if idx is not None:
+            self.jobs[idx]['nr_done'] += 1
+
+    def finish(self, status, duration, result=None, fname=''):
+        """Finish running job.
+
+        Args:
+            status (str): DONE, STOPPED or FAILED.
+            duration (float): scan duration [s].
+            result (dict, optional): fitting result with 'coupling' and
+                'coupling_error'. Defaults to None.
+            fname (str, optional): file where data was saved.
+
+        """
+        idx = self.current
+        if idx is None:
+            return
+        job = self.jobs[idx]
+        job.update(status=status, duration=duration, fname=fname)
+        if result is not None:
+            job.update(
+                coupling=result['coupling'],
+                coupling_error=result['coupling_error'])
+
+    def get_time_per_point(self, time_wait):
+        """Estimate time of a point from the finished jobs [s]."""
+        ovhs = [
+            job['duration']/job['nr_done'] - job['settings']['time_wait']
+            for job in self.jobs
+            if job['status'] == DONE and job['nr_done']]
+        ovh = np.mean(ovhs) if ovhs else self.POINT_OVERHEAD
+        return time_wait + max(ovh, 0)
+
+    def estimate_remaining(self):
+        """Estimate time to finish the queue [s].
+
+        Settling detection and adaptive scans may measure faster or less
+        points, so this is an upper bound for them.
+        """
+        total = 0.0
+        for job in self.jobs:
+            if job['status'] not in (QUEUED, RUNNING):
+                continue
+            sett = job['settings']
+            tpp = self.get_time_per_point(sett['time_wait'])
+            total += max(sett['nr_points'] - job['nr_done'], 0)*tpp
+        return total
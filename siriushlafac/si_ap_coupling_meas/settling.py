@@ -0,0 +1,109 @@
+"""Detection of the settling of quadrupole current and tunes."""
+
+import time as _time
+from collections import deque as _deque
+
+import numpy as np
+
+from .sampling import TUNE_UPDATE_PERIOD
+
+
+class SettlingDetector:
+    """Wait until current readback and tunes are stable.
+
+    The readings are polled periodically and they are considered settled
+    when, during the last window seconds:
+        - the current readback is within curr_tol of the setpoint;
+        - the spread of the current readback is smaller than curr_tol;
+        - the tunes were updated at least min_updates times after the
+            setpoint change and the spread of each tune over these
+            updates is smaller than tune_tol.
+    The tunes usually update more slowly than they are polled, so a
+    stable reading of a tune that was not updated yet would be taken
+    for a settled one. The window is at least tune_period long, so it
+    holds the required updates.
+    """
+
+    def __init__(
+            self, read_current, read_tunes, curr_tol=1e-3, tune_tol=1e-4,
+            window=0.5, period=0.05, tune_period=TUNE_UPDATE_PERIOD,
+            min_updates=2):
+        """.
+
+        Args:
+            read_current (callable): returns the current readback [A].
+            read_tunes (callable): returns horizontal and vertical tunes
+                and the number of their updates, as
+                sampling.TuneReader.read.
+            curr_tol (float, optional): current tolerance [A]. Defaults to
+                1e-3.
+            tune_tol (float, optional): tune tolerance. Defaults to 1e-4.
+            window (float, optional): time the readings must be stable
+                [s]. Defaults to 0.5.
+            period (float, optional): polling period [s]. Defaults to
+                0.05.
+            tune_period (float, optional): update period of the tunes
+                [s]. Defaults to sampling.TUNE_UPDATE_PERIOD.
+            min_updates (int, optional): number of tune updates in the
+                window. Defaults to 2.
+
+        """
+        self.read_current = read_current
+        self.read_tunes = read_tunes
+        self.curr_tol = curr_tol
+        self.tune_tol = tune_tol
+        self.window = window
+        self.period = period
+        self.tune_period = tune_period
+        self.min_updates = min_updates
+
+    def wait(self, setpoint, timeout, stop_evt=None):
+        """Wait for settling after the current setpoint change.
+
+        Args:
+            setpoint (float): current setpoint [A].
+            timeout (float): maximum waiting time [s].
+            stop_evt (threading.Event, optional): interrupts the wait when
+                set. Defaults to None.
+
+        Returns:
+            settled (bool): whether the readings settled before timeout.
+            elapsed (float): waiting time [s].
+
+        """
+        tini = _time.monotonic()
+        window = max(self.window, self.tune_period)
+        samples = _deque()
+        count0 = None
+        while True:
+            now = _time.monotonic()
+            elapsed = now - tini
+            if elapsed >= timeout:
+                return False, elapsed
+            (tunex, tuney), count = self.read_tunes()
+            if count0 is None:
+                count0 = count
+            samples.append((now, self.read_current(), tunex, tuney, count))
+            while samples[0][0] < now - window:
+                samples.popleft()
+            if elapsed >= window and \
+                    self._isstable(samples, setpoint, count0):
+                return True, elapsed
+            wait = min(self.period, timeout - elapsed)
+            if stop_evt is not None:
+                if stop_evt.wait(wait):
+                    return False, _time.monotonic() - tini
+            else:
+                _time.sleep(wait)
+
+    def _isstable(self, samples, setpoint, count0):
+        _, curr, tunex, tuney, count = np.array(samples).T
+        if np.max(np.abs(curr - setpoint)) > self.curr_tol:
+            return False
+        if np.ptp(curr) > self.curr_tol:
+            return False
+        fresh = count > count0
+        if np.unique(count[fresh]).size < self.min_updates:
+            return False
+        return np.ptp(tunex[fresh]) <= self.tune_tol and \
+            np.ptp(tuney[fresh]) <= self.tune_tol
@@ -0,0 +1,409 @@
+"""Widgets of the Application Interface."""
+
+import os as _os
+import time as _time
+
+import numpy as np
+import matplotlib.pyplot as mplt
+
+from qtpy.QtCore import Qt, Signal, QSortFilterProxyModel
+from qtpy.QtGui import QStandardItemModel, QStandardItem
+from qtpy.QtWidgets import QGroupBox, QGridLayout, QLabel, QLineEdit, \
+    QComboBox, QPushButton, QProgressBar, QTableView, QAbstractItemView, \
+    QHeaderView, QTableWidget, QTableWidgetItem, QWidget, QSpinBox
+
+from siriushla.widgets import MatplotlibWidget
+
+from .scheduler import RUNNING
+from .worker import TaskWorker
+
+
+class _CatalogFilter(QSortFilterProxyModel):
+    """Filter rows by quadrupole family and by a text in any column."""
+
+    FAMILY_COL = 1
+
+    def __init__(self, parent=None):
+        """."""
+        super().__init__(parent)
+        self.family = ''
+        self.text = ''
+
+    def set_filter(self, family, text):
+        """."""
+        self.family = family
+        self.text = text.lower()
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, row, parent):
+        """."""
+        model = self.sourceModel()
+        if self.family and model.index(
+                row, self.FAMILY_COL, parent).data() != self.family:
+            return False
+        if not self.text:
+            return True
+        return any(
+            self.text in str(model.index(row, col, parent).data()).lower()
+            for col in range(model.columnCount()))
+
+
+class CatalogWidget(QGroupBox):
+    """List of the measurements of a CouplingCatalog.
+
+    The catalog is updated in a thread and the table is filled at the
+    end, so filtering and sorting do not access the files.
+    """
+
+    fileSelected = Signal(str)
+    COLUMNS = ('Date', 'Family', '# Points', 'Coupling [%]', 'File')
+
+    def __init__(self, catalog, families=(), parent=None):
+        """."""
+        super().__init__('Measurement Catalog', parent)
+        self.catalog = catalog
+        self._worker = None
+
+        self.cbb_family = QComboBox(self)
+        self.cbb_family.addItem('All')
+        self.cbb_family.addItems(families)
+        self.cbb_family.currentTextChanged.connect(self._apply_filter)
+        self.led_filter = QLineEdit(self)
+        self.led_filter.setPlaceholderText('Filter by date or file...')
+        self.led_filter.textChanged.connect(self._apply_filter)
+        self.pusb_update = QPushButton('Update', self)
+        self.pusb_update.setToolTip(
+            'Look for new files in ' + self.catalog.root)
+        self.pusb_update.clicked.connect(self.update_catalog)
+        self.pbar = QProgressBar(self)
+        self.pbar.setVisible(False)
+        self.lab_status = QLabel('', self)
+
+        self.model = QStandardItemModel(0, len(self.COLUMNS), self)
+        self.model.setHorizontalHeaderLabels(self.COLUMNS)
+        self.proxy = _CatalogFilter(self)
+        self.proxy.setSourceModel(self.model)
+        self.table = QTableView(self)
+        self.table.setModel(self.proxy)
+        self.table.setSortingEnabled(True)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        self.table.doubleClicked.connect(self._select)
+        self.pusb_load = QPushButton('Load Selected', self)
+        self.pusb_load.clicked.connect(
+            lambda: self._select(self.table.currentIndex()))
+
+        lay = QGridLayout(self)
+        lay.addWidget(QLabel('Family', self), 0, 0)
+        lay.addWidget(self.cbb_family, 0, 1)
+        lay.addWidget(self.led_filter, 0, 2)
+        lay.addWidget(self.pusb_update, 0, 3)
+        lay.addWidget(self.table, 1, 0, 1, 4)
+        lay.addWidget(self.pbar, 2, 0, 1, 2)
+        lay.addWidget(self.lab_status, 2, 2)
+        lay.addWidget(self.pusb_load, 2, 3)
+        lay.setColumnStretch(2, 2)
+
+        self._fill(self.catalog.entries)
+
+    @property
+    def isupdating(self):
+        """."""
+        return self._worker is not None and self._worker.isRunning()
+
+    def update_catalog(self):
+        """Read new and modified files in a thread."""
+        if self.isupdating:
+            return
+        self.pusb_update.setEnabled(False)
+        self.pbar.setValue(0)
+        self.pbar.setVisible(True)
+        self.lab_status.setText('Updating...')
+        self._worker = TaskWorker(self.catalog.update, parent=self)
+        self._worker.progressChanged.connect(self._update_progress)
+        self._worker.done.connect(self._fill)
+        self._worker.failed.connect(
+            lambda err: self.lab_status.setText('Update failed: ' + err))
+        self._worker.finished.connect(self._update_finished)
+        self._worker.start()
+
+    def wait(self):
+        """Wait for catalog update to finish."""
+        if self._worker is not None:
+            self._worker.wait()
+
+    def _update_progress(self, done, total):
+        self.pbar.setMaximum(total)
+        self.pbar.setValue(done)
+
+    def _update_finished(self):
+        self.pusb_update.setEnabled(True)
+        self.pbar.setVisible(False)
+
+    def _fill(self, entries):
+        self.table.setSortingEnabled(False)
+        self.model.removeRows(0, self.model.rowCount())
+        for ent in entries:
+            date = QStandardItem(_time.strftime(
+                '%Y-%m-%d %H:%M:%S', _time.localtime(ent['timestamp'])))
+            points = QStandardItem()
+            points.setData(ent['nr_points'], Qt.DisplayRole)
+            coup = QStandardItem()
+            coup.setData(round(ent['coupling']*100, 3), Qt.DisplayRole)
+            coup.setToolTip(f'± {ent["coupling_error"]*100:.3f} %')
+            fil = QStandardItem(_os.path.basename(ent['path']))
+            fil.setToolTip(ent['path'])
+            fil.setData(ent['path'], Qt.UserRole)
+            self.model.appendRow(
+                [date, QStandardItem(ent['family']), points, coup, fil])
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, Qt.DescendingOrder)
+        self.lab_status.setText(f'{len(entries):d} measurements')
+
+    def _apply_filter(self, *_):
+        family = self.cbb_family.currentText()
+        self.proxy.set_filter(
+            '' if family == 'All' else family, self.led_filter.text())
+
+    def _select(self, index):
+        if not index.isValid():
+            return
+        col = len(self.COLUMNS) - 1
+        path = index.sibling(index.row(), col).data(Qt.UserRole)
+        if path:
+            self.fileSelected.emit(path)
+
+
+class MeasQueueWidget(QGroupBox):
+    """Summary table and controls of a MeasScheduler.
+
+    The widget does not run the measurements: it emits signals handled
+    by the window, which calls update_table when the queue changes.
+    """
+
+    addRequested = Signal(bool)
+    runRequested = Signal()
+    stopRequested = Signal()
+    COLUMNS = (
+        'Family', '# Points', 'Wait [s]', 'Mode', 'Status', 'Coupling [%]',
+        'Duration [s]')
+
+    def __init__(self, scheduler, parent=None):
+        """."""
+        super().__init__('Measurement Queue', parent)
+        self.scheduler = scheduler
+
+        self.table = QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setSectionResizeMode(
+            QHeaderView.ResizeToContents)
+        self.table.horizontalHeader().setStretchLastSection(True)
+
+        pusb_add = QPushButton('Add', self)
+        pusb_add.setToolTip('Add family and settings of Measurement Control.')
+        pusb_add.clicked.connect(lambda: self.addRequested.emit(False))
+        pusb_addall = QPushButton('Add All Families', self)
+        pusb_addall.setToolTip(
+            'Add all families with the settings of Measurement Control.')
+        pusb_addall.clicked.connect(lambda: self.addRequested.emit(True))
+        pusb_rem = QPushButton('Remove', self)
+        pusb_rem.clicked.connect(self._remove_selected)
+        pusb_clear = QPushButton('Clear', self)
+        pusb_clear.clicked.connect(self._clear)
+        self.pusb_run = QPushButton('Run Queue', self)
+        self.pusb_run.clicked.connect(self.runRequested.emit)
+        pusb_stop = QPushButton('Stop Queue', self)
+        pusb_stop.clicked.connect(self.stopRequested.emit)
+        self.lab_remaining = QLabel('', self)
+
+        lay = QGridLayout(self)
+        lay.addWidget(self.table, 0, 0, 1, 4)
+        lay.addWidget(pusb_add, 1, 0)
+        lay.addWidget(pusb_addall, 1, 1)
+        lay.addWidget(pusb_rem, 1, 2)
+        lay.addWidget(pusb_clear, 1, 3)
+        lay.addWidget(self.pusb_run, 2, 0)
+        lay.addWidget(pusb_stop, 2, 1)
+        lay.addWidget(self.lab_remaining, 2, 2, 1, 2)
+
+    def update_table(self):
+        """Show jobs of the scheduler and the remaining time."""
+        jobs = self.scheduler.jobs
+        self.table.setRowCount(len(jobs))
+        for row, job in enumerate(jobs):
+            sett = job['settings']
+            mode = 'adaptive' if sett.get('adaptive') else 'uniform'
+            if sett.get('settling'):
+                mode += ', settling'
+            coup = ''
+            if job['coupling'] == job['coupling']:
+                coup = f'{job["coupling"]*100:.3f} ± ' + \
+                    f'{job["coupling_error"]*100:.3f}'
+            dur = ''
+            if job['duration'] == job['duration']:
+                dur = f'{job["duration"]:.0f}'
+            status = job['status']
+            if status == RUNNING:
+                status += f' ({job["nr_done"]:d})'
+            vals = (
+                sett['quadfam_name'], str(sett['nr_points']),
+                f'{sett["time_wait"]:.1f}', mode, status, coup, dur)
+            for col, val in enumerate(vals):
+                item = QTableWidgetItem(val)
+                if col == 0 and job['fname']:
+                    item.setToolTip(job['fname'])
+                self.table.setItem(row, col, item)
+
+        rem = self.scheduler.estimate_remaining()
+        self.lab_remaining.setText(
+            f'Remaining: ~{rem//60:.0f} min {rem % 60:02.0f} s' if rem
+            else '')
+        self.pusb_run.setEnabled(self.scheduler.current is None)
+
+    def _remove_selected(self):
+        rows = sorted(
+            {idx.row() for idx in self.table.selectedIndexes()},
+            reverse=True)
+        for row in rows:
+            self.scheduler.remove(row)
+        self.update_table()
+
+    def _clear(self):
+        self.scheduler.clear()
+        self.update_table()
+
+
+class BootstrapWidget(QWidget):
+    """Bootstrap distribution of the coupling.
+
+    Shows the histogram of the couplings fitted to the resamples, with
+    the confidence interval and the least squares result. Runs are done
+    by a bootstrap.Bootstrapper in a TaskWorker thread and the result is
+    also emitted by bootstrapDone, to draw the confidence bands.
+    """
+
+    bootstrapDone = Signal(dict)
+    CONF_LEVELS = ('68', '90', '95')
+
+    def __init__(self, bootstrapper, parent=None):
+        """."""
+        super().__init__(parent=parent)
+        self.bootstrapper = bootstrapper
+        self._data = None
+        self._lsq = None
+        self._worker = None
+        self.setWindowTitle('Coupling Bootstrap')
+        self._setupui()
+
+    def _setupui(self):
+        self.fig = mplt.figure(figsize=(6, 4))
+        self.axes = self.fig.add_subplot(111)
+        self.axes.set_xlabel('Coupling [%]')
+        self.axes.set_ylabel('# Resamples')
+        fig_wid = MatplotlibWidget(self.fig, parent=self)
+
+        self.wid_nr_boot = QSpinBox(self)
+        self.wid_nr_boot.setRange(100, 100000)
+        self.wid_nr_boot.setSingleStep(1000)
+        self.wid_nr_boot.setValue(4000)
+        self.cbb_conf = QComboBox(self)
+        self.cbb_conf.addItems(self.CONF_LEVELS)
+        self.pusb_run = QPushButton('Run', self)
+        self.pusb_run.clicked.connect(self.start_bootstrap)
+        self.pbar = QProgressBar(self)
+        self.lab_status = QLabel('', self)
+
+        lay = QGridLayout(self)
+        lay.addWidget(fig_wid, 0, 0, 1, 6)
+        lay.addWidget(QLabel('# Resamples', self), 1, 0)
+        lay.addWidget(self.wid_nr_boot, 1, 1)
+        lay.addWidget(QLabel('Confidence [%]', self), 1, 2)
+        lay.addWidget(self.cbb_conf, 1, 3)
+        lay.addWidget(self.pusb_run, 1, 4)
+        lay.addWidget(self.pbar, 1, 5)
+        lay.addWidget(self.lab_status, 2, 0, 1, 6)
+
+    @property
+    def isrunning(self):
+        """."""
+        return self._worker is not None and self._worker.isRunning()
+
+    def set_data(self, curr, tune1, tune2, params, error, sigma1=None,
+                 sigma2=None):
+        """Set measurement and least squares result and run bootstrap.
+
+        Args:
+            curr (numpy.ndarray): quadrupole currents.
+            tune1 (numpy.ndarray): upper mode tunes.
+            tune2 (numpy.ndarray): lower mode tunes.
+            params (numpy.ndarray): fitted parameters.
+            error (float): least squares error of the coupling.
+            sigma1 (numpy.ndarray, optional): errors of tune1.
+            sigma2 (numpy.ndarray, optional): errors of tune2.
+
+        """
+        self._data = dict(
+            curr=curr, tune1=tune1, tune2=tune2, params0=params,
+            sigma1=sigma1, sigma2=sigma2)
+        self._lsq = (abs(params[-1]), error)
+        self.start_bootstrap()
+
+    def start_bootstrap(self):
+        """."""
+        if self._data is None or self.isrunning:
+            return
+        nr_boot = self.wid_nr_boot.value()
+        conf = float(self.cbb_conf.currentText())/100
+        data = self._data
+        self.pusb_run.setEnabled(False)
+        self.lab_status.setText('Running...')
+        self._worker = TaskWorker(
+            lambda progress: self.bootstrapper.run(
+                nr_boot=nr_boot, conf=conf, progress=progress, **data),
+            parent=self)
+        self._worker.progressChanged.connect(self._update_progress)
+        self._worker.done.connect(self._update_plot)
+        self._worker.failed.connect(
+            lambda err: self.lab_status.setText('Bootstrap failed: ' + err))
+        self._worker.finished.connect(lambda: self.pusb_run.setEnabled(True))
+        self._worker.start()
+
+    def wait(self):
+        """Wait for running bootstrap to finish."""
+        if self._worker is not None:
+            self._worker.wait()
+
+    def _update_progress(self, done, total):
+        self.pbar.setMaximum(total)
+        self.pbar.setValue(done)
+
+    def _update_plot(self, res):
+        coup = res['coupling']*100
+        low, high = res['interval']*100
+        lsq, err = self._lsq[0]*100, self._lsq[1]*100
+        self.axes.clear()
+        self.axes.hist(coup, bins=min(100, max(10, coup.size//40)),
+                       color='C0', alpha=0.7, label='bootstrap')
+        self.axes.axvspan(
+            low, high, color='C0', alpha=0.2,
+            label=f'{res["conf"]*100:.0f} % interval')
+        self.axes.axvline(lsq, color='k', label='least squares')
+        self.axes.axvspan(lsq - err, lsq + err, color='k', alpha=0.1)
+        self.axes.set_xlabel('Coupling [%]')
+        self.axes.set_ylabel('# Resamples')
+        self.axes.legend(loc='best')
+        self.fig.canvas.draw_idle()
+        self.lab_status.setText(
+            f'Coupling: {np.median(coup):.3f} [{low:.3f}, {high:.3f}] %, '
+            f'least squares {lsq:.3f} ± {err:.3f} %; '
+            f'{res["nr_failed"]:d} of {res["nr_boot"]:d} fits failed; '
+            f'{res["boot_time"]:.2f} s.')
+        self.bootstrapDone.emit(res)
@@ -0,0 +1,247 @@
+"""Measurement worker thread of the Application Interface."""
+
+import time as _time
+import logging as _log
+from threading import Event as _Event
+
+import numpy as np
+
+from qtpy.QtCore import QThread, Signal
+
+from siriuspy.devices import PowerSupply
+from siriuspy.namesys import SiriusPVName
+
+from .fitting import IncrementalCouplingFit, suggest_current
+from .sampling import sample_tunes, TuneReader
+from .settling import SettlingDetector
+
+
+class CouplingScanWorker(QThread):
+    """Thread scanning a quadrupole family and measuring the tunes.
+
+    The scan uses the quadrupole and tune devices of MeasCoupling. Each
+    point is emitted as soon as it is measured and the coupling is refit
+    with all points measured so far. At the end, the initial current is
+    restored and the data is stored in MeasCoupling.data, so it can be
+    processed and saved as a regular measurement.
+
+    In adaptive mode, nr_coarse points are measured uniformly in the
+    current interval and the next ones are placed around the tune
+    crossing estimated by the fitting, until the coupling error is
+    smaller than target_error or nr_points are measured.
+
+    If settling is enabled, each point is measured as soon as the
+    current readback is stable and the tunes are stable over updates
+    after the current change, with time_wait as the maximum waiting
+    time.
+
+    With nr_samples > 1, the tunes of each point are read at nr_samples
+    updates of the tune PVs after the wait, waiting at most
+    sample_timeout seconds for each update. Their mean and
+    standard deviation are stored in 'tunes' and 'tunes_std' of the data
+    and the fitting is weighted by the standard errors of the mean.
+    """
+
+    DEFAULT_NR_COARSE = 5
+    DEFAULT_SAMPLE_TIMEOUT = 2.0
+
+    pointMeasured = Signal(int, float, float, float, float, float)
+    fitUpdated = Signal(dict)
+    scanFinished = Signal(bool)
+
+    def __init__(self, meas_coup, settings, parent=None):
+        """.
+
+        Args:
+            meas_coup (MeasCoupling): measurement object.
+            settings (dict): values of 'quadfam_name', 'nr_points',
+                'time_wait', 'neg_percent' and 'pos_percent' to be set in
+                meas_coup.params. Optionally 'adaptive' (bool),
+                'target_error', the coupling error to stop the adaptive
+                scan, and 'nr_coarse'; 'settling' (bool), 'curr_tol' and
+                'tune_tol', see SettlingDetector; 'nr_samples',
+                'sample_timeout' and 'keep_samples', whether to store the
+                readings in 'tunes_samples' of the data.
+            parent (QObject, optional): Defaults to None.
+
+        """
+        super().__init__(parent)
+        self.meas_coup = meas_coup
+        self.settings = dict(settings)
+        self.adaptive = self.settings.pop('adaptive', False)
+        self.target_error = self.settings.pop('target_error', 0.0)
+        self.nr_coarse = self.settings.pop(
+            'nr_coarse', self.DEFAULT_NR_COARSE)
+        self.settling = self.settings.pop('settling', False)
+        self.settling_kws = {
+            key: self.settings.pop(key) for key in ('curr_tol', 'tune_tol')
+            if key in self.settings}
+        self.settle_times = []
+        self.nr_samples = max(int(self.settings.pop('nr_samples', 1)), 1)
+        self.sample_timeout = self.settings.pop(
+            'sample_timeout', self.DEFAULT_SAMPLE_TIMEOUT)
+        self.keep_samples = self.settings.pop('keep_samples', False)
+        self.fitter = IncrementalCouplingFit()
+        self._stop_evt = _Event()
+
+    def stop(self):
+        """Interrupt scan, restoring the initial current."""
+        self._stop_evt.set()
+
+    @property
+    def stopped(self):
+        """Whether the scan was interrupted by stop."""
+        return self._stop_evt.is_set()
+
+    def run(self):
+        """."""
+        completed = False
+        try:
+            completed = self._do_scan()
+        except Exception as err:
+            _log.error('Problem measuring coupling.')
+            _log.error(str(err))
+        self.scanFinished.emit(completed)
+
+    def _get_quad(self):
+        params = self.meas_coup.params
+        quad = self.meas_coup.devices['quad']
+        if SiriusPVName(quad.devname).dev != params.quadfam_name:
+            quad = PowerSupply('SI-Fam:PS-' + params.quadfam_name)
+            self.meas_coup.devices['quad'] = quad
+        return quad
+
+    def _do_scan(self):
+        params = self.meas_coup.params
+        for attr, val in self.settings.items():
+            setattr(params, attr, val)
+        self.meas_coup.wait_for_connection()
+        quad = self._get_quad()
+        quad.wait_for_connection()
+        tune = self.meas_coup.devices['tune']
+
+        curr0 = quad.current
+        lims = curr0*(1 - params.neg_percent), curr0*(1 + params.pos_percent)
+        gen = self._adaptive_currents if self.adaptive else \
+            self._uniform_currents
+        reader = TuneReader(tune)
+        detector = SettlingDetector(
+            lambda: quad.current_mon, reader.read,
+            **self.settling_kws) if self.settling else None
+        meas_currs, tunes, stds, nrs, samples = [], [], [], [], []
+        self.settle_times = []
+        _log.info(f'Scanning {quad.devname:s} around {curr0:.4f} A.')
+        tini = _time.time()
+        try:
+            for idx, curr in enumerate(gen(*lims, params.nr_points)):
+                quad.current = curr
+                settled, settle_time = self._wait_settling(
+                    detector, curr, params.time_wait)
+                if self._stop_evt.is_set():
+                    break
+                stats = sample_tunes(
+                    reader.read, self.nr_samples, self.sample_timeout,
+                    stop_evt=self._stop_evt,
+                    keep=self.keep_samples)
+                if self._stop_evt.is_set():
+                    break
+                self.settle_times.append(settle_time)
+                (tunex, tuney), (stdx, stdy) = stats.mean, stats.std
+                meas_currs.append(curr)
+                tunes.append((tunex, tuney))
+                stds.append((stdx, stdy))
+                nrs.append(stats.count)
+                if self.keep_samples:
+                    samples.append(np.array(stats.samples))
+                _log.info(
+                    f'{idx+1:02d}/{params.nr_points:02d}: {curr:.4f} A, '
+                    f'tunes {tunex:.4f}, {tuney:.4f}, '
+                    + (f'settled in {settle_time:.2f} s' if settled else
+                       f'waited {settle_time:.2f} s'))
+                errx, erry = stats.error
+                self.pointMeasured.emit(idx, curr, tunex, tuney, errx, erry)
+                if stats.count > 1 and errx > 0 and erry > 0:
+                    res = self.fitter.add_point(
+                        curr, tunex, tuney, sigma1=errx, sigma2=erry)
+                else:
+                    res = self.fitter.add_point(curr, tunex, tuney)
+                if res is not None:
+                    self.fitUpdated.emit(res)
+        finally:
+            quad.current = curr0
+            _log.info(f'Restored {quad.devname:s} to {curr0:.4f} A.')
+
+        data = self.meas_coup.data
+        for key in ('tunes_std', 'nr_samples', 'tunes_samples'):
+            data.pop(key, None)
+        data.update(
+            timestamp=_time.time(), qname=quad.devname,
+            current=np.array(meas_currs), tunes=np.array(tunes).reshape(-1, 2))
+        if self.nr_samples > 1:
+            data.update(
+                tunes_std=np.array(stds).reshape(-1, 2),
+                nr_samples=np.array(nrs))
+            if self.keep_samples:
+                data['tunes_samples'] = samples
+        completed = not self.stopped
+        _log.info(
+            ('Finished' if completed else 'Stopped') +
+            f' after {len(meas_currs):d} points in '
+            f'{_time.time()-tini:.1f} s.')
+        if self.settling and self.settle_times:
+            saved = len(self.settle_times)*params.time_wait - \
+                sum(self.settle_times)
+            _log.info(
+                f'Mean settling time {np.mean(self.settle_times):.2f} s, '
+                f'{saved:.1f} s saved.')
+        return completed
+
+    def _wait_settling(self, detector, setpoint, time_wait):
+        if detector is None:
+            tini = _time.monotonic()
+            self._stop_evt.wait(time_wait)
+            return False, _time.monotonic() - tini
+        return detector.wait(setpoint, time_wait, stop_evt=self._stop_evt)
+
+    @staticmethod
+    def _uniform_currents(curr_min, curr_max, nr_points):
+        yield from np.linspace(curr_min, curr_max, nr_points)
+
+    def _adaptive_currents(self, curr_min, curr_max, nr_points):
+        nr_coarse = min(max(self.nr_coarse, 3), nr_points)
+        yield from np.linspace(curr_min, curr_max, nr_coarse)
+        for _ in range(nr_points - nr_coarse):
+            res = self.fitter.result
+            if res is not None and res['coupling_error'] <= self.target_error:
+                _log.info(
+                    f'Target error reached: {res["coupling"]*100:.3f} '
+                    f'+- {res["coupling_error"]*100:.3f} %')
+                return
+            yield suggest_current(res, self.fitter.curr, curr_min, curr_max)
+
+
+class TaskWorker(QThread):
+    """Thread running a function out of the GUI thread.
+
+    The function receives a progress callback, called with the number of
+    steps done and the total, and its return value is emitted by done.
+    """
+
+    done = Signal(object)
+    failed = Signal(str)
+    progressChanged = Signal(int, int)
+
+    def __init__(self, func, parent=None):
+        """."""
+        super().__init__(parent)
+        self._func = func
+
+    def run(self):
+        """."""
+        try:
+            res = self._func(self.progressChanged.emit)
+        except Exception as err:
+            _log.error(str(err))
+            self.failed.emit(str(err))
+            return
+        self.done.emit(res)
@@ -0,0 +1,58 @@
+"""Widgets shared by the applications."""
+
+from qtpy.QtCore import QTimer
+from qtpy.QtWidgets import QWidget, QGridLayout, QLabel, QCheckBox, \
+    QPushButton, QFileDialog
+
+
+class StageTimerWidget(QWidget):
+    """Enable a StageTimer and show its statistics periodically."""
+
+    def __init__(self, timer, parent=None, update_period=1000):
+        """."""
+        super().__init__(parent=parent)
+        self.timer = timer
+        self._last_dir = ''
+
+        self.chb_enbl = QCheckBox('Measure Latency', self)
+        self.chb_enbl.setChecked(self.timer.enabled)
+        self.chb_enbl.toggled.connect(self._set_enabled)
+        pusb_dump = QPushButton('Dump', self)
+        pusb_dump.setToolTip('Log statistics and save them to a JSON file.')
+        pusb_dump.clicked.connect(self._dump)
+        pusb_clear = QPushButton('Clear', self)
+        pusb_clear.clicked.connect(self.timer.clear)
+        self.lab_stats = QLabel('', self)
+        self.lab_stats.setStyleSheet('font-family: monospace;')
+
+        lay = QGridLayout(self)
+        lay.setContentsMargins(0, 0, 0, 0)
+        lay.addWidget(self.chb_enbl, 0, 0)
+        lay.addWidget(pusb_dump, 0, 1)
+        lay.addWidget(pusb_clear, 0, 2)
+        lay.addWidget(self.lab_stats, 1, 0, 1, 3)
+        self.lab_stats.setVisible(self.timer.enabled)
+
+        self._qtimer = QTimer(self)
+        self._qtimer.timeout.connect(self._update_stats)
+        self._qtimer.start(update_period)
+
+    def _set_enabled(self, value):
+        self.timer.enabled = value
+        self.lab_stats.setVisible(value)
+
+    def _update_stats(self):
+        if not self.timer.enabled:
+            return
+        self.lab_stats.setText(self.timer.format_stats())
+
+    def _dump(self):
+        fname, _ = QFileDialog.getSaveFileName(
+            self, caption='Save Latency Statistics',
+            directory=self._last_dir, filter='JSON Files (*.json)')
+        if not fname:
+            self.timer.dump()
+            return
+        fname += '' if fname.endswith('.json') else '.json'
+        self._last_dir = fname
+        self.timer.dump(fname)